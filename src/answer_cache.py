@@ -0,0 +1,254 @@
+import os
+import sys
+import json
+import time
+import sqlite3
+import argparse
+import threading
+from typing import Dict, Any, Optional, List, Iterable
+
+import numpy as np
+
+# --- КОНФИГУРАЦИЯ ---
+# 0 = не использовать кэш ответов (каждый вопрос идёт в поиск и Gemini)
+ANSWER_CACHE = os.getenv("ANSWER_CACHE", "1") == "1"
+ANSWER_CACHE_PATH = os.getenv("ANSWER_CACHE_PATH", ".cache/answers.sqlite")
+# Минимальное косинусное сходство вопроса с ранее отвеченным, чтобы отдать готовый ответ
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+# Время жизни ответа, секунды (0 = без срока) и предел числа записей (вытесняются давно не использованные)
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "86400"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "10000"))
+
+
+def _batched(items: List, size: int = 500) -> List[List]:
+    # SQLite ограничивает число параметров в запросе
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+class AnswerCache:
+    """Семантический кэш ответов: вопрос, близкий по эмбеддингу к уже отвеченному, получает готовый ответ.
+
+    Вместе с ответом хранятся ID чанков, на которых он основан: загрузка, переписавшая или удалившая
+    эти чанки (или весь их документ), удаляет ответ. Вопросы разных настроек поиска/генерации (scope)
+    друг другу не отвечают. Векторы вопросов держатся в памяти матрицей и перечитываются, только если
+    базу изменил другой процесс (PRAGMA data_version).
+    """
+
+    def __init__(self, path: str = ANSWER_CACHE_PATH, scope: str = "",
+                 threshold: float = ANSWER_CACHE_THRESHOLD, ttl: float = ANSWER_CACHE_TTL,
+                 max_entries: int = ANSWER_CACHE_MAX_ENTRIES):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.scope = scope
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS answers (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                scope TEXT NOT NULL,
+                question TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                answer TEXT NOT NULL,
+                sources TEXT NOT NULL,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS answer_chunks (
+                answer_id INTEGER NOT NULL,
+                chunk_id TEXT NOT NULL,
+                PRIMARY KEY (answer_id, chunk_id)
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS answer_chunks_chunk ON answer_chunks(chunk_id)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS answers_accessed ON answers(accessed)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS answers_created ON answers(created)")
+        # Матрица нормированных векторов вопросов текущего scope; загружается при первом поиске,
+        # поэтому загрузка документов (только инвалидирует) её не строит
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.created = np.zeros(0, dtype=np.float64)
+        self.matrix: Optional[np.ndarray] = None
+        self.version = None
+        # Счётчики текущего процесса
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.invalidated = 0
+
+    # ---------------- Векторы в памяти ----------------
+
+    def _sync(self):
+        version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+        if self.matrix is not None and version == self.version:
+            return
+        self.version = version
+        rows = self.conn.execute(
+            "SELECT id, created, vector FROM answers WHERE scope = ? ORDER BY id", (self.scope,)).fetchall()
+        self.ids = np.array([r[0] for r in rows], dtype=np.int64)
+        self.created = np.array([r[1] for r in rows], dtype=np.float64)
+        vectors = [np.frombuffer(r[2], dtype=np.float32) for r in rows]
+        dims = {len(v) for v in vectors}
+        self.matrix = np.vstack(vectors) if len(dims) == 1 else np.zeros((0, 0), dtype=np.float32)
+
+    def _forget(self, ids: Iterable[int]):
+        if self.matrix is None or not len(self.ids):
+            return
+        keep = ~np.isin(self.ids, np.fromiter(ids, dtype=np.int64))
+        self.ids, self.created, self.matrix = self.ids[keep], self.created[keep], self.matrix[keep]
+
+    def _delete(self, ids: List[int]):
+        for part in _batched(ids):
+            marks = ",".join("?" * len(part))
+            self.conn.execute(f"DELETE FROM answers WHERE id IN ({marks})", part)
+            self.conn.execute(f"DELETE FROM answer_chunks WHERE answer_id IN ({marks})", part)
+        self._forget(ids)
+
+    # ---------------- Поиск и запись ----------------
+
+    def lookup(self, vector: List[float]) -> Optional[Dict[str, Any]]:
+        """Готовый ответ на самый похожий вопрос, если сходство не ниже порога и срок не истёк."""
+        query = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        with self.lock:
+            self._sync()
+            if not len(self.ids) or not norm or self.matrix.shape[1] != len(query):
+                self.misses += 1
+                return None
+            scores = self.matrix @ (query / norm)
+            if self.ttl:
+                scores[self.created < time.time() - self.ttl] = -1.0
+            best = int(np.argmax(scores))
+            similarity = float(scores[best])
+            if similarity < self.threshold:
+                self.misses += 1
+                return None
+            answer_id = int(self.ids[best])
+            row = self.conn.execute(
+                "SELECT question, answer, sources FROM answers WHERE id = ?", (answer_id,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.conn.execute(
+                "UPDATE answers SET accessed = ?, hits = hits + 1 WHERE id = ?", (time.time(), answer_id))
+            self.conn.commit()
+            self.hits += 1
+        return {
+            "cached_question": row[0],
+            "answer": row[1],
+            "sources": json.loads(row[2]),
+            "similarity": round(similarity, 4),
+        }
+
+    def put(self, question: str, vector: List[float], answer: str, sources: List[Dict[str, Any]]):
+        query = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        chunk_ids = sorted({s["id"] for s in sources if s.get("id")})
+        if not answer or not norm or not chunk_ids:
+            return
+        query = query / norm
+        now = time.time()
+        with self.lock:
+            self._sync()
+            cur = self.conn.execute(
+                "INSERT INTO answers (scope, question, vector, answer, sources, created, accessed) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (self.scope, question, query.tobytes(), answer,
+                 json.dumps(sources, ensure_ascii=False), now, now),
+            )
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO answer_chunks (answer_id, chunk_id) VALUES (?, ?)",
+                [(cur.lastrowid, cid) for cid in chunk_ids],
+            )
+            if self.matrix.shape[1] in (0, len(query)):
+                self.ids = np.append(self.ids, cur.lastrowid)
+                self.created = np.append(self.created, now)
+                self.matrix = np.vstack([self.matrix.reshape(-1, len(query)), query[None, :]])
+            self._evict(now)
+            self.conn.commit()
+            self.stores += 1
+
+    def _evict(self, now: float):
+        if self.ttl:
+            expired = [r[0] for r in self.conn.execute(
+                "SELECT id FROM answers WHERE created < ?", (now - self.ttl,)).fetchall()]
+            self._delete(expired)
+        count = self.conn.execute("SELECT count(*) FROM answers").fetchone()[0]
+        if count > self.max_entries:
+            # Удаляем давно не использованные, пока не уложимся в 90% лимита
+            excess = count - int(self.max_entries * 0.9)
+            self._delete([r[0] for r in self.conn.execute(
+                "SELECT id FROM answers ORDER BY accessed LIMIT ?", (excess,)).fetchall()])
+
+    # ---------------- Инвалидация ----------------
+
+    def invalidate_chunks(self, chunk_ids: Iterable[str]) -> int:
+        """Удаляет ответы, основанные хотя бы на одном из чанков; возвращает число удалённых ответов."""
+        chunk_ids = list(set(chunk_ids))
+        if not chunk_ids:
+            return 0
+        with self.lock:
+            ids = set()
+            for part in _batched(chunk_ids):
+                rows = self.conn.execute(
+                    f"SELECT DISTINCT answer_id FROM answer_chunks WHERE chunk_id IN ({','.join('?' * len(part))})",
+                    part,
+                ).fetchall()
+                ids.update(r[0] for r in rows)
+            if ids:
+                self._delete(sorted(ids))
+                self.conn.commit()
+            self.invalidated += len(ids)
+        return len(ids)
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            entries, saved = self.conn.execute(
+                "SELECT count(*), COALESCE(SUM(hits), 0) FROM answers").fetchone()
+            scopes = self.conn.execute("SELECT scope, count(*) FROM answers GROUP BY scope").fetchall()
+        lookups = self.hits + self.misses
+        return {
+            "entries": entries,
+            "saved_calls_total": saved,
+            "run_hits": self.hits,
+            "run_misses": self.misses,
+            "run_stores": self.stores,
+            "run_invalidated": self.invalidated,
+            "run_hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "scopes": [{"scope": s, "entries": n} for s, n in scopes],
+        }
+
+    def clear(self) -> int:
+        with self.lock:
+            cur = self.conn.execute("DELETE FROM answers")
+            self.conn.execute("DELETE FROM answer_chunks")
+            self.conn.commit()
+            self._forget(self.ids.tolist())
+        return cur.rowcount
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Статистика и очистка семантического кэша ответов")
+    parser.add_argument("--path", default=ANSWER_CACHE_PATH)
+    parser.add_argument("--invalidate-chunk", metavar="CHUNK_ID", nargs="+",
+                        help="Удалить ответы, основанные на указанных чанках")
+    parser.add_argument("--clear", action="store_true", help="Очистить кэш целиком")
+    args = parser.parse_args()
+
+    cache = AnswerCache(args.path)
+    if args.clear:
+        print(f"🗑️ Удалено ответов: {cache.clear()}")
+    elif args.invalidate_chunk:
+        print(f"🗑️ Удалено ответов: {cache.invalidate_chunks(args.invalidate_chunk)}")
+    json.dump(cache.stats(), sys.stdout, indent=2, ensure_ascii=False)
+    print()
+    cache.close()
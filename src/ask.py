@@ -1,6 +1,58 @@
 import sys
-from query import search
+import socket
+import argparse
+import query_server
+
+def print_result(result):
+    sources = result.get("sources") or []
+    if not sources:
+        print("⚠️ Ничего не найдено.")
+        return
+    print(f"✅ Найдено источников: {len(sources)}\n")
+    for i, src in enumerate(sources):
+        score = src.get("score")
+        score_display = f"{score:.4f}" if isinstance(score, (int, float)) else "N/A"
+        entities_str = ', '.join(src.get("entities") or []) or "(Нет связей)"
+        print(f"--- Источник {i+1} (Score: {score_display}) ---")
+        print(f"🔗 Сущности: {entities_str}")
+        print(f"📄 Текст: {(src.get('text') or '')[:100].replace(chr(10), ' ')}...")
+    print("\n" + "="*20 + " ОТВЕТ " + "="*20)
+    print(result.get("answer"))
+    print("="*47)
 
 if __name__ == "__main__":
-    question = sys.argv[1] if len(sys.argv) > 1 else "Summarize the content of the uploaded documents."
-    search(question)
+    parser = argparse.ArgumentParser(description="Вопрос к графу знаний (или пакет вопросов из JSONL)")
+    parser.add_argument("question", nargs="?", default="Summarize the content of the uploaded documents.")
+    parser.add_argument("--batch", metavar="INPUT",
+                        help="JSONL с вопросами ({\"id\": ..., \"question\": ...}); '-' = stdin")
+    parser.add_argument("--output", default="-", help="Куда писать ответы в JSONL ('-' = stdout)")
+    parser.add_argument("--concurrency", type=int, default=None, help="Параллельная генерация ответов")
+    parser.add_argument("--resume", action="store_true", help="Продолжить --output: отвеченные строки сохраняются, вопросы с ошибкой отвечаются заново")
+    args = parser.parse_args()
+
+    if args.batch:
+        # Пакетный режим работает в этом процессе: один пул соединений на все вопросы
+        from batch_ask import run_batch, BATCH_CONCURRENCY
+        stats = run_batch(args.batch, args.output, args.concurrency or BATCH_CONCURRENCY, args.resume)
+        print(f"✅ Отвечено: {stats['answered']}, ошибок: {stats['failed']}, пропущено: {stats['skipped']}",
+              file=sys.stderr)
+        sys.exit(0)
+
+    question = args.question
+    try:
+        # Тонкий клиент: вся тяжёлая работа в долгоживущем query_server.py
+        result = query_server.request("POST", "/ask", {"question": question})
+        print(f"\n🔎 Вопрос: {question}")
+        print_result(result)
+    except (ConnectionError, FileNotFoundError):
+        # Сервер не запущен - отвечаем в этом процессе, как раньше
+        print("ℹ️ Сервер вопросов недоступен, отвечаю локально (python src/query_server.py ускорит ответы).")
+        from query import search
+        search(question)
+    except (TimeoutError, socket.timeout):
+        print(f"❌ Сервер не ответил за {query_server.QUERY_SERVER_TIMEOUT:.0f} с (QUERY_SERVER_TIMEOUT).")
+        sys.exit(1)
+    except RuntimeError as e:
+        # Ответ сервера не 200: его текст ошибки и есть диагноз
+        print(f"❌ Ошибка сервера вопросов: {e}")
+        sys.exit(1)
@@ -0,0 +1,154 @@
+import os
+import sys
+import json
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from typing import Dict, Any, Iterator, List, Set
+
+# --- КОНФИГУРАЦИЯ ---
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))
+# Сколько вопросов обрабатываем за одно окно (эмбеддинги пачкой, поиск в одной сессии)
+BATCH_WINDOW = int(os.getenv("BATCH_WINDOW", "256"))
+
+
+def read_questions(path: str) -> Iterator[Dict[str, Any]]:
+    """Читает JSONL (или stdin при path == '-'); строка - {"question": ..., "id": ...} или просто строка."""
+    stream = sys.stdin if path == "-" else open(path, "r", encoding="utf-8")
+    try:
+        for n, line in enumerate(stream):
+            line = line.strip()
+            if not line:
+                continue
+            item = json.loads(line)
+            if isinstance(item, str):
+                item = {"question": item}
+            item.setdefault("id", n)
+            yield item
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+
+def load_previous(path: str) -> "OrderedDict[str, Dict[str, Any]]":
+    """Строки частично записанного файла по ID (для --resume); при повторе ID побеждает последняя."""
+    rows: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+    if not path or path == "-" or not os.path.exists(path):
+        return rows
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError:
+                # Последняя строка могла оборваться при аварийной остановке
+                continue
+            rows.pop(str(row.get("id")), None)
+            rows[str(row.get("id"))] = row
+    return rows
+
+
+def _windows(items: Iterator[Dict[str, Any]], size: int) -> Iterator[List[Dict[str, Any]]]:
+    window = []
+    for item in items:
+        window.append(item)
+        if len(window) >= size:
+            yield window
+            window = []
+    if window:
+        yield window
+
+
+def _answer_window(query, session, executor: ThreadPoolExecutor,
+                   window: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Строки ответов окна вопросов в порядке входа; ошибка достаётся только своим вопросам."""
+    rows: List[Dict[str, Any]] = [{"id": q["id"], "question": q["question"]} for q in window]
+
+    # 1. Эмбеддинги вопросов одним batch-запросом (с кэшем)
+    try:
+        vectors = query.embedder.embed([q["question"] for q in window], "retrieval_query")
+    except Exception as e:
+        # Повторы 429/5xx уже исчерпаны планировщиком: окно целиком в ошибках, следующее идёт дальше
+        for row in rows:
+            row.update(error=f"Gemini: {e}", sources=[], scores=[])
+        return rows
+
+    # 2. Похожие вопросы, уже отвеченные раньше, берутся из кэша ответов
+    for row, vector in zip(rows, vectors):
+        hit = query.cached_answer(vector)
+        if hit is not None:
+            row.update(answer=hit["answer"], sources=hit["sources"], cached=True)
+    todo = [(row, vector) for row, vector in zip(rows, vectors) if "cached" not in row]
+
+    # 3. Векторный поиск в одной сессии (локальный движок - одним матричным умножением)
+    try:
+        found = query.retrieve_many([vector for _, vector in todo], session) if todo else []
+        for (row, _), sources in zip(todo, found):
+            row["sources"] = sources
+    except Exception:
+        # Ищем по одному, чтобы ошибка досталась только своему вопросу
+        for row, vector in todo:
+            try:
+                row["sources"] = query.retrieve(vector, session)
+            except Exception as e:
+                row["error"] = f"Memgraph: {e}"
+
+    # 4. Генерация ответов параллельно (лимиты и повторы - в планировщике query.generate_answer)
+    futures = [
+        executor.submit(query.generate_answer, row["question"], query.build_context(row["sources"]))
+        if "cached" not in row and row.get("sources") else None
+        for row in rows
+    ]
+    for row, vector, future in zip(rows, vectors, futures):
+        if future is not None:
+            try:
+                row["answer"] = future.result()
+                query.remember_answer(row["question"], vector, row["answer"], row["sources"])
+            except Exception as e:
+                row["error"] = f"Gemini: {e}"
+        elif "error" not in row and "cached" not in row:
+            row["answer"] = None
+        sources = row.pop("sources", None) or []
+        row["sources"] = [{"id": s["id"], "score": s["score"], "entities": s["entities"]} for s in sources]
+        row["scores"] = [s["score"] for s in sources]
+    return rows
+
+
+def run_batch(input_path: str, output_path: str = "-", concurrency: int = BATCH_CONCURRENCY,
+              resume: bool = False) -> Dict[str, int]:
+    import query
+
+    # --resume переписывает файл заново в порядке входа: отвеченные строки переносятся,
+    # а вопросы с ошибкой отвечаются снова и встают на своё место, без дублей ID
+    previous = load_previous(output_path) if resume else OrderedDict()
+    done = {qid for qid, row in previous.items() if "error" not in row}
+    target = output_path + ".tmp" if previous else output_path
+
+    out = sys.stdout if output_path == "-" else open(target, "w", encoding="utf-8")
+    stats = {"answered": 0, "failed": 0, "skipped": 0}
+    written: Set[str] = set()
+    executor = ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="answer")
+    try:
+        with query.get_driver().session() as session:
+            for window in _windows(read_questions(input_path), BATCH_WINDOW):
+                todo = [q for q in window if str(q["id"]) not in done]
+                answered = iter(_answer_window(query, session, executor, todo) if todo else [])
+                for q in window:
+                    if str(q["id"]) in done:
+                        row = previous[str(q["id"])]
+                        stats["skipped"] += 1
+                    else:
+                        row = next(answered)
+                        stats["failed" if "error" in row else "answered"] += 1
+                    out.write(json.dumps(row, ensure_ascii=False) + "\n")
+                    written.add(str(q["id"]))
+                out.flush()
+    finally:
+        executor.shutdown(wait=True)
+        if out is not sys.stdout:
+            # Прерванный прогон не теряет строки прошлого, до которых не дошёл
+            for qid, row in previous.items():
+                if qid not in written:
+                    out.write(json.dumps(row, ensure_ascii=False) + "\n")
+            out.close()
+            if target != output_path:
+                os.replace(target, output_path)
+    return stats
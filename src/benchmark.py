@@ -0,0 +1,298 @@
+import os
+import io
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import functools
+import tempfile
+import resource
+import tracemalloc
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+# Бенчмарк загрузки и поиска без Gemini и Memgraph: HybridGraphPipeline и query.answer
+# работают как обычно, но с фейковыми клиентом Gemini и драйвером графа (см. fakes.py).
+# Кэши пишутся во временную папку, чтобы каждый прогон начинался с холодного кэша.
+# Процессы-шарды (--shards) заново импортируют этот модуль: папка передаётся им через окружение
+_WORKDIR = os.environ.get("RAG_BENCH_WORKDIR") or tempfile.mkdtemp(prefix="rag-bench-")
+os.environ["RAG_BENCH_WORKDIR"] = _WORKDIR
+os.environ.setdefault("GEMINI_API_KEY", "benchmark")
+os.environ.setdefault("EMBEDDING_CACHE_PATH", os.path.join(_WORKDIR, "embeddings.sqlite"))
+os.environ.setdefault("EXTRACTION_CACHE_PATH", os.path.join(_WORKDIR, "extraction.sqlite"))
+os.environ.setdefault("LOCAL_INDEX_DIR", os.path.join(_WORKDIR, "local_index"))
+os.environ.setdefault("CHECKPOINT_PATH", os.path.join(_WORKDIR, "checkpoint.sqlite"))
+os.environ.setdefault("ANSWER_CACHE_PATH", os.path.join(_WORKDIR, "answers.sqlite"))
+os.environ.setdefault("DEDUP_PATH", os.path.join(_WORKDIR, "dedup.sqlite"))
+# Вопросы бенчмарка повторяются по кругу: по умолчанию меряем полный путь без кэша ответов (--answer-cache)
+os.environ.setdefault("ANSWER_CACHE", "0")
+# Docling в синтетическом корпусе не нужен (только .txt)
+os.environ.setdefault("CONVERT_WORKERS", "0")
+# В фейковом API лимиты запросов не имеют смысла, важна только собственная задержка
+os.environ.setdefault("EXTRACTION_RPM", "0")
+os.environ.setdefault("EXTRACTION_TPM", "0")
+os.environ.setdefault("EMBEDDING_RPM", "0")
+os.environ.setdefault("EMBEDDING_TPM", "0")
+os.environ.setdefault("QA_RPM", "0")
+os.environ.setdefault("QA_TPM", "0")
+
+from fakes import FakeGenAI, FakeGraphDriver, make_fake_clients
+from sharded_ingest import run_sharded
+from metrics import METRICS, percentiles
+
+# --- КОНФИГУРАЦИЯ ---
+BENCH_DOCS = int(os.getenv("BENCH_DOCS", "20"))
+BENCH_DOC_WORDS = int(os.getenv("BENCH_DOC_WORDS", "2000"))
+BENCH_QUERIES = int(os.getenv("BENCH_QUERIES", "50"))
+
+# Словарь синтетического корпуса: сущности (с заглавной буквы) и связующие слова
+ENTITY_WORDS = [
+    "Memgraph", "Gemini", "Docling", "Chonkie", "Python", "Cypher", "Neo4j", "Vector", "Graph",
+    "Index", "Chunk", "Document", "Entity", "Relation", "Embedding", "Pipeline", "Server", "Cache",
+    "Query", "Answer", "Context", "Manifest", "Resolver", "Scheduler", "Worker", "Stage",
+]
+FILLER_WORDS = (
+    "the a of and to in is for with on that by from as are this be at which it or an "
+    "stores builds links reads writes returns improves reduces uses describes contains"
+).split()
+
+
+def generate_corpus(data_dir: str, docs: int, words: int, seed: int = 0) -> List[str]:
+    """Пишет docs текстовых файлов по ~words слов; возвращает вопросы по их содержимому."""
+    rng = random.Random(seed)
+    os.makedirs(data_dir, exist_ok=True)
+    questions = []
+    for n in range(docs):
+        # У каждого документа своя тема: подмножество сущностей, которые в нём встречаются чаще
+        topic = rng.sample(ENTITY_WORDS, 5)
+        sentences, count = [], 0
+        while count < words:
+            length = rng.randint(8, 20)
+            sentence = [
+                rng.choice(topic) if rng.random() < 0.15
+                else rng.choice(ENTITY_WORDS) if rng.random() < 0.03
+                else rng.choice(FILLER_WORDS)
+                for _ in range(length)
+            ]
+            sentences.append(" ".join(sentence).capitalize() + ".")
+            count += length
+        with open(os.path.join(data_dir, f"doc_{n:05d}.txt"), "w", encoding="utf-8") as f:
+            f.write("\n".join(" ".join(sentences[i:i + 6]) for i in range(0, len(sentences), 6)))
+        questions.append(f"How does {topic[0]} relate to {topic[1]} and {topic[2]}?")
+    return questions
+
+
+def peak_memory_mb() -> float:
+    # ru_maxrss: в Linux килобайты, в macOS байты
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+@contextlib.contextmanager
+def _quiet(verbose: bool):
+    if verbose:
+        yield
+        return
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+def bench_ingest(data_dir: str, gemini: FakeGenAI, driver: FakeGraphDriver, verbose: bool = False,
+                 shards: int = 0, make_clients=None) -> Dict[str, Any]:
+    with _quiet(verbose):
+        import main
+        pipeline = main.HybridGraphPipeline(
+            main.MEMGRAPH_URI, main.MEMGRAPH_AUTH, driver=driver, client=gemini)
+    gemini.recorder.reset()
+    driver.recorder.reset()
+    METRICS.reset()
+    rows_before = driver.rows_written
+
+    started = time.perf_counter()
+    with _quiet(verbose):
+        if shards > 1:
+            # Шарды ходят в свои фейковые клиенты; в граф пишет только driver координатора
+            stages = run_sharded(pipeline, data_dir, shards, make_clients, quiet=not verbose)
+        else:
+            stages = pipeline.process_directory(data_dir)
+    elapsed = time.perf_counter() - started
+    pipeline.close()
+
+    chunks = len(driver.graph.chunks)
+    rows = driver.rows_written - rows_before
+    return {
+        "seconds": round(elapsed, 3),
+        "documents": pipeline.documents_written,
+        "chunks": chunks,
+        "chunks_per_s": round(chunks / elapsed, 2) if elapsed else None,
+        "rows_written": rows,
+        "writes_per_s": round(rows / elapsed, 2) if elapsed else None,
+        "failed": sum(stage.failed for stage in stages),
+        "stages": {
+            stage.name: dict(percentiles(stage.durations),
+                             items_per_s=round(stage.processed / elapsed, 2) if elapsed else None)
+            for stage in stages
+        },
+        "gemini_calls": {kind: percentiles(v) for kind, v in gemini.recorder.snapshot().items()},
+        "graph_statements": {kind: percentiles(v) for kind, v in driver.recorder.snapshot().items()},
+        "extraction_failures": pipeline.extractor.failures,
+        "embedding_api_calls": pipeline.embedder.api_calls,
+        "spans": METRICS.spans(),
+        "counters": METRICS.summary()["counters"],
+    }
+
+
+def bench_queries(questions: List[str], gemini: FakeGenAI, driver: FakeGraphDriver,
+                  concurrency: int = 1, verbose: bool = False) -> Dict[str, Any]:
+    with _quiet(verbose):
+        import query
+    # Подменяем синглтоны модуля: драйвер, модель ответов и клиента эмбеддингов
+    query._driver = driver
+    query._qa_model = gemini.GenerativeModel(query.QA_MODEL)
+    query.embedder.client = gemini
+    if query.RETRIEVAL_BACKEND != "memgraph":
+        # Как в конце main.py: локальная матрица дописывается из графа после загрузки
+        query.get_local_index().refresh(driver)
+    gemini.recorder.reset()
+    driver.recorder.reset()
+    METRICS.reset()
+
+    latencies, empty = [], 0
+
+    def run(question: str):
+        t0 = time.perf_counter()
+        result = query.answer(question)
+        return time.perf_counter() - t0, result
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        for seconds, result in pool.map(run, questions):
+            latencies.append(seconds)
+            empty += not result["sources"]
+    elapsed = time.perf_counter() - started
+
+    return {
+        "seconds": round(elapsed, 3),
+        "queries": len(questions),
+        "concurrency": concurrency,
+        "queries_per_s": round(len(questions) / elapsed, 2) if elapsed else None,
+        "latency": percentiles(latencies),
+        "no_sources": empty,
+        "gemini_calls": {kind: percentiles(v) for kind, v in gemini.recorder.snapshot().items()},
+        "graph_statements": {kind: percentiles(v) for kind, v in driver.recorder.snapshot().items()},
+        "spans": METRICS.spans(),
+        "counters": METRICS.summary()["counters"],
+        "answer_cache": query.answer_cache.stats() if query.answer_cache is not None else None,
+    }
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Регрессии относительно прошлого отчёта: пропускная способность ниже или p95 выше допуска."""
+    problems = []
+    checks = [
+        ("ingest.chunks_per_s", report["ingest"]["chunks_per_s"], baseline["ingest"]["chunks_per_s"], True),
+        ("query.queries_per_s", report["query"]["queries_per_s"], baseline["query"]["queries_per_s"], True),
+        ("query.latency.p95_ms", report["query"]["latency"].get("p95_ms"),
+         baseline["query"]["latency"].get("p95_ms"), False),
+    ]
+    for name, value, base, higher_is_better in checks:
+        if not value or not base:
+            continue
+        change = (value - base) / base
+        if (higher_is_better and change < -tolerance) or (not higher_is_better and change > tolerance):
+            problems.append(f"{name}: {base} -> {value} ({change:+.0%})")
+    return problems
+
+
+def run_benchmark(docs: int = BENCH_DOCS, doc_words: int = BENCH_DOC_WORDS, queries: int = BENCH_QUERIES,
+                  gemini_latency: float = 0.0, gemini_token_latency: float = 0.0,
+                  graph_latency: float = 0.0, graph_row_latency: float = 0.0, jitter: float = 0.0,
+                  query_concurrency: int = 1, seed: int = 0, trace_memory: bool = False,
+                  data_dir: Optional[str] = None, verbose: bool = False, shards: int = 0) -> Dict[str, Any]:
+    data_dir = data_dir or os.path.join(_WORKDIR, "data")
+    questions = generate_corpus(data_dir, docs, doc_words, seed)
+    questions = [questions[i % len(questions)] for i in range(queries)] if questions else []
+
+    gemini = FakeGenAI(gemini_latency, gemini_token_latency, jitter, seed)
+    driver = FakeGraphDriver(graph_latency, graph_row_latency, jitter, seed)
+
+    if trace_memory:
+        # tracemalloc заметно замедляет Python, поэтому только по запросу
+        tracemalloc.start()
+    report: Dict[str, Any] = {
+        "config": {
+            "docs": docs, "doc_words": doc_words, "queries": queries,
+            "gemini_latency": gemini_latency, "gemini_token_latency": gemini_token_latency,
+            "graph_latency": graph_latency, "graph_row_latency": graph_row_latency,
+            "jitter": jitter, "query_concurrency": query_concurrency, "seed": seed,
+            "answer_cache": os.environ["ANSWER_CACHE"] == "1", "shards": shards,
+        },
+        "ingest": bench_ingest(
+            data_dir, gemini, driver, verbose, shards,
+            functools.partial(make_fake_clients, (gemini_latency, gemini_token_latency, jitter, seed),
+                              (graph_latency, graph_row_latency, jitter, seed))),
+        "query": bench_queries(questions, gemini, driver, query_concurrency, verbose),
+        "memory": {"peak_rss_mb": peak_memory_mb()},
+    }
+    if trace_memory:
+        report["memory"]["peak_python_heap_mb"] = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 1)
+        tracemalloc.stop()
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Бенчмарк загрузки и поиска с фейковыми Gemini и Memgraph")
+    parser.add_argument("--docs", type=int, default=BENCH_DOCS, help="Число синтетических документов")
+    parser.add_argument("--doc-words", type=int, default=BENCH_DOC_WORDS, help="Слов в документе")
+    parser.add_argument("--queries", type=int, default=BENCH_QUERIES, help="Число вопросов")
+    parser.add_argument("--query-concurrency", type=int, default=1)
+    parser.add_argument("--gemini-latency", type=float, default=0.0, help="Задержка вызова Gemini, с")
+    parser.add_argument("--gemini-token-latency", type=float, default=0.0, help="Доп. задержка на токен, с")
+    parser.add_argument("--graph-latency", type=float, default=0.0, help="Задержка запроса к графу, с")
+    parser.add_argument("--graph-row-latency", type=float, default=0.0, help="Доп. задержка на строку UNWIND, с")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Разброс задержек, доля (0.2 = ±20%%)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--trace-memory", action="store_true", help="Пик кучи Python через tracemalloc")
+    parser.add_argument("--data-dir", help="Папка для корпуса (по умолчанию временная)")
+    parser.add_argument("--output", default="-", help="Файл для JSON-отчёта ('-' = stdout)")
+    parser.add_argument("--baseline", help="Прошлый отчёт: код выхода 1 при регрессии")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Допустимое ухудшение, доля")
+    parser.add_argument("--verbose", action="store_true", help="Показывать вывод пайплайна")
+    parser.add_argument("--answer-cache", action="store_true",
+                        help="Включить семантический кэш ответов (повторные вопросы отвечаются из него)")
+    parser.add_argument("--shards", type=int, default=0,
+                        help="Загружать несколькими процессами (sharded_ingest), 0 = в одном процессе")
+    args = parser.parse_args()
+    if args.answer_cache:
+        os.environ["ANSWER_CACHE"] = "1"
+
+    try:
+        report = run_benchmark(
+            docs=args.docs, doc_words=args.doc_words, queries=args.queries,
+            gemini_latency=args.gemini_latency, gemini_token_latency=args.gemini_token_latency,
+            graph_latency=args.graph_latency, graph_row_latency=args.graph_row_latency,
+            jitter=args.jitter, query_concurrency=args.query_concurrency, seed=args.seed,
+            trace_memory=args.trace_memory, data_dir=args.data_dir, verbose=args.verbose, shards=args.shards,
+        )
+    finally:
+        shutil.rmtree(_WORKDIR, ignore_errors=True)
+
+    problems = []
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            problems = compare(report, json.load(f), args.tolerance)
+        report["regressions"] = problems
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output == "-":
+        print(text)
+    else:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    if problems:
+        for p in problems:
+            print(f"❌ Регрессия: {p}", file=sys.stderr)
+        sys.exit(1)
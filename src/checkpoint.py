@@ -0,0 +1,284 @@
+import os
+import sys
+import json
+import time
+import sqlite3
+import argparse
+import threading
+from typing import Dict, Any, Optional, List, Iterable, Set, Tuple
+
+# --- КОНФИГУРАЦИЯ ---
+CHECKPOINT_PATH = os.getenv("CHECKPOINT_PATH", ".cache/checkpoint.sqlite")
+# После стольких неудачных попыток чанк уходит в dead-letter и автоматически больше не повторяется
+CHUNK_MAX_ATTEMPTS = int(os.getenv("CHUNK_MAX_ATTEMPTS", "3"))
+# Сколько раз за запуск повторять очередь упавших чанков и пауза перед каждым проходом, секунды
+CHUNK_RETRY_PASSES = int(os.getenv("CHUNK_RETRY_PASSES", "1"))
+CHUNK_RETRY_DELAY = float(os.getenv("CHUNK_RETRY_DELAY", "10"))
+
+# Статусы документа: started - обрабатывается (или запуск оборвался), partial - часть чанков
+# не записана, failed - потерян сегмент (сбой стадии, остальное не дописывалось),
+# done - записан целиком (строки чанков после этого удаляются).
+# Статусы чанка: pending - ждёт записи, written - в графе, retry - в очереди повторов, dead - dead-letter.
+RETRY, DEAD, WRITTEN, PENDING = "retry", "dead", "written", "pending"
+
+
+class IngestCheckpoint:
+    """Журнал загрузки в SQLite: статус каждого документа и чанка, очередь повторов и dead-letter."""
+
+    def __init__(self, path: str = CHECKPOINT_PATH, max_attempts: int = CHUNK_MAX_ATTEMPTS):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.max_attempts = max_attempts
+        self.lock = threading.Lock()
+        # Шардированная загрузка пишет в журнал из нескольких процессов: ждём блокировку, а не падаем
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS documents (
+                doc_id TEXT PRIMARY KEY,
+                filename TEXT NOT NULL,
+                manifest TEXT NOT NULL,
+                status TEXT NOT NULL,
+                updated REAL NOT NULL
+            )
+        """)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS chunks (
+                chunk_id TEXT PRIMARY KEY,
+                doc_id TEXT NOT NULL,
+                idx INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                stage TEXT,
+                error TEXT,
+                text TEXT,
+                updated REAL NOT NULL
+            )
+        """)
+        # Ссылки дубликатов на канонические чанки, которые ещё не в графе: документ ждёт их без манифеста
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS links (
+                doc_id TEXT NOT NULL,
+                chunk_id TEXT NOT NULL,
+                updated REAL NOT NULL,
+                PRIMARY KEY (doc_id, chunk_id)
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS chunks_doc ON chunks(doc_id)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS chunks_status ON chunks(status)")
+
+    def start_document(self, doc_id: str, filename: str, manifest: Dict[str, Any]):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO documents (doc_id, filename, manifest, status, updated) "
+                "VALUES (?, ?, ?, 'started', ?)",
+                (doc_id, filename, json.dumps(manifest), time.time()),
+            )
+            # Ссылки документа заново вычисляет чанкинг
+            self.conn.execute("DELETE FROM links WHERE doc_id = ?", (doc_id,))
+            self.conn.commit()
+
+    def plan_chunks(self, doc_id: str, chunks: List[Tuple[int, str, bool]]):
+        """Фиксирует очередной сегмент документа: (index, chunk_id, предстоит ли запись).
+
+        Чанки, которые писать не нужно, уже в графе - кроме dead-letter, который остаётся со своей ошибкой.
+        Число попыток сохраняется: чанк, падавший в прошлых запусках, не получает новых попыток.
+        """
+        now = time.time()
+        with self.lock:
+            self.conn.executemany(
+                "INSERT INTO chunks (chunk_id, doc_id, idx, status, updated) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(chunk_id) DO UPDATE SET "
+                "  doc_id = excluded.doc_id, idx = excluded.idx, updated = excluded.updated, "
+                "  status = CASE WHEN excluded.status = 'pending' THEN 'pending' "
+                "                WHEN chunks.status = 'dead' THEN 'dead' ELSE 'written' END, "
+                "  stage = CASE WHEN chunks.status = 'dead' AND excluded.status != 'pending' THEN chunks.stage END, "
+                "  error = CASE WHEN chunks.status = 'dead' AND excluded.status != 'pending' THEN chunks.error END, "
+                "  text = CASE WHEN chunks.status = 'dead' AND excluded.status != 'pending' THEN chunks.text END",
+                [(cid, doc_id, idx, PENDING if pending else WRITTEN, now) for idx, cid, pending in chunks],
+            )
+            self.conn.commit()
+
+    def end_plan(self, doc_id: str, chunk_ids: Set[str]):
+        """Все сегменты документа учтены: строки чанков, которых больше нет в документе, удаляются."""
+        with self.lock:
+            rows = self.conn.execute("SELECT chunk_id, status FROM chunks WHERE doc_id = ?", (doc_id,)).fetchall()
+            stale = [(cid,) for cid, _ in rows if cid not in chunk_ids]
+            self.conn.executemany("DELETE FROM chunks WHERE chunk_id = ?", stale)
+            if any(status == DEAD for cid, status in rows if cid in chunk_ids):
+                self.conn.execute("UPDATE documents SET status = 'partial' WHERE doc_id = ?", (doc_id,))
+            self.conn.commit()
+
+    def mark_written(self, chunk_ids: Iterable[str]):
+        rows = [(time.time(), cid) for cid in chunk_ids]
+        if not rows:
+            return
+        with self.lock:
+            self.conn.executemany(
+                "UPDATE chunks SET status = 'written', error = NULL, text = NULL, updated = ? WHERE chunk_id = ?",
+                rows,
+            )
+            self.conn.commit()
+
+    def mark_failed(self, doc_id: str, failures: List[Tuple[int, str, str, str, str]]) -> Dict[str, int]:
+        """failures: (index, text, chunk_id, stage, error). Текст хранится, чтобы повтор не читал файл заново."""
+        counts = {RETRY: 0, DEAD: 0}
+        now = time.time()
+        with self.lock:
+            for idx, text, cid, stage, error in failures:
+                row = self.conn.execute("SELECT attempts FROM chunks WHERE chunk_id = ?", (cid,)).fetchone()
+                attempts = (row[0] if row else 0) + 1
+                status = DEAD if attempts >= self.max_attempts else RETRY
+                counts[status] += 1
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO chunks "
+                    "(chunk_id, doc_id, idx, status, attempts, stage, error, text, updated) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (cid, doc_id, idx, status, attempts, stage, error, text, now),
+                )
+            self.conn.execute(
+                "UPDATE documents SET status = 'partial', updated = ? WHERE doc_id = ?", (now, doc_id))
+            self.conn.commit()
+        return counts
+
+    def fail_document(self, doc_id: str):
+        # Сегмент документа потерян (сбой стадии): без манифеста он дообработается при --resume
+        with self.lock:
+            self.conn.execute(
+                "UPDATE documents SET status = 'failed', updated = ? WHERE doc_id = ?", (time.time(), doc_id))
+            self.conn.commit()
+
+    def defer_links(self, doc_id: str, chunk_ids: Iterable[str]):
+        now = time.time()
+        with self.lock:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO links (doc_id, chunk_id, updated) VALUES (?, ?, ?)",
+                [(doc_id, cid, now) for cid in chunk_ids])
+            self.conn.commit()
+
+    def resolve_links(self, doc_id: str, chunk_ids: Iterable[str]):
+        with self.lock:
+            self.conn.executemany(
+                "DELETE FROM links WHERE doc_id = ? AND chunk_id = ?", [(doc_id, cid) for cid in chunk_ids])
+            self.conn.commit()
+
+    def deferred_links(self) -> List[Dict[str, Any]]:
+        """Отложенные ссылки, сгруппированные по документам, с манифестом для завершения документа."""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT l.doc_id, d.filename, d.manifest, l.chunk_id "
+                "FROM links l JOIN documents d ON d.doc_id = l.doc_id ORDER BY l.doc_id"
+            ).fetchall()
+        jobs: Dict[str, Dict[str, Any]] = {}
+        for doc_id, filename, manifest, cid in rows:
+            job = jobs.setdefault(doc_id, {
+                "doc_id": doc_id, "filename": filename, "manifest": json.loads(manifest), "links": [],
+            })
+            job["links"].append(cid)
+        return list(jobs.values())
+
+    def finish_document(self, doc_id: str):
+        # Документ целиком в графе вместе с манифестом: журнал по нему больше не нужен
+        with self.lock:
+            self.conn.execute(
+                "UPDATE documents SET status = 'done', updated = ? WHERE doc_id = ?", (time.time(), doc_id))
+            self.conn.execute("DELETE FROM chunks WHERE doc_id = ?", (doc_id,))
+            self.conn.execute("DELETE FROM links WHERE doc_id = ?", (doc_id,))
+            self.conn.commit()
+
+    def unfinished(self, doc_id: str) -> Optional[Dict[str, Any]]:
+        """Незавершённая загрузка документа: сохранённый манифест и ID записанных и отложенных чанков."""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT manifest FROM documents WHERE doc_id = ? AND status != 'done'", (doc_id,)).fetchone()
+            if row is None:
+                return None
+            chunks = self.conn.execute(
+                "SELECT chunk_id, status FROM chunks WHERE doc_id = ?", (doc_id,)).fetchall()
+        return {
+            "manifest": json.loads(row[0]),
+            "written": {cid for cid, status in chunks if status == WRITTEN},
+            "dead": {cid for cid, status in chunks if status == DEAD},
+        }
+
+    def retry_queue(self) -> List[Dict[str, Any]]:
+        """Очередь повторов, сгруппированная по документам, в порядке чанков."""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT c.doc_id, d.filename, d.manifest, c.idx, c.text, c.chunk_id "
+                "FROM chunks c JOIN documents d ON d.doc_id = c.doc_id "
+                "WHERE c.status = 'retry' ORDER BY c.doc_id, c.idx"
+            ).fetchall()
+        jobs: Dict[str, Dict[str, Any]] = {}
+        for doc_id, filename, manifest, idx, text, cid in rows:
+            job = jobs.setdefault(doc_id, {
+                "doc_id": doc_id, "filename": filename, "manifest": json.loads(manifest),
+                "to_delete": set(), "pending": [],
+            })
+            job["pending"].append((idx, text, cid))
+        return list(jobs.values())
+
+    def has_unwritten(self, doc_id: str) -> bool:
+        with self.lock:
+            return self.conn.execute(
+                "SELECT 1 FROM chunks WHERE doc_id = ? AND status != 'written' "
+                "UNION ALL SELECT 1 FROM links WHERE doc_id = ? LIMIT 1", (doc_id, doc_id)
+            ).fetchone() is not None
+
+    def dead_letters(self) -> List[Dict[str, Any]]:
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT c.doc_id, d.filename, c.idx, c.chunk_id, c.attempts, c.stage, c.error "
+                "FROM chunks c JOIN documents d ON d.doc_id = c.doc_id "
+                "WHERE c.status = 'dead' ORDER BY c.doc_id, c.idx"
+            ).fetchall()
+        keys = ("doc_id", "filename", "index", "chunk_id", "attempts", "stage", "error")
+        return [dict(zip(keys, r)) for r in rows]
+
+    def requeue_dead(self) -> int:
+        """Возвращает dead-letter в очередь повторов с обнулённым счётчиком попыток."""
+        with self.lock:
+            cur = self.conn.execute("UPDATE chunks SET status = 'retry', attempts = 0 WHERE status = 'dead'")
+            self.conn.commit()
+        return cur.rowcount
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            docs = dict(self.conn.execute("SELECT status, count(*) FROM documents GROUP BY status").fetchall())
+            chunks = dict(self.conn.execute("SELECT status, count(*) FROM chunks GROUP BY status").fetchall())
+            links = self.conn.execute("SELECT count(*) FROM links").fetchone()[0]
+        return {"documents": docs, "chunks": chunks, "deferred_links": links}
+
+    def clear(self):
+        with self.lock:
+            self.conn.execute("DELETE FROM chunks")
+            self.conn.execute("DELETE FROM links")
+            self.conn.execute("DELETE FROM documents")
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Состояние журнала загрузки: очередь повторов и dead-letter")
+    parser.add_argument("--path", default=CHECKPOINT_PATH)
+    parser.add_argument("--dead", action="store_true", help="Показать чанки в dead-letter с ошибками")
+    parser.add_argument("--requeue-dead", action="store_true",
+                        help="Вернуть dead-letter в очередь повторов (следующий запуск main.py их повторит)")
+    parser.add_argument("--clear", action="store_true", help="Очистить журнал целиком")
+    args = parser.parse_args()
+
+    checkpoint = IngestCheckpoint(args.path)
+    if args.clear:
+        checkpoint.clear()
+        print("🗑️ Журнал очищен.")
+    if args.requeue_dead:
+        print(f"🔁 Возвращено в очередь: {checkpoint.requeue_dead()}")
+    result: Dict[str, Any] = checkpoint.stats()
+    if args.dead:
+        result["dead_letters"] = checkpoint.dead_letters()
+    json.dump(result, sys.stdout, indent=2, ensure_ascii=False)
+    print()
+    checkpoint.close()
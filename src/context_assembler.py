@@ -0,0 +1,72 @@
+import os
+import hashlib
+from typing import List, Dict, Any
+
+from workers import estimate_tokens
+
+# --- КОНФИГУРАЦИЯ ---
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000"))
+# Доля бюджета под факты графа (связи между сущностями), остальное - тексты чанков
+FACTS_BUDGET_SHARE = float(os.getenv("FACTS_BUDGET_SHARE", "0.2"))
+# Меньше этого остатка чанк не обрезаем, а просто не берём
+MIN_TRUNCATED_TOKENS = 64
+
+
+def _fingerprint(text: str) -> str:
+    return hashlib.sha1(" ".join(text.split()).lower().encode("utf-8")).hexdigest()
+
+
+def _truncate(text: str, tokens: int) -> str:
+    # Та же грубая оценка ~4 символа на токен, что и в estimate_tokens
+    cut = text[:tokens * 4]
+    space = cut.rfind(" ")
+    return (cut[:space] if space > len(cut) // 2 else cut) + " …"
+
+
+def assemble_context(sources: List[Dict[str, Any]], budget: int = CONTEXT_TOKEN_BUDGET) -> str:
+    """Упаковывает лучшие факты и тексты чанков в фиксированный бюджет токенов без повторов.
+
+    sources должны быть отсортированы по убыванию релевантности; у источника могут быть
+    поля text, entities и facts (строки вида "A -RELATION-> B").
+    """
+    # 1. Факты: без повторов, в порядке релевантности источников
+    facts, seen_facts = [], set()
+    fact_budget = int(budget * FACTS_BUDGET_SHARE)
+    used = 0
+    for src in sources:
+        for fact in src.get("facts") or []:
+            if fact in seen_facts:
+                continue
+            cost = estimate_tokens(fact) + 1
+            if used + cost > fact_budget:
+                break
+            seen_facts.add(fact)
+            facts.append(fact)
+            used += cost
+
+    # 2. Тексты: одинаковые по содержанию чанки берём один раз, последний влезающий обрезаем
+    parts, seen_texts = [], set()
+    for src in sources:
+        text = src.get("text") or ""
+        fp = _fingerprint(text)
+        if not text.strip() or fp in seen_texts:
+            continue
+        seen_texts.add(fp)
+
+        entities = src.get("entities") or []
+        entities_str = ', '.join(entities) if entities else "(Нет связей)"
+        header = f"Source {len(parts) + 1}:\nEntities: {entities_str}\nText: "
+        remaining = budget - used - estimate_tokens(header)
+        cost = estimate_tokens(text)
+        if cost > remaining:
+            if remaining < MIN_TRUNCATED_TOKENS:
+                break
+            text = _truncate(text, remaining)
+            cost = estimate_tokens(text)
+        parts.append(header + text + "\n\n")
+        used += estimate_tokens(header) + cost
+
+    context = ""
+    if facts:
+        context += "Facts:\n" + "\n".join(f"- {f}" for f in facts) + "\n\n"
+    return context + "".join(parts)
@@ -0,0 +1,278 @@
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import zlib
+import sqlite3
+import hashlib
+import argparse
+import threading
+from typing import Dict, Any, Optional, List, Iterable, Set, Tuple, Callable
+
+import numpy as np
+
+# --- КОНФИГУРАЦИЯ ---
+# 0 = каждый чанк обрабатывается и хранится отдельно, даже если такой текст уже есть в графе
+DEDUP = os.getenv("DEDUP", "1") == "1"
+DEDUP_PATH = os.getenv("DEDUP_PATH", ".cache/dedup.sqlite")
+# Порог оценки сходства Жаккара по словесным шинглам, с которого чанк считается почти-дубликатом
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.9"))
+DEDUP_SHINGLE = int(os.getenv("DEDUP_SHINGLE", "5"))
+# Длина подписи MinHash и число полос LSH (в полосе DEDUP_NUM_PERM / DEDUP_BANDS значений)
+DEDUP_NUM_PERM = int(os.getenv("DEDUP_NUM_PERM", "128"))
+DEDUP_BANDS = int(os.getenv("DEDUP_BANDS", "16"))
+
+# Простое число чуть больше 2^32: (a * x + b) mod P для 32-битных x, a, b не переполняет uint64
+_PRIME = np.uint64((1 << 32) + 15)
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+# Канонический чанк годится, если он уже в графе или зарегистрирован текущим запуском
+_USABLE = "(c.status = 'written' OR c.run = ?)"
+
+
+def normalize_text(text: str) -> str:
+    """Регистр, пунктуация и пробелы не влияют на сравнение чанков."""
+    return " ".join(_WORD_RE.findall(text.lower()))
+
+
+def _permutations(num_perm: int) -> Tuple[np.ndarray, np.ndarray]:
+    # Фиксированное зерно: подписи из разных запусков и процессов сравнимы между собой
+    rng = np.random.RandomState(1)
+    a = rng.randint(1, 1 << 32, size=num_perm, dtype=np.uint64)
+    b = rng.randint(0, 1 << 32, size=num_perm, dtype=np.uint64)
+    return a, b
+
+
+def minhash(normalized: str, num_perm: int = DEDUP_NUM_PERM, shingle: int = DEDUP_SHINGLE,
+            perms: Optional[Tuple[np.ndarray, np.ndarray]] = None) -> np.ndarray:
+    """Подпись MinHash (uint32[num_perm]) по множеству словесных шинглов текста."""
+    words = normalized.split()
+    shingles = {" ".join(words[i:i + shingle]) for i in range(max(1, len(words) - shingle + 1))}
+    hashes = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles), dtype=np.uint64, count=len(shingles))
+    a, b = perms if perms is not None else _permutations(num_perm)
+    values = (hashes[:, None] * a[None, :] + b[None, :]) % _PRIME
+    return (values.min(axis=0) & np.uint64(0xFFFFFFFF)).astype(np.uint32)
+
+
+def band_buckets(signature: np.ndarray, bands: int = DEDUP_BANDS) -> List[int]:
+    """Ключи корзин LSH: хэш каждой полосы подписи вместе с её номером (int64 для SQLite)."""
+    rows = len(signature) // bands
+    return [
+        int.from_bytes(hashlib.blake2b(bytes([band]) + signature[band * rows:(band + 1) * rows].tobytes(),
+                                       digest_size=8).digest(), "big", signed=True)
+        for band in range(bands)
+    ]
+
+
+class DedupIndex:
+    """Индекс канонических чанков корпуса в SQLite: точный хэш текста + MinHash/LSH для почти-дубликатов.
+
+    Канонический чанк регистрируется, как только попадает в план загрузки (статус pending текущего
+    запуска), и становится постоянным после записи в граф (mark_written). Pending-записи прошлых
+    запусков не используются: их чанк мог так и не попасть в граф.
+    """
+
+    def __init__(self, path: str = DEDUP_PATH, threshold: float = DEDUP_THRESHOLD,
+                 num_perm: int = DEDUP_NUM_PERM, bands: int = DEDUP_BANDS, shingle: int = DEDUP_SHINGLE,
+                 run: Optional[str] = None):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        if num_perm % bands:
+            raise ValueError("DEDUP_NUM_PERM должно делиться на DEDUP_BANDS")
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.shingle = shingle
+        self.perms = _permutations(num_perm)
+        # Процессы одной шардированной загрузки используют общий run: pending-чанки соседей тоже годятся
+        self.run = run or uuid.uuid4().hex
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS canonical (
+                chunk_id TEXT PRIMARY KEY,
+                doc_id TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                signature BLOB NOT NULL,
+                status TEXT NOT NULL,
+                run TEXT,
+                updated REAL NOT NULL
+            )
+        """)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS buckets (
+                bucket INTEGER NOT NULL,
+                chunk_id TEXT NOT NULL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS canonical_hash ON canonical(text_hash)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS buckets_bucket ON buckets(bucket)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS buckets_chunk ON buckets(chunk_id)")
+        # Счётчики текущего процесса
+        self.exact = 0
+        self.near = 0
+        self.unique = 0
+
+    def _match(self, text_hash: str, signature: np.ndarray, buckets: List[int],
+               own_id: str, doc_id: str) -> Tuple[Optional[str], str]:
+        # Свой ID в приоритете: чанк, который уже канонический, не становится дубликатом другого
+        row = self.conn.execute(
+            f"SELECT c.chunk_id FROM canonical c WHERE c.text_hash = ? AND {_USABLE} "
+            f"ORDER BY c.chunk_id = ? DESC LIMIT 1",
+            (text_hash, self.run, own_id),
+        ).fetchone()
+        if row is not None:
+            return row[0], "exact"
+        # Почти-дубликаты ищем только в других документах: отредактированный или сдвинутый чанк
+        # похож на свою прежнюю версию, и правка иначе не попала бы в граф
+        marks = ",".join("?" * len(buckets))
+        candidates = self.conn.execute(
+            f"SELECT DISTINCT c.chunk_id, c.signature FROM buckets b JOIN canonical c ON c.chunk_id = b.chunk_id "
+            f"WHERE b.bucket IN ({marks}) AND {_USABLE} AND (c.doc_id != ? OR c.chunk_id = ?)",
+            [*buckets, self.run, doc_id, own_id],
+        ).fetchall()
+        if any(chunk_id == own_id for chunk_id, _ in candidates):
+            return own_id, "near"
+        best, best_score = None, self.threshold
+        for chunk_id, blob in candidates:
+            # Доля совпавших минимумов - несмещённая оценка сходства Жаккара
+            score = float(np.mean(np.frombuffer(blob, dtype=np.uint32) == signature))
+            if score >= best_score:
+                best, best_score = chunk_id, score
+        return best, "near"
+
+    def resolve(self, doc_id: str, chunks: List[Tuple[str, str]],
+                is_pending: Callable[[str], bool]) -> List[Optional[str]]:
+        """Для каждого (chunk_id, text) - ID канонического чанка, если текст дублирует уже известный, иначе None.
+
+        Уникальные чанки сразу регистрируются каноническими (в порядке следования, поэтому повтор
+        внутри той же пачки тоже находится). Чанк, который писать не нужно, уже в графе - он постоянный.
+        """
+        result: List[Optional[str]] = []
+        now = time.time()
+        # Подписи считаем до блокировки: она нужна только на сверку и регистрацию
+        prepared = []
+        for chunk_id, text in chunks:
+            normalized = normalize_text(text)
+            signature = minhash(normalized, self.num_perm, self.shingle, self.perms)
+            prepared.append((chunk_id, hashlib.sha256(normalized.encode("utf-8")).hexdigest(), signature,
+                             band_buckets(signature, self.bands)))
+        with self.lock:
+            # Блокировка записи сразу: параллельные процессы загрузки (--shards) не зарегистрируют
+            # один и тот же текст каноническим дважды
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                for chunk_id, text_hash, signature, buckets in prepared:
+                    canonical, kind = self._match(text_hash, signature, buckets, chunk_id, doc_id)
+                    if canonical is not None and canonical != chunk_id:
+                        if kind == "exact":
+                            self.exact += 1
+                        else:
+                            self.near += 1
+                        result.append(canonical)
+                        continue
+                    self.unique += 1
+                    result.append(None)
+                    pending = is_pending(chunk_id)
+                    self.conn.execute(
+                        "INSERT OR REPLACE INTO canonical (chunk_id, doc_id, text_hash, signature, status, run, updated) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (chunk_id, doc_id, text_hash, signature.tobytes(), "pending" if pending else "written",
+                         self.run if pending else None, now),
+                    )
+                    self.conn.execute("DELETE FROM buckets WHERE chunk_id = ?", (chunk_id,))
+                    self.conn.executemany("INSERT INTO buckets (bucket, chunk_id) VALUES (?, ?)",
+                                          [(bucket, chunk_id) for bucket in buckets])
+            except BaseException:
+                self.conn.rollback()
+                raise
+            self.conn.commit()
+        return result
+
+    def mark_written(self, chunk_ids: Iterable[str]):
+        rows = [(time.time(), cid) for cid in chunk_ids]
+        if not rows:
+            return
+        with self.lock:
+            self.conn.executemany(
+                "UPDATE canonical SET status = 'written', run = NULL, updated = ? WHERE chunk_id = ?", rows)
+            self.conn.commit()
+
+    def known(self, chunk_ids: Iterable[str]) -> Set[str]:
+        """Какие из ID - записанные в граф канонические чанки (свои или чужие, на которые ссылаются дубликаты)."""
+        chunk_ids, found = list(chunk_ids), set()
+        with self.lock:
+            for i in range(0, len(chunk_ids), 500):
+                part = chunk_ids[i:i + 500]
+                rows = self.conn.execute(
+                    f"SELECT chunk_id FROM canonical WHERE status = 'written' "
+                    f"AND chunk_id IN ({','.join('?' * len(part))})", part,
+                ).fetchall()
+                found.update(r[0] for r in rows)
+        return found
+
+    def forget(self, doc_id: str, chunk_ids: Iterable[str]):
+        """Чанки документа отвязаны от него и могли быть удалены из графа: больше не предлагаем их как канонические.
+
+        Ссылки на чужие канонические чанки не трогаем - владелец их по-прежнему держит. Записи этого
+        запуска остаются: полная переобработка удаляет и тут же заново пишет чанки с теми же ID.
+        """
+        rows = [(cid, doc_id, self.run) for cid in chunk_ids]
+        if not rows:
+            return
+        with self.lock:
+            self.conn.executemany(
+                "DELETE FROM canonical WHERE chunk_id = ? AND doc_id = ? AND (run IS NULL OR run != ?)", rows)
+            self.conn.executemany(
+                "DELETE FROM buckets WHERE chunk_id = ? AND chunk_id NOT IN (SELECT chunk_id FROM canonical)",
+                [(cid,) for cid, _, _ in rows])
+            self.conn.commit()
+
+    def prune(self) -> int:
+        """Удаляет pending-записи прошлых запусков (их чанки так и не были записаны)."""
+        with self.lock:
+            cur = self.conn.execute(
+                "DELETE FROM canonical WHERE status = 'pending' AND run != ?", (self.run,))
+            self.conn.execute("DELETE FROM buckets WHERE chunk_id NOT IN (SELECT chunk_id FROM canonical)")
+            self.conn.commit()
+        return cur.rowcount
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            statuses = dict(self.conn.execute("SELECT status, count(*) FROM canonical GROUP BY status").fetchall())
+        return {
+            "canonical": statuses,
+            "run_unique": self.unique,
+            "run_exact_duplicates": self.exact,
+            "run_near_duplicates": self.near,
+        }
+
+    def clear(self):
+        with self.lock:
+            self.conn.execute("DELETE FROM canonical")
+            self.conn.execute("DELETE FROM buckets")
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Индекс канонических чанков для поиска дубликатов")
+    parser.add_argument("--path", default=DEDUP_PATH)
+    parser.add_argument("--prune", action="store_true", help="Удалить незаписанные кандидаты прошлых запусков")
+    parser.add_argument("--clear", action="store_true", help="Очистить индекс (нужно после reset_and_init.py)")
+    args = parser.parse_args()
+
+    index = DedupIndex(args.path)
+    if args.clear:
+        index.clear()
+        print("🗑️ Индекс очищен.")
+    elif args.prune:
+        print(f"🗑️ Удалено записей: {index.prune()}")
+    json.dump(index.stats(), sys.stdout, indent=2, ensure_ascii=False)
+    print()
+    index.close()
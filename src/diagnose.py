@@ -1,10 +1,16 @@
 import os
+import sys
 import json
 import uuid
 import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List
 from dotenv import load_dotenv
 from neo4j import GraphDatabase
 import google.generativeai as genai
+from index_manager import read_registry, status as index_status, EMBEDDING_MODEL
+from metrics import percentiles
 
 load_dotenv()
 
@@ -12,6 +18,151 @@ load_dotenv()
 MEMGRAPH_URI = os.getenv("MEMGRAPH_URI", "bolt://localhost:7687")
 MEMGRAPH_AUTH = (os.getenv("MEMGRAPH_USER", ""), os.getenv("MEMGRAPH_PASSWORD", ""))
 genai.configure(api_key=os.environ["GEMINI_API_KEY"])
+# Режим --probe: число поисков каждого вида и сколько выполняется одновременно
+PROBE_SAMPLES = int(os.getenv("PROBE_SAMPLES", "200"))
+PROBE_CONCURRENCY = int(os.getenv("PROBE_CONCURRENCY", "8"))
+# Пороги: при нарушении любого код выхода 1 (отрицательное значение = порог не проверяется)
+PROBE_THRESHOLDS = {
+    "max_vector_p95_ms": float(os.getenv("PROBE_MAX_VECTOR_P95_MS", "200")),
+    "max_hybrid_p95_ms": float(os.getenv("PROBE_MAX_HYBRID_P95_MS", "1000")),
+    "min_qps": float(os.getenv("PROBE_MIN_QPS", "-1")),
+    "max_bad_embeddings": int(os.getenv("PROBE_MAX_BAD_EMBEDDINGS", "0")),
+    "max_orphan_entities": int(os.getenv("PROBE_MAX_ORPHAN_ENTITIES", "-1")),
+    "max_index_fill": float(os.getenv("PROBE_MAX_INDEX_FILL", "0.9")),
+}
+
+# Вопросы пробы - эмбеддинги уже сохранённых чанков: Gemini не вызывается, а векторы реальные
+SAMPLE_EMBEDDINGS = """
+MATCH (c:Chunk)
+WHERE c.embedding IS NOT NULL AND size(c.embedding) = $dimension
+RETURN c.embedding AS embedding
+ORDER BY c.id
+LIMIT $limit
+"""
+
+HEALTH_COUNTS = """
+MATCH (c:Chunk)
+WITH count(c) AS chunks, sum(CASE WHEN c.embedding IS NULL OR size(c.embedding) = 0 THEN 1 ELSE 0 END) AS missing
+OPTIONAL MATCH (e:Entity)
+WHERE NOT (e)<-[:MENTIONS]-(:Chunk)
+WITH chunks, missing, count(e) AS orphan_entities
+OPTIONAL MATCH (o:Chunk)
+WHERE NOT (o)<-[:HAS_CHUNK]-(:Document)
+RETURN chunks, missing, orphan_entities, count(o) AS orphan_chunks
+"""
+
+
+def _load(run_one: Callable, vectors: List[List[float]], samples: int, concurrency: int) -> Dict[str, Any]:
+    """samples вызовов run_one(vector) в concurrency потоков: перцентили задержки, пропускная способность, ошибки."""
+    latencies: List[float] = []
+    errors: List[str] = []
+
+    def call(n: int):
+        started = time.perf_counter()
+        try:
+            run_one(vectors[n % len(vectors)])
+        except Exception as e:
+            errors.append(str(e))
+            return
+        latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        list(pool.map(call, range(samples)))
+    elapsed = time.perf_counter() - started
+    return {
+        "latency": percentiles(latencies),
+        "throughput_qps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "errors": len(errors),
+        "first_error": errors[0] if errors else None,
+    }
+
+
+def _breaches(report: Dict[str, Any], thresholds: Dict[str, float]) -> List[str]:
+    found = []
+
+    def over(name: str, value, limit, fmt: str = "{}"):
+        if limit is not None and limit >= 0 and value is not None and value > limit:
+            found.append(f"{name}: {fmt.format(value)} > {fmt.format(limit)}")
+
+    for kind, limit in (("vector", thresholds["max_vector_p95_ms"]), ("hybrid", thresholds["max_hybrid_p95_ms"])):
+        result = report["searches"][kind]
+        if result["errors"]:
+            found.append(f"{kind}: ошибок {result['errors']} ({result['first_error']})")
+        over(f"{kind} p95, мс", result["latency"].get("p95_ms"), limit)
+        if thresholds["min_qps"] >= 0 and result["throughput_qps"] < thresholds["min_qps"]:
+            found.append(f"{kind} пропускная способность: {result['throughput_qps']} < {thresholds['min_qps']} запр/с")
+    health = report["health"]
+    over("чанков без вектора или с неверной длиной", health["missing_embeddings"] + health["wrong_length_embeddings"],
+         thresholds["max_bad_embeddings"])
+    over("сущностей без упоминаний", health["orphan_entities"], thresholds["max_orphan_entities"])
+    over("заполнение индекса", report["index"]["fill"], thresholds["max_index_fill"], "{:.0%}")
+    return found
+
+
+def probe(samples: int = PROBE_SAMPLES, concurrency: int = PROBE_CONCURRENCY,
+          thresholds: Dict[str, float] = None) -> Dict[str, Any]:
+    """Нагрузочная и health-проба поиска: те же запросы, что у query.py, на векторах из базы."""
+    import query
+    thresholds = {**PROBE_THRESHOLDS, **(thresholds or {})}
+    driver = query.get_driver()
+    with driver.session() as session:
+        index = index_status(session)
+        health = dict(session.run(HEALTH_COUNTS).single())
+        vectors = [r["embedding"] for r in session.run(
+            SAMPLE_EMBEDDINGS, dimension=index["dimension"], limit=max(1, samples))]
+        index_name = query.VECTOR_INDEX.get(session)
+    health["missing_embeddings"] = health.pop("missing")
+    health["wrong_length_embeddings"] = sum(n for d, n in index["chunk_dimensions"].items() if d != index["dimension"])
+    report: Dict[str, Any] = {
+        "index": {k: index[k] for k in ("active", "dimension", "expected_dimension", "capacity", "size",
+                                       "fill", "memory_mb", "recommended_capacity", "problems")},
+        "health": health,
+        "config": {"samples": samples, "concurrency": concurrency, "top_k": query.TOP_K,
+                   "graph_hops": query.GRAPH_HOPS, "hybrid_candidates": query.HYBRID_CANDIDATES},
+        "thresholds": thresholds,
+    }
+    if not vectors:
+        report["searches"] = {kind: {"latency": {"count": 0}, "throughput_qps": 0.0, "errors": 1,
+                                     "first_error": "нет чанков с эмбеддингами"} for kind in ("vector", "hybrid")}
+        report["breaches"] = _breaches(report, thresholds)
+        return report
+
+    def vector_search(vector):
+        with driver.session() as session:
+            list(session.run(query.VECTOR_QUERY, index=index_name, k=query.TOP_K, vector=vector))
+
+    def hybrid_search(vector):
+        with driver.session() as session:
+            list(session.run(query.HYBRID_QUERY.format(hops=int(query.GRAPH_HOPS)),
+                             index=index_name, k=query.TOP_K, vector=vector,
+                             limit=query.HYBRID_CANDIDATES, facts_per_chunk=query.FACTS_PER_CHUNK))
+
+    report["searches"] = {
+        "vector": _load(vector_search, vectors, samples, concurrency),
+        "hybrid": _load(hybrid_search, vectors, samples, concurrency),
+    }
+    report["breaches"] = _breaches(report, thresholds)
+    return report
+
+
+def print_probe(report: Dict[str, Any]):
+    index, health = report["index"], report["health"]
+    fill = f"{index['fill']:.0%}" if index["fill"] is not None else "?"
+    print(f"📇 Индекс {index['active']}: dimension={index['dimension']}, {index['size']}/{index['capacity']} "
+          f"({fill}), ~{index['memory_mb']} МБ")
+    print(f"📊 Чанков: {health['chunks']}, без вектора: {health['missing_embeddings']}, "
+          f"неверной длины: {health['wrong_length_embeddings']}, без документа: {health['orphan_chunks']}, "
+          f"сущностей без упоминаний: {health['orphan_entities']}")
+    for kind, result in report["searches"].items():
+        lat = result["latency"]
+        print(f"🔎 {kind}: p50={lat.get('p50_ms')}мс p95={lat.get('p95_ms')}мс p99={lat.get('p99_ms')}мс, "
+              f"{result['throughput_qps']} запр/с при concurrency={report['config']['concurrency']}, "
+              f"ошибок {result['errors']}")
+    for breach in report["breaches"]:
+        print(f"❌ {breach}")
+    if not report["breaches"]:
+        print("✅ Все пороги соблюдены.")
 
 def diagnose():
     print("🚀 ЗАПУСК ДИАГНОСТИКИ...")
@@ -32,7 +183,7 @@ def diagnose():
             
             # Эмбеддинг
             vector = genai.embed_content(
-                model="models/text-embedding-004",
+                model=EMBEDDING_MODEL,
                 content=text,
                 task_type="retrieval_document"
             )['embedding']
@@ -64,17 +215,21 @@ def diagnose():
         # 3. ПРОВЕРКА ПОИСКА (RAG)
         print("\n🔎 Тест поиска: 'What is Memgraph?'")
         q_vector = genai.embed_content(
-            model="models/text-embedding-004",
+            model=EMBEDDING_MODEL,
             content="What is Memgraph?",
             task_type="retrieval_query"
         )['embedding']
         
+        # Имя активной версии индекса - из реестра (index_manager.py)
+        index_name = read_registry(session)["active"]
+        print(f"   📇 Активный индекс: {index_name}")
+
         # Пробуем разные сигнатуры vector_search, так как версии меняются
         search_queries = [
             # Вариант 1 (Memgraph 2.15+ native): index, limit, vector
-            f"CALL vector_search.search('chunk_vector_index', 5, {json.dumps(q_vector)}) YIELD node, score RETURN node.text, score",
+            f"CALL vector_search.search('{index_name}', 5, {json.dumps(q_vector)}) YIELD node, score RETURN node.text, score",
             # Вариант 2 (Старый native): index, vector, limit
-            f"CALL vector_search.search('chunk_vector_index', {json.dumps(q_vector)}, 5) YIELD node, score RETURN node.text, score"
+            f"CALL vector_search.search('{index_name}', {json.dumps(q_vector)}, 5) YIELD node, score RETURN node.text, score"
         ]
         
         success = False
@@ -92,10 +247,36 @@ def diagnose():
                 print(f"   ❌ Метод #{i+1} не подошел: {e}")
         
         if not success:
-            print("\n💡 Если методы не подошли, возможно индекс 'chunk_vector_index' сломан.")
-            print("   Попробуй выполнить: python src/reset_and_init.py")
+            print(f"\n💡 Если методы не подошли, возможно индекс '{index_name}' сломан.")
+            print("   Попробуй выполнить: python src/index_manager.py --check")
+            print("   или пересобрать его: python src/fix_index.py")
 
     driver.close()
 
 if __name__ == "__main__":
-    diagnose()
+    parser = argparse.ArgumentParser(description="Диагностика базы; --probe - проверка задержки и здоровья поиска")
+    parser.add_argument("--probe", action="store_true",
+                        help="Нагрузочная проба поиска и health-счётчики; код выхода 1 при нарушении порогов")
+    parser.add_argument("--samples", type=int, default=PROBE_SAMPLES)
+    parser.add_argument("--concurrency", type=int, default=PROBE_CONCURRENCY)
+    for name, default in PROBE_THRESHOLDS.items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=type(default), default=default,
+                            help="Порог (отрицательное значение = не проверять)")
+    parser.add_argument("--json", action="store_true", help="Вывести отчёт пробы в JSON")
+    parser.add_argument("--output", help="Сохранить JSON-отчёт пробы в файл")
+    args = parser.parse_args()
+
+    if not args.probe:
+        diagnose()
+        sys.exit(0)
+
+    report = probe(args.samples, args.concurrency, {name: getattr(args, name) for name in PROBE_THRESHOLDS})
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False, default=str)
+    if args.json:
+        json.dump(report, sys.stdout, indent=2, ensure_ascii=False, default=str)
+        print()
+    else:
+        print_probe(report)
+    sys.exit(1 if report["breaches"] else 0)
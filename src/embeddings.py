@@ -0,0 +1,194 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from array import array
+from collections import OrderedDict
+from typing import List, Dict, Optional, Iterable
+
+import google.generativeai as genai
+
+from metrics import gemini_request
+
+# --- КОНФИГУРАЦИЯ ---
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", ".cache/embeddings.sqlite")
+EMBEDDING_CACHE_MAX_MB = int(os.getenv("EMBEDDING_CACHE_MAX_MB", "2048"))
+# Gemini принимает до 100 текстов в одном batch-запросе
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "100"))
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "1024"))
+# Уменьшенная размерность векторов (output_dimensionality модели; 0 = родная размерность модели).
+# Меньше размерность - меньше памяти на чанк в Memgraph; индекс пересобирается index_manager.py
+EMBEDDING_DIM = int(os.getenv("EMBEDDING_DIM", "0"))
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def batched(items: List, size: int) -> List[List]:
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+class EmbeddingCache:
+    """Дисковый кэш векторов в SQLite по ключу (model, task_type, sha256(text)) с вытеснением по размеру."""
+
+    def __init__(self, path: str = EMBEDDING_CACHE_PATH, max_mb: int = EMBEDDING_CACHE_MAX_MB):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.max_bytes = max_mb * 1024 * 1024
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                task_type TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                accessed REAL NOT NULL,
+                PRIMARY KEY (model, task_type, text_hash)
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS embeddings_accessed ON embeddings(accessed)")
+        self.bytes = self.conn.execute("SELECT COALESCE(SUM(length(vector)), 0) FROM embeddings").fetchone()[0]
+
+    def get_many(self, model: str, task_type: str, hashes: Iterable[str]) -> Dict[str, List[float]]:
+        hashes = list(set(hashes))
+        found = {}
+        with self.lock:
+            # SQLite ограничивает число параметров, поэтому идём порциями
+            for part in batched(hashes, 500):
+                marks = ",".join("?" * len(part))
+                rows = self.conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings "
+                    f"WHERE model = ? AND task_type = ? AND text_hash IN ({marks})",
+                    [model, task_type, *part],
+                ).fetchall()
+                for h, blob in rows:
+                    vec = array("f")
+                    vec.frombytes(blob)
+                    found[h] = vec.tolist()
+                if rows:
+                    # Отмечаем только найденные: их может быть меньше, чем запрошено
+                    self.conn.execute(
+                        f"UPDATE embeddings SET accessed = ? "
+                        f"WHERE model = ? AND task_type = ? AND text_hash IN ({','.join('?' * len(rows))})",
+                        [time.time(), model, task_type, *[h for h, _ in rows]],
+                    )
+            self.conn.commit()
+        return found
+
+    def put_many(self, model: str, task_type: str, items: Dict[str, List[float]]):
+        if not items:
+            return
+        now = time.time()
+        rows = [(model, task_type, h, array("f", vec).tobytes(), now) for h, vec in items.items() if vec]
+        with self.lock:
+            # REPLACE перезаписывает уже сохранённый вектор: его байты не должны считаться дважды
+            replaced = 0
+            for part in batched([r[2] for r in rows], 500):
+                marks = ",".join("?" * len(part))
+                replaced += self.conn.execute(
+                    f"SELECT COALESCE(SUM(length(vector)), 0) FROM embeddings "
+                    f"WHERE model = ? AND task_type = ? AND text_hash IN ({marks})",
+                    [model, task_type, *part],
+                ).fetchone()[0]
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, task_type, text_hash, vector, accessed) "
+                "VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+            self.bytes += sum(len(r[3]) for r in rows) - replaced
+            if self.bytes > self.max_bytes:
+                self._evict()
+            self.conn.commit()
+
+    def _evict(self):
+        # Удаляем самые давно использованные записи, пока не уложимся в 90% лимита
+        target = self.max_bytes * 0.9
+        while self.bytes > target:
+            rows = self.conn.execute(
+                "SELECT rowid, length(vector) FROM embeddings ORDER BY accessed LIMIT 1000"
+            ).fetchall()
+            if not rows:
+                self.bytes = 0
+                break
+            self.conn.executemany("DELETE FROM embeddings WHERE rowid = ?", [(r[0],) for r in rows])
+            self.bytes -= sum(r[1] for r in rows)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+class EmbeddingService:
+    """Единая точка получения эмбеддингов: пакетные запросы, дисковый кэш и LRU для вопросов."""
+
+    def __init__(self, model: str, cache: Optional[EmbeddingCache] = None, scheduler=None,
+                 client=genai, batch_size: int = EMBEDDING_BATCH_SIZE,
+                 query_cache_size: int = QUERY_CACHE_SIZE, dimensions: int = EMBEDDING_DIM):
+        self.model = model
+        self.dimensions = dimensions
+        # Ключ кэша и манифестов: векторы разной размерности не должны подменять друг друга
+        self.model_key = f"{model}@{dimensions}" if dimensions else model
+        self.cache = cache if cache is not None else EmbeddingCache()
+        self.scheduler = scheduler
+        self.client = client
+        self.batch_size = batch_size
+        self.query_cache_size = query_cache_size
+        self.query_cache: "OrderedDict[str, List[float]]" = OrderedDict()
+        self.query_lock = threading.Lock()
+        self.api_calls = 0
+
+    def _call_api(self, texts: List[str], task_type: str) -> List[List[float]]:
+        kwargs = dict(model=self.model, content=texts, task_type=task_type)
+        if self.dimensions:
+            kwargs["output_dimensionality"] = self.dimensions
+        self.api_calls += 1
+        if self.scheduler is not None:
+            tokens = sum(max(1, len(t) // 4) for t in texts)
+            result = self.scheduler.call(self.client.embed_content, tokens=tokens, **kwargs)
+        else:
+            gemini_request(self.model, sum(max(1, len(t) // 4) for t in texts))
+            result = self.client.embed_content(**kwargs)
+        return result["embedding"]
+
+    def embed(self, texts: List[str], task_type: str = "retrieval_document") -> List[List[float]]:
+        hashes = [text_hash(t) for t in texts]
+        found = self.cache.get_many(self.model_key, task_type, hashes)
+
+        # Одинаковые тексты внутри пачки считаем один раз
+        missing: Dict[str, str] = {}
+        for h, t in zip(hashes, texts):
+            if h not in found and h not in missing:
+                missing[h] = t
+
+        if missing:
+            miss_hashes = list(missing)
+            fresh: Dict[str, List[float]] = {}
+            for part in batched(miss_hashes, self.batch_size):
+                vectors = self._call_api([missing[h] for h in part], task_type)
+                fresh.update(zip(part, vectors))
+            self.cache.put_many(self.model_key, task_type, fresh)
+            found.update(fresh)
+
+        return [found[h] for h in hashes]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embed(texts, "retrieval_document")
+
+    def embed_query(self, text: str) -> List[float]:
+        with self.query_lock:
+            if text in self.query_cache:
+                self.query_cache.move_to_end(text)
+                return self.query_cache[text]
+        vector = self.embed([text], "retrieval_query")[0]
+        with self.query_lock:
+            self.query_cache[text] = vector
+            if len(self.query_cache) > self.query_cache_size:
+                self.query_cache.popitem(last=False)
+        return vector
+
+    def close(self):
+        self.cache.close()
@@ -0,0 +1,108 @@
+import os
+import re
+import json
+import difflib
+import threading
+import unicodedata
+from typing import Dict, Iterable, List, Optional
+
+# --- КОНФИГУРАЦИЯ ---
+ENTITY_RESOLUTION = os.getenv("ENTITY_RESOLUTION", "1") == "1"
+# Файл с ручными синонимами: {"alias": "Canonical Name", ...}
+ENTITY_ALIASES_PATH = os.getenv("ENTITY_ALIASES_PATH", "")
+# Порог нечёткого сравнения ключей (0 = выключено, 0.9 - осторожно, 0.8 - агрессивно)
+ENTITY_FUZZY_CUTOFF = float(os.getenv("ENTITY_FUZZY_CUTOFF", "0"))
+
+# Хвосты, которые не меняют сущность: "Memgraph DB" == "Memgraph", "Google Inc." == "Google"
+NOISE_SUFFIXES = {"db", "inc", "ltd", "llc", "corp", "corporation", "co", "gmbh", "plc"}
+
+LOAD_ENTITIES = """
+MATCH (e:Entity)
+RETURN e.id AS id, e.aliases AS aliases
+"""
+
+
+def normalize_key(name: str) -> str:
+    """Ключ сравнения: регистр, Unicode, пунктуация, пробелы и шумовые хвосты не важны."""
+    key = unicodedata.normalize("NFKC", name).casefold()
+    key = re.sub(r"[^\w\s]", " ", key)
+    words = key.split()
+    while len(words) > 1 and words[-1] in NOISE_SUFFIXES:
+        words.pop()
+    if len(words) > 1 and words[0] == "the":
+        words.pop(0)
+    return " ".join(words)
+
+
+class EntityResolver:
+    """Индекс известных сущностей в памяти: сырое имя из LLM -> канонический id узла Entity."""
+
+    def __init__(self, fuzzy_cutoff: float = ENTITY_FUZZY_CUTOFF):
+        self.fuzzy_cutoff = fuzzy_cutoff
+        self.by_key: Dict[str, str] = {}
+        # Кандидаты для нечёткого поиска группируются по первой букве ключа
+        self.buckets: Dict[str, List[str]] = {}
+        self.lock = threading.Lock()
+        self.merged = 0
+
+    def _register(self, key: str, canonical: str):
+        if not key or key in self.by_key:
+            return
+        self.by_key[key] = canonical
+        self.buckets.setdefault(key[0], []).append(key)
+
+    def add(self, canonical: str, aliases: Iterable[str] = ()):
+        with self.lock:
+            self._register(normalize_key(canonical), canonical)
+            for alias in aliases or ():
+                self._register(normalize_key(alias), canonical)
+
+    def load_aliases(self, path: str = ENTITY_ALIASES_PATH):
+        if not path or not os.path.exists(path):
+            return
+        with open(path, "r", encoding="utf-8") as f:
+            for alias, canonical in json.load(f).items():
+                self.add(canonical, [alias])
+
+    def load(self, session) -> int:
+        """Загружает все сущности (и сохранённые синонимы) из Memgraph."""
+        count = 0
+        for r in session.run(LOAD_ENTITIES):
+            self.add(r["id"], r["aliases"] or [])
+            count += 1
+        return count
+
+    def _lookup(self, key: str) -> Optional[str]:
+        if key in self.by_key:
+            return self.by_key[key]
+        if self.fuzzy_cutoff > 0:
+            match = difflib.get_close_matches(key, self.buckets.get(key[0], []), n=1, cutoff=self.fuzzy_cutoff)
+            if match:
+                # Запоминаем найденное, чтобы не повторять нечёткий поиск
+                self.by_key[key] = self.by_key[match[0]]
+                return self.by_key[key]
+        return None
+
+    def resolve_batch(self, names: Iterable[str]) -> Dict[str, str]:
+        """Сопоставляет пачку сырых имён каноническим id; новые имена становятся каноническими."""
+        mapping: Dict[str, str] = {}
+        with self.lock:
+            for raw in names:
+                if raw in mapping:
+                    continue
+                name = raw.strip()
+                key = normalize_key(name)
+                if not key:
+                    mapping[raw] = name
+                    continue
+                canonical = self._lookup(key)
+                if canonical is None:
+                    canonical = name
+                    self._register(key, canonical)
+                elif canonical != name:
+                    self.merged += 1
+                mapping[raw] = canonical
+        return mapping
+
+    def __len__(self) -> int:
+        return len(set(self.by_key.values()))
@@ -0,0 +1,207 @@
+import os
+import re
+import json
+from typing import Dict, Any, Optional, List
+
+import google.generativeai as genai
+
+from extraction_cache import ExtractionCache, extraction_key, prompt_hash
+from workers import estimate_tokens
+from metrics import gemini_request
+
+# Системный промпт
+SYSTEM_PROMPT = """
+You are an expert Knowledge Graph Engineer.
+Extract entities and relationships from the text.
+
+STRICT JSON OUTPUT FORMAT (NO MARKDOWN, NO COMMENTS):
+{
+  "entities": [
+    {"id": "Entity Name", "type": "Category"}
+  ],
+  "relations": [
+    {"source": "Entity Name", "target": "Entity Name", "type": "RELATION_TYPE"}
+  ]
+}
+Normalize IDs. Use SCREAMING_SNAKE_CASE for relation types.
+"""
+
+# Промпт для пакетного режима: несколько чанков в одном запросе, каждый элемент помечен номером чанка
+MULTI_CHUNK_PROMPT = """
+You are an expert Knowledge Graph Engineer.
+The input contains several independent text chunks. Each chunk starts with a line "### CHUNK <n>".
+Extract entities and relationships from EACH chunk separately.
+
+STRICT JSON OUTPUT FORMAT (NO MARKDOWN, NO COMMENTS):
+{
+  "entities": [
+    {"chunk": 0, "id": "Entity Name", "type": "Category"}
+  ],
+  "relations": [
+    {"chunk": 0, "source": "Entity Name", "target": "Entity Name", "type": "RELATION_TYPE"}
+  ]
+}
+Every entity and relation MUST have the integer "chunk" of the chunk it was found in.
+If an entity appears in several chunks, repeat it for each chunk.
+Normalize IDs. Use SCREAMING_SNAKE_CASE for relation types.
+"""
+
+GENERATION_CONFIG = {"temperature": 0.1, "response_mime_type": "application/json"}
+
+# --- КОНФИГУРАЦИЯ ---
+# Сколько чанков упаковывать в один запрос (1 = по одному, как раньше) и бюджет токенов на пачку
+EXTRACTION_PACK_SIZE = int(os.getenv("EXTRACTION_PACK_SIZE", "1"))
+EXTRACTION_PACK_TOKENS = int(os.getenv("EXTRACTION_PACK_TOKENS", "4096"))
+
+
+def empty_graph() -> Dict[str, Any]:
+    return {"entities": [], "relations": []}
+
+
+def parse_graph_response(raw: str) -> Dict[str, Any]:
+    """Разбирает ответ модели; бросает ValueError, если это не граф."""
+    if "```" in raw:
+        raw = re.sub(r"```json|```", "", raw).strip()
+    data = json.loads(raw)
+    if not isinstance(data, dict):
+        raise ValueError("ответ модели не является JSON-объектом")
+    entities = data.get("entities", [])
+    relations = data.get("relations", [])
+    if not isinstance(entities, list) or not isinstance(relations, list):
+        raise ValueError("entities/relations должны быть списками")
+    return {
+        "entities": [e for e in entities if isinstance(e, dict)],
+        "relations": [r for r in relations if isinstance(r, dict)],
+    }
+
+
+def split_packed_response(graph: Dict[str, Any], count: int) -> List[Dict[str, Any]]:
+    """Раскладывает ответ пакетного запроса по чанкам; бросает ValueError при неверной разметке."""
+    result = [empty_graph() for _ in range(count)]
+    for kind in ("entities", "relations"):
+        for item in graph[kind]:
+            item = dict(item)
+            idx = item.pop("chunk", None)
+            if isinstance(idx, str) and idx.strip().isdigit():
+                idx = int(idx)
+            if not isinstance(idx, int) or not 0 <= idx < count:
+                raise ValueError(f"элемент без корректного номера чанка: {item}")
+            result[idx][kind].append(item)
+    return result
+
+
+def pack_texts(texts: List[str], pack_size: int = EXTRACTION_PACK_SIZE,
+               pack_tokens: int = EXTRACTION_PACK_TOKENS) -> List[List[str]]:
+    """Группирует тексты по порядку в пачки не больше pack_size штук и pack_tokens токенов."""
+    packs, current, tokens = [], [], 0
+    for text in texts:
+        size = estimate_tokens(text)
+        if current and (len(current) >= pack_size or tokens + size > pack_tokens):
+            packs.append(current)
+            current, tokens = [], 0
+        current.append(text)
+        tokens += size
+    if current:
+        packs.append(current)
+    return packs
+
+
+class GraphExtractor:
+    """Извлечение графа из текста через Gemini с кэшем успешно разобранных ответов."""
+
+    def __init__(self, model_name: str, scheduler=None, cache: Optional[ExtractionCache] = None,
+                 client=genai, system_prompt: str = SYSTEM_PROMPT,
+                 generation_config: Optional[Dict[str, Any]] = None):
+        self.model_name = model_name
+        self.scheduler = scheduler
+        self.cache = cache if cache is not None else ExtractionCache()
+        self.system_prompt = system_prompt
+        self.generation_config = generation_config or dict(GENERATION_CONFIG)
+        self.prompt_hash = prompt_hash(system_prompt)
+        self.model = client.GenerativeModel(
+            model_name=model_name,
+            system_instruction=system_prompt,
+            generation_config=self.generation_config,
+        )
+        self.multi_prompt = MULTI_CHUNK_PROMPT
+        self.multi_prompt_hash = prompt_hash(MULTI_CHUNK_PROMPT)
+        self.multi_model = client.GenerativeModel(
+            model_name=model_name,
+            system_instruction=MULTI_CHUNK_PROMPT,
+            generation_config=self.generation_config,
+        )
+        self.failures = 0
+        self.pack_fallbacks = 0
+
+    def _generate(self, model, system_prompt: str, prompt: str) -> str:
+        if self.scheduler is not None:
+            resp = self.scheduler.call(
+                model.generate_content, prompt,
+                tokens=estimate_tokens(system_prompt + prompt),
+            )
+        else:
+            gemini_request(self.model_name, estimate_tokens(system_prompt + prompt))
+            resp = model.generate_content(prompt)
+        return resp.text
+
+    def _single_key(self, text: str) -> str:
+        return extraction_key(self.model_name, self.system_prompt, self.generation_config, text)
+
+    def _packed_key(self, text: str) -> str:
+        return extraction_key(self.model_name, self.multi_prompt, self.generation_config, text)
+
+    def extract(self, text: str) -> Dict[str, Any]:
+        key = self._single_key(text)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        return self._extract(text, key)
+
+    def _extract(self, text: str, key: str) -> Dict[str, Any]:
+        # Без поиска в кэше: вызывающий уже искал и учёл промах
+        try:
+            graph = parse_graph_response(
+                self._generate(self.model, self.system_prompt, f"Extract graph from:\\n\\n{text}"))
+        except Exception as e:
+            # Ошибки и неразборчивые ответы не кэшируем: в следующий раз попробуем снова
+            self.failures += 1
+            print(f"      ⚠️ Ошибка извлечения графа: {e}")
+            # Пометка для журнала загрузки: пустой граф из-за сбоя, а не потому что в тексте нет сущностей
+            return dict(empty_graph(), error=str(e))
+        self.cache.put(key, self.model_name, self.prompt_hash, graph)
+        return graph
+
+    def extract_pack(self, texts: List[str]) -> List[Dict[str, Any]]:
+        """Извлекает граф для нескольких чанков одним запросом; при сбое разбора - по одному."""
+        if len(texts) == 1:
+            return [self.extract(texts[0])]
+
+        results: List[Optional[Dict[str, Any]]] = [None] * len(texts)
+        missing = []
+        for i, text in enumerate(texts):
+            # Годится результат и одиночного, и пакетного режима
+            results[i] = self.cache.get(self._single_key(text), self._packed_key(text))
+            if results[i] is None:
+                missing.append(i)
+
+        if len(missing) == 1:
+            results[missing[0]] = self._extract(texts[missing[0]], self._single_key(texts[missing[0]]))
+        elif missing:
+            body = "\n\n".join(f"### CHUNK {n}\n{texts[i]}" for n, i in enumerate(missing))
+            try:
+                graph = parse_graph_response(
+                    self._generate(self.multi_model, self.multi_prompt, f"Extract graph from:\n\n{body}"))
+                split = split_packed_response(graph, len(missing))
+            except Exception as e:
+                self.pack_fallbacks += 1
+                print(f"      ⚠️ Пакетное извлечение не разобрано ({e}), повторяю по одному чанку")
+                for i in missing:
+                    results[i] = self._extract(texts[i], self._single_key(texts[i]))
+            else:
+                for n, i in enumerate(missing):
+                    self.cache.put(self._packed_key(texts[i]), self.model_name, self.multi_prompt_hash, split[n])
+                    results[i] = split[n]
+        return results
+
+    def close(self):
+        self.cache.close()
@@ -0,0 +1,143 @@
+import os
+import sys
+import json
+import time
+import sqlite3
+import hashlib
+import argparse
+import threading
+from typing import Dict, Any, Optional, List
+
+# --- КОНФИГУРАЦИЯ ---
+EXTRACTION_CACHE_PATH = os.getenv("EXTRACTION_CACHE_PATH", ".cache/extractions.sqlite")
+
+
+def prompt_hash(system_prompt: str) -> str:
+    return hashlib.sha256(system_prompt.encode("utf-8")).hexdigest()[:16]
+
+
+def extraction_key(model: str, system_prompt: str, generation_config: Dict[str, Any], text: str) -> str:
+    payload = "\0".join([
+        model,
+        system_prompt,
+        json.dumps(generation_config, sort_keys=True),
+        text,
+    ])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ExtractionCache:
+    """Кэш разобранных ответов LLM (entities/relations) по хэшу модели, промпта, конфигурации и текста."""
+
+    def __init__(self, path: str = EXTRACTION_CACHE_PATH):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS extractions (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                prompt_hash TEXT NOT NULL,
+                result TEXT NOT NULL,
+                created REAL NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS extractions_prompt ON extractions(prompt_hash)")
+        # Счётчики текущего процесса
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+
+    def get(self, *keys: str) -> Optional[Dict[str, Any]]:
+        """Первый найденный из ключей; один поиск - одно попадание или один промах, сколько бы ключей ни было."""
+        with self.lock:
+            row = None
+            for key in keys:
+                row = self.conn.execute("SELECT result FROM extractions WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    break
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.conn.execute("UPDATE extractions SET hits = hits + 1 WHERE key = ?", (key,))
+            self.conn.commit()
+        return json.loads(row[0])
+
+    def put(self, key: str, model: str, p_hash: str, result: Dict[str, Any]):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO extractions (key, model, prompt_hash, result, created) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, model, p_hash, json.dumps(result, ensure_ascii=False), time.time()),
+            )
+            self.conn.commit()
+            self.stores += 1
+
+    def invalidate(self, prompt_hash: Optional[str] = None, model: Optional[str] = None,
+                   keep_prompt_hashes: Optional[List[str]] = None) -> int:
+        """Удаляет записи по хэшу промпта и/или модели; keep_prompt_hashes удаляет всё, кроме текущих промптов."""
+        clauses, params = [], []
+        if prompt_hash:
+            clauses.append("prompt_hash = ?")
+            params.append(prompt_hash)
+        if model:
+            clauses.append("model = ?")
+            params.append(model)
+        if keep_prompt_hashes:
+            clauses.append(f"prompt_hash NOT IN ({','.join('?' * len(keep_prompt_hashes))})")
+            params.extend(keep_prompt_hashes)
+        where = " WHERE " + " AND ".join(clauses) if clauses else ""
+        with self.lock:
+            cur = self.conn.execute(f"DELETE FROM extractions{where}", params)
+            self.conn.commit()
+        return cur.rowcount
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            entries, size, saved = self.conn.execute(
+                "SELECT count(*), COALESCE(SUM(length(result)), 0), COALESCE(SUM(hits), 0) FROM extractions"
+            ).fetchone()
+            prompts = self.conn.execute(
+                "SELECT prompt_hash, model, count(*) FROM extractions GROUP BY prompt_hash, model"
+            ).fetchall()
+        lookups = self.hits + self.misses
+        return {
+            "entries": entries,
+            "bytes": size,
+            "saved_calls_total": saved,
+            "run_hits": self.hits,
+            "run_misses": self.misses,
+            "run_stores": self.stores,
+            "run_hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "prompts": [{"prompt_hash": p, "model": m, "entries": n} for p, m, n in prompts],
+        }
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Статистика и очистка кэша извлечения графа")
+    parser.add_argument("--path", default=EXTRACTION_CACHE_PATH)
+    parser.add_argument("--invalidate-prompt", metavar="HASH", help="Удалить записи для указанного хэша промпта")
+    parser.add_argument("--invalidate-model", metavar="MODEL", help="Удалить записи для указанной модели")
+    parser.add_argument("--prune-stale", action="store_true",
+                        help="Удалить записи всех промптов, кроме текущих SYSTEM_PROMPT и MULTI_CHUNK_PROMPT")
+    args = parser.parse_args()
+
+    cache = ExtractionCache(args.path)
+    if args.prune_stale:
+        from extraction import SYSTEM_PROMPT, MULTI_CHUNK_PROMPT
+        removed = cache.invalidate(keep_prompt_hashes=[prompt_hash(SYSTEM_PROMPT), prompt_hash(MULTI_CHUNK_PROMPT)])
+        print(f"🗑️ Удалено устаревших записей: {removed}")
+    elif args.invalidate_prompt or args.invalidate_model:
+        removed = cache.invalidate(prompt_hash=args.invalidate_prompt, model=args.invalidate_model)
+        print(f"🗑️ Удалено записей: {removed}")
+    json.dump(cache.stats(), sys.stdout, indent=2, ensure_ascii=False)
+    print()
+    cache.close()
@@ -0,0 +1,478 @@
+import re
+import json
+import time
+import random
+import hashlib
+import threading
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from graph_writer import (
+    UPSERT_DOCUMENTS, UPSERT_CHUNKS, UPSERT_MENTIONS, DELETE_CHUNKS, LINK_CHUNKS, SET_MANIFESTS,
+)
+from manifest import LOAD_MANIFEST, TOUCH_MANIFEST
+from entity_resolution import LOAD_ENTITIES
+from index_manager import READ_REGISTRY, INDEX_INFO, CHUNK_DIMENSIONS
+from local_search import ALL_CHUNK_IDS, CHUNK_EMBEDDINGS
+from workers import estimate_tokens
+
+# Подмены Gemini и Memgraph для бенчмарков и прогонов без ключа и контейнера.
+# Ответы детерминированы: одинаковый текст -> одинаковый граф и эмбеддинг.
+
+EMBEDDING_DIM = 768
+# Сущности фейкового извлечения: слова с заглавной буквы длиной от трёх символов
+ENTITY_RE = re.compile(r"\b[A-Z][a-zA-Z0-9]{2,}\b")
+CHUNK_HEADER_RE = re.compile(r"^### CHUNK (\d+)$", re.MULTILINE)
+MAX_ENTITIES = 8
+
+_RELATION_RE = re.compile(r"MERGE \(a\)-\[:(\w+)\]->\(b\)")
+
+
+def _seed(text: str) -> int:
+    return int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "big")
+
+
+@lru_cache(maxsize=65536)
+def _word_vector(word: str, dim: int) -> np.ndarray:
+    return np.random.default_rng(_seed(word)).standard_normal(dim).astype(np.float32)
+
+
+def fake_embedding(text: str, dim: int = EMBEDDING_DIM) -> List[float]:
+    """Сумма случайных векторов слов: тексты с общими словами близки по косинусу, как у настоящей модели."""
+    vec = np.zeros(dim, dtype=np.float32)
+    for word in text.lower().split():
+        vec += _word_vector(word, dim)
+    norm = float(np.linalg.norm(vec))
+    if norm == 0.0:
+        vec = _word_vector("", dim)
+        norm = float(np.linalg.norm(vec))
+    return (vec / norm).tolist()
+
+
+def truncate_embedding(vector: List[float], dim: int) -> List[float]:
+    """Уменьшенная размерность как у моделей с Matryoshka-обучением: первые dim компонент, заново нормированные."""
+    if dim >= len(vector):
+        return vector
+    head = np.asarray(vector[:dim], dtype=np.float32)
+    return (head / (float(np.linalg.norm(head)) or 1.0)).tolist()
+
+
+def fake_graph(text: str) -> Dict[str, Any]:
+    names = list(dict.fromkeys(ENTITY_RE.findall(text)))[:MAX_ENTITIES]
+    return {
+        "entities": [{"id": name, "type": "Concept"} for name in names],
+        "relations": [{"source": a, "target": b, "type": "RELATED_TO"} for a, b in zip(names, names[1:])],
+    }
+
+
+class LatencyRecorder:
+    """Потокобезопасный сбор длительностей вызовов по видам."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples: Dict[str, List[float]] = {}
+
+    def record(self, kind: str, seconds: float):
+        with self.lock:
+            self.samples.setdefault(kind, []).append(seconds)
+
+    def snapshot(self) -> Dict[str, List[float]]:
+        with self.lock:
+            return {kind: list(values) for kind, values in self.samples.items()}
+
+    def reset(self):
+        with self.lock:
+            self.samples.clear()
+
+
+class _Latency:
+    """Задержка base + per_token * токены с детерминированным разбросом ±jitter."""
+
+    def __init__(self, base: float, per_token: float, jitter: float, seed: int):
+        self.base = base
+        self.per_token = per_token
+        self.jitter = jitter
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def sleep(self, tokens: int = 0):
+        delay = self.base + self.per_token * tokens
+        if self.jitter:
+            with self.lock:
+                delay *= 1 + self.rng.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+
+class _Response:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class FakeGenerativeModel:
+    def __init__(self, owner: "FakeGenAI", model_name: str = "", system_instruction: Optional[str] = None,
+                 generation_config: Optional[Dict[str, Any]] = None):
+        self.owner = owner
+        self.model_name = model_name
+        self.system_instruction = system_instruction
+        self.generation_config = generation_config or {}
+
+    def _respond(self, prompt: str) -> str:
+        if not self.system_instruction:
+            # Модель ответов: короткий текст, зависящий от вопроса
+            question = prompt.rsplit("Question:", 1)[-1].split("Answer:", 1)[0].strip()
+            return f"Synthetic answer to: {question}"
+        headers = list(CHUNK_HEADER_RE.finditer(prompt))
+        if not headers:
+            return json.dumps(fake_graph(prompt.split("\n\n", 1)[-1]))
+        # Пакетный запрос: у каждого элемента номер своего чанка
+        packed = {"entities": [], "relations": []}
+        for n, header in enumerate(headers):
+            end = headers[n + 1].start() if n + 1 < len(headers) else len(prompt)
+            graph = fake_graph(prompt[header.end():end])
+            for kind in ("entities", "relations"):
+                packed[kind].extend(dict(item, chunk=int(header.group(1))) for item in graph[kind])
+        return json.dumps(packed)
+
+    def generate_content(self, prompt: str) -> _Response:
+        tokens = estimate_tokens((self.system_instruction or "") + prompt)
+        return _Response(self.owner._call("generate", tokens, lambda: self._respond(prompt)))
+
+
+class FakeGenAI:
+    """Замена модуля google.generativeai: configure, GenerativeModel, embed_content."""
+
+    def __init__(self, latency: float = 0.0, per_token_latency: float = 0.0, jitter: float = 0.0,
+                 seed: int = 0, dim: int = EMBEDDING_DIM):
+        self.dim = dim
+        self.latency = _Latency(latency, per_token_latency, jitter, seed)
+        self.recorder = LatencyRecorder()
+        self.lock = threading.Lock()
+        self.calls: Dict[str, int] = {"generate": 0, "embed": 0}
+        self.tokens = 0
+
+    def configure(self, **kwargs):
+        pass
+
+    def GenerativeModel(self, model_name: str = "", system_instruction: Optional[str] = None,
+                        generation_config: Optional[Dict[str, Any]] = None) -> FakeGenerativeModel:
+        return FakeGenerativeModel(self, model_name, system_instruction, generation_config)
+
+    def _call(self, kind: str, tokens: int, fn):
+        started = time.perf_counter()
+        self.latency.sleep(tokens)
+        result = fn()
+        self.recorder.record(kind, time.perf_counter() - started)
+        with self.lock:
+            self.calls[kind] += 1
+            self.tokens += tokens
+        return result
+
+    def embed_content(self, model: str, content, task_type: str = "retrieval_document", **kwargs):
+        texts = content if isinstance(content, list) else [content]
+        tokens = sum(estimate_tokens(t) for t in texts)
+        dim = kwargs.get("output_dimensionality") or self.dim
+        vectors = self._call("embed", tokens, lambda: [truncate_embedding(fake_embedding(t, self.dim), dim)
+                                                        for t in texts])
+        return {"embedding": vectors if isinstance(content, list) else vectors[0]}
+
+
+class FakeResult:
+    def __init__(self, records: List[Dict[str, Any]]):
+        self.records = records
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def single(self) -> Optional[Dict[str, Any]]:
+        return self.records[0] if self.records else None
+
+    def consume(self):
+        return None
+
+
+class FakeGraph:
+    """Граф в памяти: документы, чанки, сущности и связи - ровно то, что пишет и читает пайплайн."""
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.documents: Dict[str, Dict[str, Any]] = {}
+        self.chunks: Dict[str, Dict[str, Any]] = {}
+        self.doc_chunks: Dict[str, set] = {}
+        self.entities: Dict[str, Dict[str, Any]] = {}
+        self.mentions: Dict[str, set] = {}
+        self.relations: Dict[str, set] = {}
+        self._matrix = None
+
+    # --- запись ---
+
+    def upsert_documents(self, rows):
+        for row in rows:
+            self.documents.setdefault(row["id"], {"id": row["id"]})
+            self.doc_chunks.setdefault(row["id"], set())
+
+    def upsert_chunks(self, rows):
+        for row in rows:
+            if row["doc_id"] not in self.documents:
+                continue
+            self.chunks[row["id"]] = {k: row[k] for k in ("id", "index", "text", "embedding")}
+            self.doc_chunks[row["doc_id"]].add(row["id"])
+        self._matrix = None
+
+    def upsert_mentions(self, rows):
+        for row in rows:
+            if row["chunk_id"] not in self.chunks:
+                continue
+            entity = self.entities.setdefault(
+                row["entity_id"], {"id": row["entity_id"], "type": row["type"], "aliases": []})
+            if row["alias"] != entity["id"] and row["alias"] not in entity["aliases"]:
+                entity["aliases"].append(row["alias"])
+            self.mentions.setdefault(row["chunk_id"], set()).add(row["entity_id"])
+
+    def upsert_relations(self, r_type: str, rows):
+        for row in rows:
+            if row["source"] in self.entities and row["target"] in self.entities:
+                self.relations.setdefault(row["source"], set()).add((r_type, row["target"]))
+                self.relations.setdefault(row["target"], set()).add((r_type, row["source"], "in"))
+
+    def link_chunks(self, rows):
+        for row in rows:
+            # MATCH: ещё не записанный канонический чанк не связывается
+            if row["doc_id"] not in self.documents or row["id"] not in self.chunks:
+                continue
+            self.doc_chunks[row["doc_id"]].add(row["id"])
+
+    def delete_chunks(self, rows):
+        # Чанк удаляется, только когда на него не ссылается ни один документ
+        for row in rows:
+            self.doc_chunks.get(row["doc_id"], set()).discard(row["id"])
+        referenced = set().union(*self.doc_chunks.values()) if self.doc_chunks else set()
+        for cid in {row["id"] for row in rows} - referenced:
+            self.chunks.pop(cid, None)
+            self.mentions.pop(cid, None)
+        self._matrix = None
+
+    def set_manifests(self, rows):
+        for row in rows:
+            if row["id"] in self.documents:
+                self.documents[row["id"]].update(row["manifest"])
+
+    # --- чтение ---
+
+    def load_manifest(self, doc_id):
+        doc = self.documents.get(doc_id)
+        if doc is None:
+            return []
+        return [{"doc": dict(doc), "chunk_ids": sorted(self.doc_chunks.get(doc_id, ()))}]
+
+    def chunk_dimensions(self):
+        dims: Dict[int, int] = {}
+        for chunk in self.chunks.values():
+            if chunk.get("embedding"):
+                dims[len(chunk["embedding"])] = dims.get(len(chunk["embedding"]), 0) + 1
+        return [{"dimension": d, "chunks": n} for d, n in dims.items()]
+
+    def load_entities(self):
+        return [{"id": e["id"], "aliases": list(e["aliases"])} for e in self.entities.values()]
+
+    def _source(self, cid: str) -> Dict[str, Any]:
+        chunk = self.chunks[cid]
+        return {"id": cid, "text": chunk["text"], "embedding": chunk["embedding"],
+                "entities": sorted(self.mentions.get(cid, ()))}
+
+    def vector_search(self, vector, k):
+        """Точный поиск перебором, score - косинусное сходство, как у индекса Memgraph с metric=cos."""
+        if self._matrix is None:
+            ids = [cid for cid, c in self.chunks.items() if c["embedding"]]
+            matrix = np.asarray([self.chunks[cid]["embedding"] for cid in ids], dtype=np.float32)
+            if len(ids):
+                matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+            self._matrix = (ids, matrix)
+        ids, matrix = self._matrix
+        if not ids:
+            return []
+        q = np.asarray(vector, dtype=np.float32)
+        scores = matrix @ (q / max(float(np.linalg.norm(q)), 1e-12))
+        top = np.argsort(-scores)[:k]
+        return [(ids[i], float(scores[i])) for i in top]
+
+    def facts(self, entities) -> List[str]:
+        facts = []
+        for e in entities:
+            for rel in sorted(self.relations.get(e, ())):
+                if len(rel) == 2:
+                    facts.append(f"{e} -{rel[0]}-> {rel[1]}")
+                else:
+                    facts.append(f"{rel[1]} -{rel[0]}-> {e}")
+        return list(dict.fromkeys(facts))
+
+    def hybrid(self, vector, k, limit, facts_per_chunk):
+        """Соседи через общие сущности (без многошаговых путей): близость = score попадания."""
+        proximity: Dict[str, float] = {}
+        seeds = set()
+        for cid, score in self.vector_search(vector, k):
+            seeds.add(cid)
+            proximity[cid] = max(proximity.get(cid, 0.0), score)
+            shared = self.mentions.get(cid, set())
+            for other, ents in self.mentions.items():
+                if other != cid and ents & shared:
+                    proximity[other] = max(proximity.get(other, 0.0), score)
+        ranked = sorted(proximity.items(), key=lambda kv: kv[1], reverse=True)[:limit]
+        records = []
+        for cid, prox in ranked:
+            src = self._source(cid)
+            src.update(proximity=prox, is_seed=int(cid in seeds),
+                       facts=self.facts(src["entities"])[:facts_per_chunk])
+            records.append(src)
+        return records
+
+
+class FakeSession:
+    def __init__(self, driver: "FakeGraphDriver"):
+        self.driver = driver
+
+    def run(self, query: str, parameters: Optional[Dict[str, Any]] = None, **params) -> FakeResult:
+        params = dict(parameters or {}, **params)
+        return FakeResult(self.driver._execute(query, params))
+
+    def execute_write(self, fn, *args, **kwargs):
+        # Транзакции нет: при ошибке частичная запись остаётся, как при обрыве соединения
+        with self.driver.graph.lock:
+            return fn(self, *args, **kwargs)
+
+    execute_read = execute_write
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class FakeGraphDriver:
+    """Замена neo4j-драйвера: понимает только запросы этого репозитория, остальное - ValueError."""
+
+    def __init__(self, latency: float = 0.0, per_row_latency: float = 0.0, jitter: float = 0.0, seed: int = 0):
+        self.graph = FakeGraph()
+        self.latency = _Latency(latency, per_row_latency, jitter, seed)
+        self.recorder = LatencyRecorder()
+        self.rows_written = 0
+        self.statements = 0
+        self.lock = threading.Lock()
+
+    def verify_connectivity(self):
+        pass
+
+    def session(self, **kwargs) -> FakeSession:
+        return FakeSession(self)
+
+    def close(self):
+        pass
+
+    def _classify(self, query: str) -> str:
+        if query == UPSERT_DOCUMENTS:
+            return "write_documents"
+        if query == UPSERT_CHUNKS:
+            return "write_chunks"
+        if query == UPSERT_MENTIONS:
+            return "write_mentions"
+        if query == DELETE_CHUNKS:
+            return "delete_chunks"
+        if query == LINK_CHUNKS:
+            return "write_links"
+        if query == SET_MANIFESTS:
+            return "write_manifests"
+        if _RELATION_RE.search(query):
+            return "write_relations"
+        if query == LOAD_MANIFEST:
+            return "load_manifest"
+        if query == TOUCH_MANIFEST:
+            return "write_touch_manifest"
+        if query == LOAD_ENTITIES:
+            return "load_entities"
+        if query == READ_REGISTRY:
+            # Фейковый граф живёт на исходном индексе: реестра версий нет
+            return "index_registry"
+        if query == INDEX_INFO:
+            return "index_info"
+        if query == CHUNK_DIMENSIONS:
+            return "chunk_dimensions"
+        if query == ALL_CHUNK_IDS:
+            return "all_chunk_ids"
+        if query == CHUNK_EMBEDDINGS:
+            return "chunk_embeddings"
+        # Запросы query.py сравниваем по признакам: импорт query тянет Gemini и neo4j
+        if "vector_search.search" in query:
+            if "AS seed" in query:
+                return "hybrid_search"
+            if "node.embedding as embedding" in query:
+                return "candidate_search"
+            return "vector_search"
+        if "UNWIND $ids AS id" in query and "node.text" in query:
+            return "chunks_by_id"
+        raise ValueError(f"FakeGraphDriver: неизвестный запрос:\n{query}")
+
+    def _execute(self, query: str, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        kind = self._classify(query)
+        rows = params.get("rows") or params.get("ids") or []
+        started = time.perf_counter()
+        self.latency.sleep(len(rows))
+        g = self.graph
+        with g.lock:
+            if kind == "write_documents":
+                g.upsert_documents(rows)
+            elif kind == "write_chunks":
+                g.upsert_chunks(rows)
+            elif kind == "write_mentions":
+                g.upsert_mentions(rows)
+            elif kind == "write_relations":
+                g.upsert_relations(_RELATION_RE.search(query).group(1), rows)
+            elif kind == "write_links":
+                g.link_chunks(rows)
+            elif kind == "delete_chunks":
+                g.delete_chunks(rows)
+            elif kind == "write_manifests":
+                g.set_manifests(rows)
+            elif kind == "write_touch_manifest":
+                g.set_manifests([{"id": params["doc_id"],
+                                  "manifest": {"size": params["size"], "mtime": params["mtime"]}}])
+            if kind.startswith(("write_", "delete_")):
+                result = []
+                with self.lock:
+                    self.rows_written += len(rows)
+            elif kind == "load_manifest":
+                result = g.load_manifest(params["doc_id"])
+            elif kind == "load_entities":
+                result = g.load_entities()
+            elif kind in ("index_registry", "index_info"):
+                result = []
+            elif kind == "chunk_dimensions":
+                result = g.chunk_dimensions()
+            elif kind == "all_chunk_ids":
+                result = [{"id": cid} for cid, c in g.chunks.items() if c.get("embedding")]
+            elif kind == "chunk_embeddings":
+                result = [{"id": cid, "embedding": g.chunks[cid].get("embedding")} for cid in rows if cid in g.chunks]
+            elif kind == "chunks_by_id":
+                result = [g._source(cid) for cid in rows if cid in g.chunks]
+            elif kind == "hybrid_search":
+                result = g.hybrid(params["vector"], params["k"], params["limit"], params["facts_per_chunk"])
+            else:
+                result = []
+                for cid, score in g.vector_search(params["vector"], params["k"]):
+                    record = g._source(cid)
+                    record["score"] = score
+                    result.append(record)
+        with self.lock:
+            self.statements += 1
+        self.recorder.record(kind, time.perf_counter() - started)
+        return result
+
+
+def make_fake_clients(gemini_args: tuple = (), graph_args: tuple = ()):
+    """(driver, client) для процесса-шарда (sharded_ingest.run_sharded): функция модуля, чтобы пережить pickle."""
+    return FakeGraphDriver(*graph_args), FakeGenAI(*gemini_args)
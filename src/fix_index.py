@@ -4,29 +4,23 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
+from index_manager import rebuild
+
 MEMGRAPH_URI = os.getenv("MEMGRAPH_URI", "bolt://localhost:7687")
 MEMGRAPH_AUTH = (os.getenv("MEMGRAPH_USER", ""), os.getenv("MEMGRAPH_PASSWORD", ""))
 
 def create_index():
     driver = GraphDatabase.driver(MEMGRAPH_URI, auth=MEMGRAPH_AUTH)
     with driver.session() as session:
-        print("🔧 Настройка векторного индекса (metric='cos')...")
-        
-        try:
-            session.run("DROP VECTOR INDEX chunk_vector_index")
-            print("🗑️ Старый индекс удален.")
-        except Exception:
-            pass
-
+        print("🔧 Пересборка векторного индекса (metric='cos') без остановки поиска...")
         try:
-            # ИСПРАВЛЕНО: "metric": "cos" (вместо "cosine")
-            session.run("""
-            CREATE VECTOR INDEX chunk_vector_index ON :Chunk(embedding) 
-            WITH CONFIG {"dimension": 768, "metric": "cos"}
-            """)
-            print("✅ Векторный индекс успешно создан!")
+            # Новая версия строится рядом со старой, поиск переключается после заполнения
+            result = rebuild(session)
+            print(f"✅ Векторный индекс {result['active']} успешно создан! "
+                  f"(чанков: {result['chunks']}, capacity={result['capacity']})")
         except Exception as e:
             print(f"❌ Ошибка создания индекса: {e}")
+            print("💡 Недостроенную версию удалит: python src/index_manager.py --abort")
 
     driver.close()
 
@@ -0,0 +1,252 @@
+import os
+import re
+import math
+from typing import List, Dict, Any, Callable, Optional
+
+from metrics import METRICS, GRAPH_ROWS
+from index_manager import chunk_labels
+
+# --- КОНФИГУРАЦИЯ ---
+# Сколько строк (чанки + упоминания + связи) копим до принудительного сброса в базу
+WRITE_BATCH_SIZE = int(os.getenv("WRITE_BATCH_SIZE", "500"))
+
+UPSERT_DOCUMENTS = """
+UNWIND $rows AS row
+MERGE (d:Document {id: row.id})
+"""
+
+UPSERT_CHUNKS = """
+UNWIND $rows AS row
+MATCH (d:Document {id: row.doc_id})
+MERGE (c:Chunk {id: row.id})
+SET c.index = row.index, c.text = row.text, c.embedding = row.embedding
+MERGE (d)-[:HAS_CHUNK]->(c)
+"""
+
+# Метки версий векторного индекса (ChunkV<n>, см. index_manager.py): чанк попадает в индекс
+# по метке, а метку, как и тип связи, параметром не передать
+LABEL_CHUNKS = """
+UNWIND $rows AS row
+MATCH (c:Chunk {{id: row.id}})
+SET c:{labels}
+"""
+
+# Сырое написание из LLM сохраняется в e.aliases, чтобы резолвер знал его при следующем запуске
+UPSERT_MENTIONS = """
+UNWIND $rows AS row
+MATCH (c:Chunk {id: row.chunk_id})
+MERGE (e:Entity {id: row.entity_id})
+ON CREATE SET e.type = row.type
+SET e.aliases = CASE
+    WHEN row.alias = e.id OR row.alias IN coalesce(e.aliases, []) THEN e.aliases
+    ELSE coalesce(e.aliases, []) + row.alias END
+MERGE (c)-[:MENTIONS]->(e)
+"""
+
+# Дубликат не хранится отдельным чанком: документ ссылается на канонический чанк.
+# MATCH, а не MERGE: пустая заготовка осталась бы без текста и вектора, если запись канонического
+# чанка упадёт; ссылки на ещё не записанные чанки откладываются в журнале загрузки (main.py).
+LINK_CHUNKS = """
+UNWIND $rows AS row
+MATCH (d:Document {id: row.doc_id})
+MATCH (c:Chunk {id: row.id})
+MERGE (d)-[:HAS_CHUNK]->(c)
+"""
+
+# Чанк отвязывается от документа; удаляется (DETACH DELETE убирает и его рёбра MENTIONS),
+# только если на него больше не ссылается ни один документ
+DELETE_CHUNKS = """
+UNWIND $rows AS row
+MATCH (:Document {id: row.doc_id})-[r:HAS_CHUNK]->(c:Chunk {id: row.id})
+DELETE r
+WITH DISTINCT c
+OPTIONAL MATCH (c)<-[:HAS_CHUNK]-(other:Document)
+WITH c, count(other) AS refs
+WHERE refs = 0
+DETACH DELETE c
+"""
+
+# Манифест пишется последним, чтобы прерванный файл не считался загруженным
+SET_MANIFESTS = """
+UNWIND $rows AS row
+MATCH (d:Document {id: row.id})
+SET d += row.manifest
+"""
+
+# Тип связи нельзя передать параметром, поэтому запрос собирается на каждый
+# (уже очищенный) тип отдельно, а сами строки идут через $rows.
+UPSERT_RELATIONS = """
+UNWIND $rows AS row
+MATCH (a:Entity {{id: row.source}}), (b:Entity {{id: row.target}})
+MERGE (a)-[:{r_type}]->(b)
+"""
+
+
+def is_valid_embedding(vector) -> bool:
+    """Пустой, нулевой или с NaN/inf вектор индекс использовать не может."""
+    if not vector:
+        return False
+    return all(math.isfinite(x) for x in vector) and any(vector)
+
+
+def clean_entity_type(raw: str) -> str:
+    return re.sub(r'[^a-zA-Z0-9_]', '', (raw or "Thing").strip()) or "Thing"
+
+
+def clean_relation_type(raw: str) -> str:
+    return re.sub(r'[^a-zA-Z0-9_]', '', (raw or "RELATED").replace(" ", "_").upper()) or "RELATED"
+
+
+class GraphWriteBatcher:
+    """Копит записи графа и сбрасывает их пачками через UNWIND в одной транзакции."""
+
+    def __init__(self, session, batch_size: int = WRITE_BATCH_SIZE, resolver=None,
+                 on_flush: Optional[Callable[[List[str]], None]] = None):
+        self.session = session
+        self.batch_size = batch_size
+        # EntityResolver: приводит написания сущностей к каноническим перед записью
+        self.resolver = resolver
+        # Вызывается с ID чанков после успешного коммита (журнал загрузки)
+        self.on_flush = on_flush
+        self._reset()
+
+    def _reset(self):
+        self.documents: List[Dict[str, Any]] = []
+        self.deleted: List[Dict[str, Any]] = []
+        self.links: List[Dict[str, Any]] = []
+        self.manifests: List[Dict[str, Any]] = []
+        self.chunks: List[Dict[str, Any]] = []
+        self.mentions: List[Dict[str, Any]] = []
+        self.relations: Dict[str, List[Dict[str, Any]]] = {}
+
+    def pending(self) -> int:
+        return (len(self.documents) + len(self.deleted) + len(self.chunks) + len(self.links)
+                + len(self.mentions) + len(self.manifests)
+                + sum(len(rows) for rows in self.relations.values()))
+
+    def add_document(self, doc_id: str):
+        self.documents.append({"id": doc_id})
+
+    def delete_chunks(self, doc_id: str, chunk_ids):
+        self.deleted.extend({"doc_id": doc_id, "id": cid} for cid in chunk_ids)
+
+    def link_chunk(self, doc_id: str, chunk_id: str):
+        # Дубликат: эмбеддинг и граф канонического чанка переиспользуются, новый узел не создаётся
+        self.links.append({"doc_id": doc_id, "id": chunk_id})
+        if self.pending() >= self.batch_size:
+            self.flush()
+
+    def set_manifest(self, doc_id: str, manifest: Dict[str, Any]):
+        self.manifests.append({"id": doc_id, "manifest": manifest})
+
+    def add_chunk(self, doc_id: str, chunk_id: str, index: int, text: str,
+                  embedding: List[float], graph_data: Dict[str, Any]):
+        # Чанк без пригодного вектора не должен попасть в chunk_vector_index
+        if not is_valid_embedding(embedding):
+            raise ValueError(f"чанк {chunk_id}: пустой или некорректный эмбеддинг")
+        self.chunks.append({
+            "doc_id": doc_id,
+            "id": chunk_id,
+            "index": index,
+            "text": text,
+            "embedding": embedding,
+        })
+
+        for ent in graph_data.get("entities", []):
+            e_id = ent.get("id") or ent.get("name")
+            if not e_id: continue
+            self.mentions.append({
+                "chunk_id": chunk_id,
+                "entity_id": e_id.strip(),
+                "alias": e_id.strip(),
+                "type": clean_entity_type(ent.get("type", "Thing")),
+            })
+
+        for rel in graph_data.get("relations", []):
+            src = rel.get("source", "").strip()
+            tgt = rel.get("target", "").strip()
+            if not src or not tgt: continue
+            r_type = clean_relation_type(rel.get("type", "RELATED"))
+            self.relations.setdefault(r_type, []).append({"source": src, "target": tgt})
+
+        if self.pending() >= self.batch_size:
+            self.flush()
+
+    @staticmethod
+    def _run(tx, statement: str, query: str, **params):
+        rows = next(iter(params.values()))
+        METRICS.inc(GRAPH_ROWS, len(rows), statement=statement)
+        with METRICS.span("graph.write", statement=statement):
+            # consume() дожидается выполнения, иначе замер покажет только отправку запроса
+            tx.run(query, **params).consume()
+
+    def _write(self, tx):
+        # Порядок важен: документы -> удаление старых чанков -> чанки -> ссылки на дубликаты -> сущности
+        # -> связи -> манифесты
+        if self.documents:
+            self._run(tx, "documents", UPSERT_DOCUMENTS, rows=self.documents)
+        if self.deleted:
+            self._run(tx, "delete_chunks", DELETE_CHUNKS, rows=self.deleted)
+        if self.chunks:
+            self._run(tx, "chunks", UPSERT_CHUNKS, rows=self.chunks)
+            # Реестр читается в той же транзакции: пересборка индекса не пропустит новые чанки
+            labels = chunk_labels(tx)
+            if labels:
+                self._run(tx, "chunk_labels", LABEL_CHUNKS.format(labels=":".join(labels)), rows=self.chunks)
+        if self.links:
+            self._run(tx, "links", LINK_CHUNKS, rows=self.links)
+        if self.mentions:
+            self._run(tx, "mentions", UPSERT_MENTIONS, rows=self.mentions)
+        for r_type, rows in self.relations.items():
+            self._run(tx, "relations", UPSERT_RELATIONS.format(r_type=r_type), rows=rows)
+        if self.manifests:
+            self._run(tx, "manifests", SET_MANIFESTS, rows=self.manifests)
+
+    def _resolve_entities(self):
+        # Вся пачка сопоставляется за один проход по индексу, затем повторы схлопываются
+        names = [m["entity_id"] for m in self.mentions]
+        for rows in self.relations.values():
+            names.extend(r["source"] for r in rows)
+            names.extend(r["target"] for r in rows)
+        mapping = self.resolver.resolve_batch(names)
+
+        mentions, seen = [], set()
+        for m in self.mentions:
+            m["entity_id"] = mapping[m["entity_id"]]
+            key = (m["chunk_id"], m["entity_id"], m["alias"])
+            if key not in seen:
+                seen.add(key)
+                mentions.append(m)
+        self.mentions = mentions
+
+        for r_type, rows in self.relations.items():
+            unique = {(mapping[r["source"]], mapping[r["target"]]) for r in rows}
+            self.relations[r_type] = [{"source": a, "target": b} for a, b in unique if a != b]
+
+    def flush(self):
+        if not self.pending():
+            return
+        try:
+            if self.resolver is not None:
+                with METRICS.span("ingest.resolve_entities"):
+                    self._resolve_entities()
+            # Вся транзакция, включая коммит
+            with METRICS.span("graph.flush"):
+                self.session.execute_write(self._write)
+            written = [c["id"] for c in self.chunks]
+        finally:
+            self._reset()
+        if self.on_flush is not None:
+            self.on_flush(written)
+
+    def discard(self):
+        self._reset()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.flush()
+        else:
+            self.discard()
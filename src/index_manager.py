@@ -0,0 +1,373 @@
+import os
+import re
+import sys
+import json
+import math
+import time
+import argparse
+import threading
+from typing import Dict, Any, Optional, List
+
+# --- КОНФИГУРАЦИЯ ---
+VECTOR_INDEX_NAME = "chunk_vector_index"
+VECTOR_INDEX_METRIC = os.getenv("VECTOR_INDEX_METRIC", "cos")
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "models/text-embedding-004")
+# Размерность векторов каждой модели эмбеддингов: индекс с другой размерностью отвергает вставки
+EMBEDDING_DIMENSIONS = {"models/text-embedding-004": 768}
+# Уменьшенная размерность (см. embeddings.py); 0 = родная размерность модели
+EMBEDDING_DIM = int(os.getenv("EMBEDDING_DIM", "0"))
+# Ёмкость = max(текущее, прогноз) * запас, округлённая вверх до VECTOR_INDEX_CAPACITY_STEP
+VECTOR_INDEX_MIN_CAPACITY = int(os.getenv("VECTOR_INDEX_MIN_CAPACITY", "10000"))
+VECTOR_INDEX_CAPACITY_STEP = int(os.getenv("VECTOR_INDEX_CAPACITY_STEP", "10000"))
+VECTOR_INDEX_HEADROOM = float(os.getenv("VECTOR_INDEX_HEADROOM", "1.5"))
+VECTOR_INDEX_PROJECTED_CHUNKS = int(os.getenv("VECTOR_INDEX_PROJECTED_CHUNKS", "0"))
+# Доля заполнения, после которой --check и main.py советуют пересобрать индекс
+VECTOR_INDEX_FILL_WARN = float(os.getenv("VECTOR_INDEX_FILL_WARN", "0.8"))
+# Как часто query.py перечитывает имя активного индекса, секунды
+VECTOR_INDEX_REFRESH = float(os.getenv("VECTOR_INDEX_REFRESH", "30"))
+# Сколько старый индекс живёт после переключения (читатели должны успеть перечитать реестр)
+VECTOR_INDEX_GRACE = float(os.getenv("VECTOR_INDEX_GRACE", str(2 * VECTOR_INDEX_REFRESH)))
+# Узлов на одну транзакцию при разметке чанков меткой нового индекса
+VECTOR_INDEX_BATCH = int(os.getenv("VECTOR_INDEX_BATCH", "5000"))
+# Оценка памяти HNSW: связей на узел (M) и байт на компоненту вектора (f32)
+HNSW_CONNECTIVITY = 16
+SCALAR_BYTES = 4
+
+# Реестр индексов - узел в самом графе: его видят и загрузка, и сервер вопросов, и переключение
+# активного индекса - одна транзакция. Версия 0 - исходный индекс chunk_vector_index на :Chunk.
+READ_REGISTRY = """
+MATCH (r:IndexRegistry {id: $id})
+RETURN r.active AS active, r.label AS label, r.version AS version, r.dimension AS dimension,
+       r.capacity AS capacity, r.building AS building, r.building_label AS building_label,
+       r.retiring AS retiring, r.retiring_label AS retiring_label, r.retire_after AS retire_after
+"""
+
+WRITE_REGISTRY = """
+MERGE (r:IndexRegistry {id: $id})
+SET r += $props, r.updated = timestamp()
+"""
+
+INDEX_INFO = "CALL vector_search.show_index_info() YIELD * RETURN *"
+
+# Пустой вектор - не другая размерность, а отсутствующий (diagnose.py считает его в missing)
+CHUNK_DIMENSIONS = """
+MATCH (c:Chunk)
+WHERE c.embedding IS NOT NULL AND size(c.embedding) > 0
+RETURN size(c.embedding) AS dimension, count(c) AS chunks
+"""
+
+# Метки меняются пачками: одна огромная транзакция держала бы блокировки и память.
+# Пачки идут по возрастанию id (индекс :Chunk(id)) с места, где остановилась предыдущая:
+# каждая пачка не просматривает заново уже размеченные чанки
+LABEL_BATCH = """
+MATCH (c:Chunk)
+WHERE c.id > $after AND c.embedding IS NOT NULL AND size(c.embedding) = $dimension AND NOT c:{label}
+WITH c ORDER BY c.id LIMIT $batch
+SET c:{label}
+RETURN count(c) AS n, max(c.id) AS last
+"""
+
+UNLABEL_BATCH = """
+MATCH (c:{label})
+WITH c LIMIT $batch
+REMOVE c:{label}
+RETURN count(c) AS n
+"""
+
+_LABEL_RE = re.compile(r"^ChunkV\d+$")
+
+
+def expected_dimension(model: str = EMBEDDING_MODEL, dimensions: int = EMBEDDING_DIM) -> Optional[int]:
+    return dimensions or EMBEDDING_DIMENSIONS.get(model)
+
+
+def plan_capacity(chunks: int, projected: int = VECTOR_INDEX_PROJECTED_CHUNKS,
+                  headroom: float = VECTOR_INDEX_HEADROOM) -> int:
+    """Ёмкость индекса под текущее и ожидаемое число чанков с запасом."""
+    need = max(chunks, projected) * headroom
+    step = max(1, VECTOR_INDEX_CAPACITY_STEP)
+    return max(VECTOR_INDEX_MIN_CAPACITY, int(math.ceil(need / step)) * step)
+
+
+def index_bytes_per_vector(dimension: int) -> int:
+    """Грубая оценка памяти HNSW на вектор: сами компоненты + списки соседей (2*M на нижнем слое, id по 4 байта)."""
+    return dimension * SCALAR_BYTES + 2 * HNSW_CONNECTIVITY * 4
+
+
+def estimate_memory_mb(vectors: int, dimension: int) -> float:
+    return round(vectors * index_bytes_per_vector(dimension) / 2 ** 20, 1)
+
+
+def read_registry(session) -> Dict[str, Any]:
+    record = session.run(READ_REGISTRY, id=VECTOR_INDEX_NAME).single()
+    registry = dict(record) if record is not None else {}
+    # Реестра ещё нет: работает исходный индекс
+    registry.setdefault("active", None)
+    registry["active"] = registry["active"] or VECTOR_INDEX_NAME
+    registry["label"] = registry.get("label") or "Chunk"
+    registry["version"] = registry.get("version") or 0
+    return registry
+
+
+def write_registry(session, **props):
+    session.run(WRITE_REGISTRY, id=VECTOR_INDEX_NAME, props=props).consume()
+
+
+def chunk_labels(tx) -> List[str]:
+    """Метки, которые запись чанка должна поставить, чтобы он попал в активный и строящийся индексы."""
+    record = tx.run(READ_REGISTRY, id=VECTOR_INDEX_NAME).single()
+    if record is None:
+        return []
+    labels = [record["label"], record["building_label"]]
+    return sorted({label for label in labels if label and _LABEL_RE.match(label)})
+
+
+class ActiveIndex:
+    """Имя активного индекса для поиска; перечитывается из реестра не чаще раза в VECTOR_INDEX_REFRESH секунд."""
+
+    def __init__(self, refresh: float = VECTOR_INDEX_REFRESH):
+        self.refresh = refresh
+        self.name = VECTOR_INDEX_NAME
+        self.loaded = 0.0
+        self.lock = threading.Lock()
+
+    def get(self, session) -> str:
+        with self.lock:
+            if time.monotonic() - self.loaded < self.refresh:
+                return self.name
+            self.loaded = time.monotonic()
+        try:
+            name = read_registry(session)["active"]
+        except Exception:
+            # Реестр недоступен - остаёмся на известном имени, поиск сам сообщит об ошибке
+            return self.name
+        with self.lock:
+            self.name = name
+        return name
+
+    def invalidate(self):
+        with self.lock:
+            self.loaded = 0.0
+
+
+def index_info(session) -> List[Dict[str, Any]]:
+    try:
+        return [dict(r) for r in session.run(INDEX_INFO)]
+    except Exception:
+        # Старые версии Memgraph не умеют show_index_info
+        return []
+
+
+def chunk_dimensions(session) -> Dict[int, int]:
+    return {r["dimension"]: r["chunks"] for r in session.run(CHUNK_DIMENSIONS)}
+
+
+def status(session, model: str = EMBEDDING_MODEL) -> Dict[str, Any]:
+    """Активный индекс, заполнение, оценка памяти и проблемы (размерность, переполнение)."""
+    registry = read_registry(session)
+    dims = chunk_dimensions(session)
+    expected = expected_dimension(model)
+    indexes = index_info(session)
+    active = next((i for i in indexes if i.get("index_name") == registry["active"]), {})
+    dimension = active.get("dimension") or registry.get("dimension") or expected
+    capacity = active.get("capacity") or registry.get("capacity")
+    size = active.get("size")
+    if size is None:
+        size = dims.get(dimension, 0)
+
+    problems = []
+    if expected is not None and dimension != expected:
+        problems.append(f"размерность индекса {dimension}, а модель {model} даёт {expected}")
+    wrong = {d: n for d, n in dims.items() if d != dimension}
+    if wrong:
+        problems.append(f"чанки с другой размерностью вектора (не попадут в индекс): {wrong}")
+    fill = round(size / capacity, 4) if capacity else None
+    if fill is not None and fill >= VECTOR_INDEX_FILL_WARN:
+        problems.append(f"индекс заполнен на {fill:.0%} (ёмкость {capacity})")
+    if registry.get("retiring") and time.time() > (registry.get("retire_after") or 0):
+        problems.append(f"старый индекс {registry['retiring']} не удалён после переключения (--abort)")
+
+    return {
+        "active": registry["active"],
+        "label": registry["label"],
+        "version": registry["version"],
+        "building": registry.get("building"),
+        "retiring": registry.get("retiring"),
+        "dimension": dimension,
+        "expected_dimension": expected,
+        "capacity": capacity,
+        "size": size,
+        "fill": fill,
+        "memory_mb": estimate_memory_mb(size, dimension or 0),
+        "reserved_memory_mb": estimate_memory_mb(capacity or 0, dimension or 0),
+        "recommended_capacity": plan_capacity(sum(dims.values())),
+        "chunk_dimensions": dims,
+        "indexes": indexes,
+        "problems": problems,
+    }
+
+
+def create_index(session, name: str, label: str, dimension: int, capacity: int):
+    # Имя, метка и конфигурация не передаются параметрами в DDL, поэтому проверены заранее
+    session.run(
+        f'CREATE VECTOR INDEX {name} ON :{label}(embedding) '
+        f'WITH CONFIG {{"dimension": {int(dimension)}, "metric": "{VECTOR_INDEX_METRIC}", "capacity": {int(capacity)}}}'
+    ).consume()
+
+
+def drop_index(session, name: str) -> bool:
+    try:
+        session.run(f"DROP VECTOR INDEX {name}").consume()
+        return True
+    except Exception:
+        return False
+
+
+def drop_all(session) -> List[str]:
+    """Удаляет все векторные индексы (полный сброс базы)."""
+    names = {i.get("index_name") for i in index_info(session)} | {VECTOR_INDEX_NAME}
+    return [name for name in sorted(n for n in names if n) if drop_index(session, name)]
+
+
+def _relabel(session, query: str, label: str, **params) -> int:
+    total = 0
+    while True:
+        n = session.run(query.format(label=label), batch=VECTOR_INDEX_BATCH, **params).single()["n"]
+        total += n
+        if not n:
+            return total
+
+
+def _label_chunks(session, label: str, dimension: int) -> int:
+    total, after = 0, ""
+    while True:
+        record = session.run(LABEL_BATCH.format(label=label), batch=VECTOR_INDEX_BATCH,
+                             dimension=dimension, after=after).single()
+        if not record["n"]:
+            return total
+        total += record["n"]
+        after = record["last"]
+
+
+def init_index(session, model: str = EMBEDDING_MODEL, projected: int = VECTOR_INDEX_PROJECTED_CHUNKS) -> Dict[str, Any]:
+    """Индекс для пустой базы: исходное имя на :Chunk, ёмкость по прогнозу."""
+    dimension = expected_dimension(model)
+    if dimension is None:
+        raise ValueError(f"неизвестная размерность для модели {model} (EMBEDDING_DIMENSIONS)")
+    capacity = plan_capacity(0, projected)
+    create_index(session, VECTOR_INDEX_NAME, "Chunk", dimension, capacity)
+    write_registry(session, active=VECTOR_INDEX_NAME, label="Chunk", version=0,
+                   dimension=dimension, capacity=capacity, building=None, building_label=None)
+    return {"active": VECTOR_INDEX_NAME, "dimension": dimension, "capacity": capacity}
+
+
+def rebuild(session, model: str = EMBEDDING_MODEL, projected: int = VECTOR_INDEX_PROJECTED_CHUNKS,
+            capacity: Optional[int] = None, grace: float = VECTOR_INDEX_GRACE) -> Dict[str, Any]:
+    """Строит индекс новой версии рядом со старым и атомарно переключает на него поиск.
+
+    1. Пустой индекс на новой метке ChunkV<n> и отметка в реестре: с этого момента загрузка
+       ставит новую метку всем записываемым чанкам.
+    2. Существующие чанки получают метку пачками - вставки в индекс идут понемногу.
+    3. Реестр переключается одной транзакцией; query.py подхватывает новое имя за VECTOR_INDEX_REFRESH.
+    4. После grace секунд старый индекс удаляется, а его метка снимается (retire). Старый индекс
+       записан в реестре, так что при обрыве его удалит следующий --rebuild или --abort.
+    """
+    dimension = expected_dimension(model)
+    if dimension is None:
+        raise ValueError(f"неизвестная размерность для модели {model} (EMBEDDING_DIMENSIONS)")
+    retire(session)
+    registry = read_registry(session)
+    if registry.get("building"):
+        raise RuntimeError(f"уже строится {registry['building']}: дождитесь окончания или удалите его "
+                           f"(--abort)")
+    dims = chunk_dimensions(session)
+    skipped = sum(n for d, n in dims.items() if d != dimension)
+    capacity = capacity or plan_capacity(dims.get(dimension, 0), projected)
+    version = registry["version"] + 1
+    name, label = f"{VECTOR_INDEX_NAME}_v{version}", f"ChunkV{version}"
+
+    print(f"🔧 Создаю {name} на :{label} (dimension={dimension}, capacity={capacity})...")
+    create_index(session, name, label, dimension, capacity)
+    write_registry(session, building=name, building_label=label)
+    started = time.time()
+    labeled = _label_chunks(session, label, dimension)
+    print(f"🏷️ Чанков в новом индексе: {labeled} за {time.time() - started:.1f}с"
+          + (f", пропущено с другой размерностью: {skipped}" if skipped else ""))
+
+    old_name, old_label = registry["active"], registry["label"]
+    write_registry(session, active=name, label=label, version=version, dimension=dimension,
+                   capacity=capacity, building=None, building_label=None,
+                   retiring=old_name, retiring_label=old_label, retire_after=time.time() + grace)
+    # Чанки, записанные между последней пачкой и переключением
+    labeled += _label_chunks(session, label, dimension)
+    print(f"🔀 Поиск переключён на {name}; старый {old_name} удалю через {grace:.0f}с.")
+
+    retire(session)
+    return {"active": name, "previous": old_name, "dimension": dimension, "capacity": capacity,
+            "chunks": labeled, "skipped": skipped}
+
+
+def retire(session) -> Optional[str]:
+    """Удаляет старый индекс, отложенный после переключения: ждёт остаток grace, снимает метку."""
+    registry = read_registry(session)
+    name, label = registry.get("retiring"), registry.get("retiring_label")
+    if not name:
+        return None
+    wait = (registry.get("retire_after") or 0) - time.time()
+    if wait > 0:
+        time.sleep(wait)
+    if name != registry["active"]:
+        drop_index(session, name)
+    if label and label != "Chunk" and label != registry["label"] and _LABEL_RE.match(label):
+        _relabel(session, UNLABEL_BATCH, label)
+    write_registry(session, retiring=None, retiring_label=None, retire_after=None)
+    print(f"🗑️ Старый индекс {name} удалён.")
+    return name
+
+
+def abort_build(session) -> Optional[str]:
+    """Удаляет недостроенный индекс (например, после обрыва --rebuild)."""
+    registry = read_registry(session)
+    name, label = registry.get("building"), registry.get("building_label")
+    if not name:
+        return None
+    drop_index(session, name)
+    write_registry(session, building=None, building_label=None)
+    if label and _LABEL_RE.match(label) and label != registry["label"]:
+        _relabel(session, UNLABEL_BATCH, label)
+    return name
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+    from neo4j import GraphDatabase
+
+    parser = argparse.ArgumentParser(description="Векторный индекс чанков: состояние, проверка, пересборка без простоя")
+    parser.add_argument("--check", action="store_true", help="Код выхода 1, если есть проблемы")
+    parser.add_argument("--rebuild", action="store_true", help="Собрать новую версию индекса и переключить поиск")
+    parser.add_argument("--abort", action="store_true", help="Удалить недостроенную и оставшуюся после переключения версии индекса")
+    parser.add_argument("--projected", type=int, default=VECTOR_INDEX_PROJECTED_CHUNKS,
+                        help="Ожидаемое число чанков для расчёта ёмкости")
+    parser.add_argument("--capacity", type=int, help="Явная ёмкость вместо расчётной")
+    parser.add_argument("--grace", type=float, default=VECTOR_INDEX_GRACE,
+                        help="Сколько секунд держать старый индекс после переключения")
+    args = parser.parse_args()
+
+    driver = GraphDatabase.driver(os.getenv("MEMGRAPH_URI", "bolt://localhost:7687"),
+                                  auth=(os.getenv("MEMGRAPH_USER", ""), os.getenv("MEMGRAPH_PASSWORD", "")))
+    with driver.session() as session:
+        if args.abort:
+            print(f"🗑️ Удалён недостроенный индекс: {abort_build(session)}")
+            retire(session)
+        if args.rebuild:
+            print(json.dumps(rebuild(session, projected=args.projected, capacity=args.capacity, grace=args.grace),
+                             ensure_ascii=False))
+        report = status(session)
+    driver.close()
+    json.dump(report, sys.stdout, indent=2, ensure_ascii=False, default=str)
+    print()
+    if args.check and report["problems"]:
+        for p in report["problems"]:
+            print(f"⚠️ {p}", file=sys.stderr)
+        sys.exit(1)
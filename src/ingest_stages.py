@@ -0,0 +1,183 @@
+import os
+import time
+import queue
+import inspect
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Iterable, Iterator, List, Optional
+
+from metrics import METRICS
+
+# --- КОНФИГУРАЦИЯ ---
+# Процессы для Docling (CPU-bound); 0 = конвертировать в текущем процессе
+CONVERT_WORKERS = int(os.getenv("CONVERT_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+# Поток чтения ждёт конвертацию своего PDF: при меньшем числе потоков часть пула Docling простаивает
+READ_WORKERS = int(os.getenv("READ_WORKERS", str(max(2, CONVERT_WORKERS))))
+CHUNK_WORKERS = int(os.getenv("CHUNK_WORKERS", "1"))
+ENRICH_WORKERS = int(os.getenv("ENRICH_WORKERS", "2"))
+# Ёмкость очереди между стадиями: ограничивает число документов (сегментов) в памяти
+STAGE_QUEUE_SIZE = int(os.getenv("STAGE_QUEUE_SIZE", "2"))
+# Потоковое чтение: файл читается блоками, чанки уходят дальше сегментами, а не целым документом
+STREAM_BLOCK_CHARS = int(os.getenv("STREAM_BLOCK_CHARS", "1000000"))
+STREAM_SEGMENT_CHUNKS = int(os.getenv("STREAM_SEGMENT_CHUNKS", "64"))
+
+_DONE = object()
+
+# Конвертер Docling создаётся один раз в каждом процессе пула
+_converter = None
+
+
+def _init_converter():
+    global _converter
+    from docling.document_converter import DocumentConverter
+    _converter = DocumentConverter()
+
+
+def convert_pdf(filepath: str, out_path: str) -> int:
+    """Выполняется в процессе пула: PDF -> Markdown через Docling, постранично в файл out_path.
+
+    Markdown не возвращается строкой: основной процесс читает файл блоками и не держит документ целиком.
+    """
+    if _converter is None:
+        _init_converter()
+    document = _converter.convert(filepath).document
+    pages = sorted(getattr(document, "pages", None) or [])
+    with open(out_path, "w", encoding="utf-8") as f:
+        if not pages:
+            f.write(document.export_to_markdown())
+        for page_no in pages:
+            f.write(document.export_to_markdown(page_no=page_no))
+            f.write("\n\n")
+    return os.path.getsize(out_path)
+
+
+def iter_text_blocks(filepath: str, block_chars: int = STREAM_BLOCK_CHARS,
+                     remove_after: bool = False) -> Iterator[str]:
+    """Читает текстовый файл блоками по block_chars символов (UTF-8 декодируется потоково)."""
+    try:
+        with open(filepath, "r", encoding="utf-8") as f:
+            carry = ""
+            while True:
+                with METRICS.span("ingest.read_file"):
+                    block = f.read(block_chars)
+                if not block:
+                    break
+                block = carry + block
+                # Последовательность '\\0' могла разорваться на границе блоков
+                carry = "\\" if block.endswith("\\") else ""
+                if carry:
+                    block = block[:-1]
+                yield block.replace('\\0', '')
+            if carry:
+                yield carry
+    finally:
+        if remove_after:
+            os.remove(filepath)
+
+
+def stream_chunks(blocks: Iterable[str], chunker: Callable, min_chars: int = STREAM_BLOCK_CHARS) -> Iterator[str]:
+    """Лениво режет поток текста на чанки; результат совпадает с chunker(весь_текст).
+
+    Последний чанк буфера может быть неполным, поэтому он не отдаётся, а буфер продолжается
+    с его начала (start_index): так перекрытие между чанками сохраняется и на границах блоков.
+    """
+    buffer = ""
+    for block in blocks:
+        buffer += block
+        if len(buffer) < min_chars:
+            continue
+        chunks = chunker(buffer)
+        if len(chunks) < 2:
+            continue
+        for chunk in chunks[:-1]:
+            yield chunk.text
+        buffer = buffer[chunks[-1].start_index:]
+    if buffer:
+        for chunk in chunker(buffer):
+            yield chunk.text
+
+
+def make_convert_pool(workers: int = CONVERT_WORKERS) -> Optional[ProcessPoolExecutor]:
+    if workers <= 0:
+        return None
+    return ProcessPoolExecutor(max_workers=workers, initializer=_init_converter)
+
+
+class Stage:
+    """Стадия конвейера: workers потоков читают из inbox, пишут в outbox, None из fn = отбросить элемент."""
+
+    def __init__(self, name: str, fn: Callable, workers: int = 1, queue_size: int = STAGE_QUEUE_SIZE):
+        self.name = name
+        self.fn = fn
+        self.workers = max(1, workers)
+        self.inbox: "queue.Queue" = queue.Queue(maxsize=max(1, queue_size))
+        self.next: Optional["Stage"] = None
+        self.threads: List[threading.Thread] = []
+        self.alive = 0
+        self.lock = threading.Lock()
+        self.processed = 0
+        self.failed = 0
+        # Длительность обработки каждого элемента, секунды
+        self.durations: List[float] = []
+
+    def _loop(self):
+        while True:
+            item = self.inbox.get()
+            if item is _DONE:
+                break
+            started = time.perf_counter()
+            try:
+                with METRICS.span(f"stage.{self.name}"):
+                    result = self.fn(item)
+                    if inspect.isgenerator(result):
+                        # Стадия отдаёт несколько элементов (сегменты документа); для неё в замер
+                        # входит и ожидание места в очереди следующей стадии
+                        for part in result:
+                            self._forward(part)
+                        result = None
+            except Exception as e:
+                with self.lock:
+                    self.failed += 1
+                print(f"      ❌ [{self.name}] Ошибка: {e}")
+                continue
+            with self.lock:
+                self.processed += 1
+                self.durations.append(time.perf_counter() - started)
+            self._forward(result)
+        with self.lock:
+            self.alive -= 1
+            last = self.alive == 0
+        if last and self.next is not None:
+            for _ in range(self.next.workers):
+                self.next.inbox.put(_DONE)
+
+    def _forward(self, result):
+        if result is not None and self.next is not None:
+            # put() блокируется, если следующая стадия не успевает - это и есть backpressure
+            self.next.inbox.put(result)
+
+    def start(self):
+        self.alive = self.workers
+        for n in range(self.workers):
+            t = threading.Thread(target=self._loop, name=f"{self.name}-{n}", daemon=True)
+            t.start()
+            self.threads.append(t)
+
+
+def run_stages(items: Iterable, stages: List[Stage]) -> List[Stage]:
+    """Прогоняет элементы через цепочку стадий и ждёт завершения последней."""
+    for stage, nxt in zip(stages, stages[1:]):
+        stage.next = nxt
+    for stage in stages:
+        stage.start()
+
+    head = stages[0]
+    for item in items:
+        head.inbox.put(item)
+    for _ in range(head.workers):
+        head.inbox.put(_DONE)
+
+    for stage in stages:
+        for t in stage.threads:
+            t.join()
+    return stages
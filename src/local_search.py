@@ -0,0 +1,297 @@
+import os
+import json
+import shutil
+import argparse
+from typing import List, Tuple, Optional, Iterable, Dict
+
+import numpy as np
+
+# --- КОНФИГУРАЦИЯ ---
+LOCAL_INDEX_DIR = os.getenv("LOCAL_INDEX_DIR", ".cache/local_index")
+# Сколько строк матрицы умножаем за раз: ограничивает пиковую память при поиске
+SEARCH_BLOCK_ROWS = int(os.getenv("SEARCH_BLOCK_ROWS", "65536"))
+EXPORT_PAGE_SIZE = int(os.getenv("EXPORT_PAGE_SIZE", "2000"))
+# Доля удалённых строк, после которой refresh перестраивает матрицу целиком
+COMPACT_RATIO = float(os.getenv("COMPACT_RATIO", "0.2"))
+# Квантованная копия матрицы для первого прохода поиска: none | int8 (1 байт на компоненту) |
+# binary (1 бит); кандидаты (k * QUANT_OVERSAMPLE) пересчитываются по полной float32 матрице
+LOCAL_INDEX_QUANTIZATION = os.getenv("LOCAL_INDEX_QUANTIZATION", "none")
+QUANT_OVERSAMPLE = int(os.getenv("QUANT_OVERSAMPLE", "4"))
+QUANTIZATIONS = ("none", "int8", "binary")
+
+# Число единичных битов в каждом байте: расстояние Хэмминга для binary
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.int32)
+
+ALL_CHUNK_IDS = """
+MATCH (c:Chunk)
+WHERE c.embedding IS NOT NULL AND size(c.embedding) > 0
+RETURN c.id AS id
+"""
+
+CHUNK_EMBEDDINGS = """
+UNWIND $ids AS id
+MATCH (c:Chunk {id: id})
+RETURN c.id AS id, c.embedding AS embedding
+"""
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def top_k(scores: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Индексы и значения k лучших по каждой строке scores (q x n), отсортированные по убыванию."""
+    k = min(k, scores.shape[1])
+    idx = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    vals = np.take_along_axis(scores, idx, axis=1)
+    order = np.argsort(-vals, axis=1)
+    return np.take_along_axis(idx, order, axis=1), np.take_along_axis(vals, order, axis=1)
+
+
+def quantize(matrix: np.ndarray, kind: str) -> Tuple[np.ndarray, np.ndarray]:
+    """Коды строк нормированной матрицы и масштаб каждой строки (для binary масштаб не нужен)."""
+    if kind == "int8":
+        scales = np.abs(matrix).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        codes = np.rint(matrix / scales[:, None]).astype(np.int8)
+        return codes, scales.astype(np.float32)
+    return np.packbits(matrix > 0, axis=1), np.ones(len(matrix), dtype=np.float32)
+
+
+def approx_scores(q: np.ndarray, codes: np.ndarray, scales: np.ndarray, kind: str, dim: int) -> np.ndarray:
+    """Приближённое сходство запросов q (float32, нормированы) с квантованными строками."""
+    if kind == "int8":
+        # Асимметрично: запрос остаётся float32, квантуется только хранимая матрица
+        return (q @ codes.T.astype(np.float32)) * scales[None, :]
+    # По одному запросу: промежуточный массив XOR - размером с блок кодов, а не запросы x блок
+    bits = np.packbits(q > 0, axis=1)
+    hamming = np.stack([_POPCOUNT[np.bitwise_xor(codes, row)].sum(axis=1) for row in bits])
+    return 1.0 - 2.0 * hamming.astype(np.float32) / dim
+
+
+class LocalVectorIndex:
+    """Точный косинусный поиск по memory-mapped float32 матрице нормированных эмбеддингов чанков.
+
+    С квантованием (int8/binary) в памяти держатся только коды: первый проход идёт по ним,
+    а с диска читаются лишь строки кандидатов для точного пересчёта.
+    """
+
+    def __init__(self, path: str = LOCAL_INDEX_DIR, quantization: str = LOCAL_INDEX_QUANTIZATION,
+                 oversample: int = QUANT_OVERSAMPLE):
+        if quantization not in QUANTIZATIONS:
+            raise ValueError(f"LOCAL_INDEX_QUANTIZATION: ожидается одно из {QUANTIZATIONS}, получено {quantization!r}")
+        self.path = path
+        self.vectors_path = os.path.join(path, "vectors.f32")
+        self.ids_path = os.path.join(path, "ids.json")
+        self.quantization = quantization
+        self.oversample = max(1, oversample)
+        self.codes_path = os.path.join(path, f"codes.{quantization}")
+        self.scales_path = os.path.join(path, f"scales.{quantization}")
+        self.dim = 0
+        self.ids: List[Optional[str]] = []
+        self.vectors: Optional[np.memmap] = None
+        self.codes: Optional[np.ndarray] = None
+        self.scales: Optional[np.ndarray] = None
+        self.alive = np.zeros(0, dtype=bool)
+        self.row_of: Dict[str, int] = {}
+        self.loaded_mtime: Optional[float] = None
+        self._load()
+
+    # ---------------- Хранение ----------------
+
+    def _load(self):
+        if not os.path.exists(self.ids_path):
+            return
+        self.loaded_mtime = os.path.getmtime(self.ids_path)
+        with open(self.ids_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        self.dim = meta["dim"]
+        self.ids = meta["ids"]
+        self.row_of = {cid: row for row, cid in enumerate(self.ids) if cid is not None}
+        self.alive = np.array([cid is not None for cid in self.ids], dtype=bool)
+        if self.ids:
+            self.vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r",
+                                     shape=(len(self.ids), self.dim))
+            if self.quantization != "none":
+                self._load_codes()
+
+    def _load_codes(self):
+        # Коды пишутся вместе с векторами; матрица, собранная без квантования, кодируется один раз
+        dtype = np.int8 if self.quantization == "int8" else np.uint8
+        width = self.dim if self.quantization == "int8" else (self.dim + 7) // 8
+        if not (os.path.exists(self.codes_path) and
+                os.path.getsize(self.codes_path) == len(self.ids) * width):
+            for name in (self.codes_path, self.scales_path):
+                if os.path.exists(name):
+                    os.remove(name)
+            for start in range(0, len(self.ids), SEARCH_BLOCK_ROWS):
+                self._write_codes(np.asarray(self.vectors[start:start + SEARCH_BLOCK_ROWS]))
+        self.codes = np.fromfile(self.codes_path, dtype=dtype).reshape(len(self.ids), width)
+        self.scales = np.fromfile(self.scales_path, dtype=np.float32)
+
+    def _write_codes(self, matrix: np.ndarray):
+        codes, scales = quantize(matrix, self.quantization)
+        with open(self.codes_path, "ab") as f:
+            f.write(codes.tobytes())
+        with open(self.scales_path, "ab") as f:
+            f.write(scales.tobytes())
+
+    def _save_ids(self):
+        tmp = self.ids_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"dim": self.dim, "ids": self.ids}, f)
+        os.replace(tmp, self.ids_path)
+
+    def add(self, ids: List[str], embeddings: List[List[float]]):
+        """Дописывает векторы в матрицу (без Memgraph: так индекс собирается из готовых эмбеддингов)."""
+        rows = [(cid, emb) for cid, emb in zip(ids, embeddings) if emb]
+        if not rows:
+            return
+        if not self.dim:
+            self.dim = len(rows[0][1])
+        # Векторы другой размерности (старая модель, битые данные) в матрицу не попадают
+        rows = [(cid, emb) for cid, emb in rows if len(emb) == self.dim]
+        if not rows:
+            return
+        matrix = normalize_rows([emb for _, emb in rows])
+        os.makedirs(self.path, exist_ok=True)
+        self.vectors = None  # закрываем memmap перед дозаписью
+        with open(self.vectors_path, "ab") as f:
+            f.write(matrix.tobytes())
+        if self.quantization != "none" and os.path.exists(self.codes_path):
+            self._write_codes(matrix)
+        self.ids.extend(cid for cid, _ in rows)
+        self._save_ids()
+        self._load()
+
+    def __len__(self) -> int:
+        return int(self.alive.sum())
+
+    def changed_on_disk(self) -> bool:
+        """Индекс обновил другой процесс (refresh в конце main.py): пора открыть его заново."""
+        mtime = os.path.getmtime(self.ids_path) if os.path.exists(self.ids_path) else None
+        return mtime != self.loaded_mtime
+
+    # ---------------- Синхронизация с Memgraph ----------------
+
+    def _fetch(self, session, ids: List[str]) -> Iterable[Tuple[List[str], List[List[float]]]]:
+        for start in range(0, len(ids), EXPORT_PAGE_SIZE):
+            page = ids[start:start + EXPORT_PAGE_SIZE]
+            records = list(session.run(CHUNK_EMBEDDINGS, ids=page))
+            yield [r["id"] for r in records], [r["embedding"] for r in records]
+
+    def rebuild(self, driver) -> int:
+        """Полный экспорт всех эмбеддингов чанков из Memgraph."""
+        if os.path.exists(self.path):
+            shutil.rmtree(self.path)
+        self.dim, self.ids, self.vectors, self.codes, self.scales = 0, [], None, None, None
+        self.alive, self.row_of = np.zeros(0, dtype=bool), {}
+        with driver.session() as session:
+            ids = sorted(r["id"] for r in session.run(ALL_CHUNK_IDS))
+            for page_ids, page_vectors in self._fetch(session, ids):
+                self.add(page_ids, page_vectors)
+        return len(self)
+
+    def refresh(self, driver) -> Dict[str, int]:
+        """Инкрементальное обновление: дописывает новые чанки, помечает удалённые."""
+        with driver.session() as session:
+            current = {r["id"] for r in session.run(ALL_CHUNK_IDS)}
+            known = set(self.row_of)
+            new_ids = sorted(current - known)
+            gone = known - current
+
+            for cid in gone:
+                self.ids[self.row_of.pop(cid)] = None
+            if gone:
+                self.alive = np.array([cid is not None for cid in self.ids], dtype=bool)
+                if len(self.ids) and (len(self.ids) - len(self)) / len(self.ids) > COMPACT_RATIO:
+                    self.rebuild(driver)
+                    return {"added": len(new_ids), "removed": len(gone), "rebuilt": 1}
+                self._save_ids()
+
+            for page_ids, page_vectors in self._fetch(session, new_ids):
+                self.add(page_ids, page_vectors)
+        return {"added": len(new_ids), "removed": len(gone), "rebuilt": 0}
+
+    # ---------------- Поиск ----------------
+
+    def search(self, queries: List[List[float]], k: int = 3) -> List[List[Tuple[str, float]]]:
+        """Top-k по косинусу для пачки запросов: точный или по квантованным кодам с точным пересчётом."""
+        if self.vectors is None or not len(self) or not queries:
+            return [[] for _ in queries]
+        q = normalize_rows(queries)
+        if self.codes is None:
+            best_idx, best_val = self._scan(q, k, lambda start, stop: q @ np.asarray(self.vectors[start:stop]).T)
+        else:
+            best_idx, best_val = self._scan(q, k * self.oversample, lambda start, stop: approx_scores(
+                q, self.codes[start:stop], self.scales[start:stop], self.quantization, self.dim))
+            best_idx, best_val = self._rescore(q, best_idx, best_val, k)
+        return [
+            [(self.ids[i], float(v)) for i, v in zip(row_idx, row_val) if np.isfinite(v)]
+            for row_idx, row_val in zip(best_idx, best_val)
+        ]
+
+    def _scan(self, q: np.ndarray, k: int, score_block) -> Tuple[np.ndarray, np.ndarray]:
+        best_idx = np.zeros((len(q), 0), dtype=np.int64)
+        best_val = np.zeros((len(q), 0), dtype=np.float32)
+        for start in range(0, len(self.ids), SEARCH_BLOCK_ROWS):
+            stop = min(start + SEARCH_BLOCK_ROWS, len(self.ids))
+            scores = score_block(start, stop)
+            scores[:, ~self.alive[start:stop]] = -np.inf
+            idx, val = top_k(scores, k)
+            # Сливаем лучшие кандидаты блока с уже найденными
+            best_idx = np.concatenate([best_idx, idx + start], axis=1)
+            best_val = np.concatenate([best_val, val], axis=1)
+            order, best_val = top_k(best_val, k)
+            best_idx = np.take_along_axis(best_idx, order, axis=1)
+        return best_idx, best_val
+
+    def _rescore(self, q: np.ndarray, idx: np.ndarray, val: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        # Точный косинус только для кандидатов: с диска читаются их строки, а не вся матрица
+        exact = np.full(idx.shape, -np.inf, dtype=np.float32)
+        for n in range(len(q)):
+            found = np.isfinite(val[n])
+            rows = idx[n][found]
+            exact[n][found] = np.asarray(self.vectors[rows]) @ q[n]
+        order, exact = top_k(exact, k)
+        return np.take_along_axis(idx, order, axis=1), exact
+
+    def rerank(self, query: List[float], candidate_ids: List[str], k: int = 3,
+               embeddings: Optional[List[List[float]]] = None) -> List[Tuple[str, float]]:
+        """Точный пересчёт score для кандидатов приближённого поиска (ANN)."""
+        q = normalize_rows([query])[0]
+        scored = []
+        for n, cid in enumerate(candidate_ids):
+            row = self.row_of.get(cid)
+            if row is not None:
+                vec = self.vectors[row]
+            elif embeddings is not None and embeddings[n] and len(embeddings[n]) == len(q):
+                vec = normalize_rows([embeddings[n]])[0]
+            else:
+                continue
+            scored.append((cid, float(np.dot(vec, q))))
+        scored.sort(key=lambda x: x[1], reverse=True)
+        return scored[:k]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Локальный точный векторный поиск по эмбеддингам из Memgraph")
+    parser.add_argument("--rebuild", action="store_true", help="Полный экспорт эмбеддингов из Memgraph")
+    parser.add_argument("--refresh", action="store_true", help="Дописать новые чанки, убрать удалённые")
+    parser.add_argument("--query", help="Проверочный вопрос")
+    parser.add_argument("-k", type=int, default=3)
+    args = parser.parse_args()
+
+    import query
+    index = LocalVectorIndex()
+    if args.rebuild:
+        print(f"✅ Экспортировано векторов: {index.rebuild(query.get_driver())}")
+    elif args.refresh:
+        print(f"✅ Обновлено: {index.refresh(query.get_driver())}, всего векторов: {len(index)}")
+    if args.query:
+        for cid, score in index.search([query.get_embedding(args.query)], args.k)[0]:
+            print(f"   {score:.4f}  {cid}")
+    query.close()
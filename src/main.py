@@ -1,12 +1,11 @@
 print("🚀 [1/6] Инициализация Python...")
 import os
 import json
-import uuid
+import argparse
 import time
-import re
-import glob
 import sys
-from typing import List, Dict, Any
+import tempfile
+from typing import List, Dict, Any, Optional
 
 # Ловим ошибки импорта
 try:
@@ -15,9 +14,31 @@ try:
     import google.generativeai as genai
     from chonkie import TokenChunker
     from neo4j import GraphDatabase
-    # --- НОВОЕ: Импорт Docling для PDF ---
-    from docling.document_converter import DocumentConverter
-    print("✅ [2/6] Библиотеки загружены (включая Docling)")
+    from ingest_stages import (
+        Stage, run_stages, convert_pdf, make_convert_pool, iter_text_blocks, stream_chunks,
+        CONVERT_WORKERS, READ_WORKERS, CHUNK_WORKERS, ENRICH_WORKERS, STREAM_SEGMENT_CHUNKS,
+    )
+    from graph_writer import GraphWriteBatcher, is_valid_embedding
+    from checkpoint import IngestCheckpoint, CHUNK_RETRY_PASSES, CHUNK_RETRY_DELAY
+    from answer_cache import AnswerCache
+    from dedup import DedupIndex, DEDUP
+    from index_manager import status as index_status, read_registry, EMBEDDING_MODEL, EMBEDDING_DIMENSIONS
+    from sharded_ingest import shard_of, run_sharded, INGEST_SHARDS
+    from local_search import LocalVectorIndex
+    from metrics import METRICS
+    from manifest import (
+        build_manifest, load_manifest, config_changed, content_unchanged, stat_changed, touch_manifest,
+        make_chunk_id, make_doc_id, chunker_config_json, file_hash,
+    )
+    from extraction import GraphExtractor, pack_texts, empty_graph
+    from entity_resolution import EntityResolver, ENTITY_RESOLUTION
+    from embeddings import EmbeddingService, EMBEDDING_BATCH_SIZE, batched
+    from workers import (
+        ModelScheduler, WorkerPool,
+        EXTRACTION_CONCURRENCY, EXTRACTION_RPM, EXTRACTION_TPM,
+        EMBEDDING_CONCURRENCY, EMBEDDING_RPM, EMBEDDING_TPM,
+    )
+    print("✅ [2/6] Библиотеки загружены (Docling - при первом PDF)")
 except ImportError as e:
     print(f"❌ Ошибка импорта: {e}")
     sys.exit(1)
@@ -25,6 +46,10 @@ except ImportError as e:
 # --- КОНФИГУРАЦИЯ ---
 MEMGRAPH_URI = os.getenv("MEMGRAPH_URI", "bolt://localhost:7687")
 MEMGRAPH_AUTH = (os.getenv("MEMGRAPH_USER", ""), os.getenv("MEMGRAPH_PASSWORD", ""))
+CHUNKER_CONFIG = {"tokenizer": "gpt2", "chunk_size": 512, "chunk_overlap": 50}
+# Поиск не только через Memgraph (local/auto): локальная матрица обновляется в конце загрузки
+RETRIEVAL_BACKEND = os.getenv("RETRIEVAL_BACKEND", "memgraph")
+SUPPORTED_EXTENSIONS = (".txt", ".md", ".pdf")
 
 if "GEMINI_API_KEY" not in os.environ:
     print("❌ Ошибка: Не найден GEMINI_API_KEY")
@@ -32,85 +57,151 @@ if "GEMINI_API_KEY" not in os.environ:
 
 genai.configure(api_key=os.environ["GEMINI_API_KEY"])
 
-# Системный промпт
-SYSTEM_PROMPT = """
-You are an expert Knowledge Graph Engineer.
-Extract entities and relationships from the text.
-
-STRICT JSON OUTPUT FORMAT (NO MARKDOWN, NO COMMENTS):
-{
-  "entities": [
-    {"id": "Entity Name", "type": "Category"}
-  ],
-  "relations": [
-    {"source": "Entity Name", "target": "Entity Name", "type": "RELATION_TYPE"}
-  ]
-}
-Normalize IDs. Use SCREAMING_SNAKE_CASE for relation types.
-"""
+def _share(limit: int, shards: int) -> int:
+    """Доля лимита на один из shards процессов; 0 (без ограничения) так и остаётся 0."""
+    return max(1, limit // shards) if limit > 0 else limit
+
 
 class HybridGraphPipeline:
-    def __init__(self, uri, auth, extraction_model="gemini-2.5-flash"):
+    def __init__(self, uri, auth, extraction_model="gemini-2.5-flash", incremental=True,
+                 driver=None, client=genai, resume=False, shard=None, writer_queue=None, dedup_run=None):
+        # driver и client можно подменить (бенчмарк с фейковыми Memgraph и Gemini)
         print(f"🔌 [3/6] Подключение к Memgraph ({uri})...")
         try:
-            self.driver = GraphDatabase.driver(uri, auth=auth)
+            self.driver = driver or GraphDatabase.driver(uri, auth=auth)
             self.driver.verify_connectivity()
             print("✅ Подключение успешно!")
         except Exception as e:
             print(f"❌ Не удалось подключиться к базе: {e}")
             sys.exit(1)
             
-        self.chunker = TokenChunker(tokenizer="gpt2", chunk_size=512, chunk_overlap=50)
-        # Инициализация конвертера PDF
-        self.pdf_converter = DocumentConverter()
+        self.chunker = TokenChunker(**CHUNKER_CONFIG)
+        # Процесс-шард получает свою долю процессов Docling и лимитов Gemini: в сумме по шардам
+        # они те же, что у загрузки одним процессом
+        shards = shard[1] if shard is not None else 1
+        # PDF конвертируются в отдельных процессах (Docling нагружает CPU)
+        self.convert_pool = make_convert_pool(_share(CONVERT_WORKERS, shards))
         
-        self.extraction_model = genai.GenerativeModel(
-            model_name=extraction_model,
-            system_instruction=SYSTEM_PROMPT,
-            generation_config={"temperature": 0.1, "response_mime_type": "application/json"}
-        )
-        self.embedding_model_name = "models/text-embedding-004" 
+        self.embedding_model_name = EMBEDDING_MODEL
+
+        # Планировщики лимитов на каждую модель и общий пул потоков для API-вызовов
+        self.extraction_scheduler = ModelScheduler(
+            extraction_model, EXTRACTION_CONCURRENCY, _share(EXTRACTION_RPM, shards), _share(EXTRACTION_TPM, shards))
+        self.embedding_scheduler = ModelScheduler(
+            self.embedding_model_name, EMBEDDING_CONCURRENCY,
+            _share(EMBEDDING_RPM, shards), _share(EMBEDDING_TPM, shards))
+        self.workers = WorkerPool(EXTRACTION_CONCURRENCY + EMBEDDING_CONCURRENCY)
+        # Извлечение графа с кэшем по (модель, промпт, конфигурация, текст чанка)
+        self.extractor = GraphExtractor(extraction_model, scheduler=self.extraction_scheduler, client=client)
+        # Пакетные эмбеддинги с дисковым кэшем: повторная загрузка того же текста бесплатна
+        self.embedder = EmbeddingService(self.embedding_model_name, scheduler=self.embedding_scheduler,
+                                         client=client)
+
+        # Индекс с другой размерностью отверг бы каждую запись чанка
+        with self.driver.session() as session:
+            indexed = read_registry(session).get("dimension")
+        expected = self.embedder.dimensions or EMBEDDING_DIMENSIONS.get(self.embedding_model_name)
+        if indexed and expected and indexed != expected:
+            print(f"❌ Векторный индекс построен для размерности {indexed}, а эмбеддинги будут {expected}: "
+                  f"сначала python src/index_manager.py --rebuild")
+            sys.exit(1)
+
+        # Шардированная загрузка (sharded_ingest.py): процесс-шард берёт свою долю файлов (shard = (номер, всего))
+        # и отдаёт готовые сегменты в writer_queue, а пишет в граф один процесс-координатор
+        self.shard = shard
+        self.writer_queue = writer_queue
+
+        # Индекс сущностей в памяти: "Memgraph", "memgraph" и "Memgraph DB" -> один узел.
+        # Шарду он не нужен: сущности сводит к каноническим тот, кто пишет
+        self.resolver = None
+        if ENTITY_RESOLUTION and writer_queue is None:
+            self.resolver = EntityResolver()
+            self.resolver.load_aliases()
+            with self.driver.session() as session:
+                print(f"🧬 Известных сущностей: {self.resolver.load(session)}")
+
+        # Инкрементальный режим: неизменённые файлы пропускаются по манифесту документа
+        self.incremental = incremental
+        # Журнал загрузки: статусы чанков, очередь повторов, продолжение прерванных файлов (resume)
+        self.checkpoint = IngestCheckpoint()
+        self.resume = resume
+        self.chunk_failures = 0
+        self.documents_written = 0
+        # Индекс канонических чанков корпуса: дубликаты ссылаются на них, а не обрабатываются заново
+        self.dedup = DedupIndex(run=dedup_run) if DEDUP else None
+        # Кэш ответов сервера вопросов: ответы по перезаписанным и удалённым чанкам удаляются
+        self.answer_cache = AnswerCache()
+        # Сегменты документа могут обогащаться параллельно и приходить на запись не по порядку
+        self.write_order: Dict[str, Dict[str, Any]] = {}
+        self.manifest_config = {
+            "chunker_config": chunker_config_json(**CHUNKER_CONFIG),
+            "extraction_model": extraction_model,
+            # С размерностью: смена EMBEDDING_DIM переобрабатывает документы новыми векторами
+            "embedding_model": self.embedder.model_key,
+            "prompt_hash": self.extractor.prompt_hash,
+        }
 
     def close(self):
+        if self.convert_pool is not None:
+            self.convert_pool.shutdown()
+        self.workers.shutdown()
+        self.embedder.close()
+        self.extractor.close()
+        self.checkpoint.close()
+        self.answer_cache.close()
+        if self.dedup is not None:
+            self.dedup.close()
         self.driver.close()
 
-    def _generate_embedding(self, text: str) -> List[float]:
-        try:
-            return genai.embed_content(
-                model=self.embedding_model_name,
-                content=text,
-                task_type="retrieval_document"
-            )['embedding']
-        except Exception as e:
-            print(f"⚠️ Ошибка вектора: {e}")
-            return []
+    def _generate_embeddings(self, texts: List[str]) -> List[List[float]]:
+        # Ошибку не глотаем: чанки пачки уйдут в очередь повторов, а не в индекс с пустым вектором
+        with METRICS.span("ingest.embed"):
+            return self.embedder.embed_documents(texts)
 
-    def _extract_graph_data(self, text: str) -> Dict[str, Any]:
-        try:
-            resp = self.extraction_model.generate_content(f"Extract graph from:\\n\\n{text}")
-            raw = resp.text
-            if "```" in raw:
-                raw = re.sub(r"```json|```", "", raw).strip()
-            return json.loads(raw)
-        except:
-            return {"entities": [], "relations": []}
-
-    def _read_file_content(self, filepath: str) -> str:
-        """Читает файл в зависимости от расширения."""
+    def _extract_graph_data(self, texts: List[str]) -> List[Dict[str, Any]]:
+        # Пачка из нескольких чанков уходит одним запросом (EXTRACTION_PACK_SIZE > 1)
+        with METRICS.span("ingest.extract"):
+            return self.extractor.extract_pack(texts)
+
+    def _read_blocks(self, filepath: str):
+        """Итератор блоков текста файла; весь документ в памяти не держится."""
         ext = os.path.splitext(filepath)[1].lower()
-        
+
         if ext == ".pdf":
+            # Docling конвертирует PDF в Markdown постранично во временный файл (в пуле процессов,
+            # если он есть), а читаем мы его тем же потоковым способом, что и текст
+            fd, md_path = tempfile.mkstemp(suffix=".md")
+            os.close(fd)
             try:
-                # Docling конвертирует PDF в Markdown
-                result = self.pdf_converter.convert(filepath)
-                return result.document.export_to_markdown()
+                with METRICS.span("ingest.pdf_convert"):
+                    if self.convert_pool is not None:
+                        size = self.convert_pool.submit(convert_pdf, filepath, md_path).result()
+                    else:
+                        size = convert_pdf(filepath, md_path)
             except Exception as e:
+                os.remove(md_path)
                 print(f"      ❌ Ошибка Docling: {e}")
-                return ""
-        else:
-            # Обычный текст
-            with open(filepath, "r", encoding="utf-8") as f:
-                return f.read().replace('\\0', '')
+                return None
+            if not size:
+                os.remove(md_path)
+                return None
+            return iter_text_blocks(md_path, remove_after=True)
+
+        # Обычный текст
+        if not os.path.getsize(filepath):
+            return None
+        return iter_text_blocks(filepath)
+
+    def _discover_files(self, data_dir: str):
+        # Генератор: огромная папка не материализуется в список целиком
+        for root, _, names in os.walk(data_dir):
+            for name in sorted(names):
+                if os.path.splitext(name)[1].lower() not in SUPPORTED_EXTENSIONS:
+                    continue
+                # Шард выбирается по ID документа: один документ никогда не обрабатывают два процесса
+                if self.shard is not None and shard_of(make_doc_id(name), self.shard[1]) != self.shard[0]:
+                    continue
+                yield os.path.join(root, name)
 
     def process_directory(self, data_dir: str):
         abs_path = os.path.abspath(data_dir)
@@ -120,91 +211,409 @@ class HybridGraphPipeline:
             print(f"❌ Папка '{data_dir}' не существует!")
             return
 
-        # Добавили поиск .pdf
-        files = glob.glob(os.path.join(data_dir, "**/*.txt"), recursive=True) + \
-                glob.glob(os.path.join(data_dir, "**/*.md"), recursive=True) + \
-                glob.glob(os.path.join(data_dir, "**/*.pdf"), recursive=True)
-        
-        print(f"📄 Найдено файлов: {len(files)}")
-        if not files: return
-        
         print("▶️ [5/6] Начало обработки...")
+        # Конвейер: чтение/конвертация -> чанкинг -> извлечение/эмбеддинги -> запись.
+        # Стадии связаны ограниченными очередями, поэтому конвертация PDF идёт
+        # одновременно с запросами к Gemini и записью в Memgraph.
         with self.driver.session() as session:
-            for filepath in files:
-                filename = os.path.basename(filepath)
-                doc_id = re.sub(r'[^a-zA-Z0-9_-]', '_', filename)
-                print(f"   🔪 Читаю файл: {filename}")
-                
+            # Все записи идут пачками через UNWIND, а не запросом на каждую сущность;
+            # после каждого коммита записанные чанки отмечаются в журнале
+            writer = GraphWriteBatcher(session, resolver=self.resolver, on_flush=self._on_flush)
+            if self.writer_queue is not None:
+                write = Stage("send", self._send_segment, 1)
+            else:
+                write = Stage("write", lambda job: self._write_stage(writer, job), 1)
+            stages = run_stages(self._discover_files(data_dir), [
+                Stage("read", self._read_stage, READ_WORKERS),
+                Stage("chunk", self._chunk_stage, CHUNK_WORKERS),
+                Stage("enrich", self._enrich_stage, ENRICH_WORKERS),
+                write,
+            ])
+            if self.writer_queue is not None:
+                # Запись, повторы и итоги - у координатора
+                return stages
+            self.abandon_unfinished()
+            self._drain_retry_queue(writer)
+            self._resolve_deferred_links(writer)
+
+        read = stages[0]
+        failed = sum(stage.failed for stage in stages)
+        print(f"📄 Обработано файлов: {read.processed + read.failed}, записано: {self.documents_written}, "
+              f"ошибок: {failed}")
+        chunks = self.checkpoint.stats()["chunks"]
+        if chunks.get("retry") or chunks.get("dead"):
+            print(f"🧾 Не записано чанков: в очереди повторов {chunks.get('retry', 0)}, "
+                  f"в dead-letter {chunks.get('dead', 0)} (python src/checkpoint.py --dead)")
+        return stages
+
+    def _send_segment(self, job: Dict[str, Any]):
+        # put() блокируется, пока координатор не разберёт очередь: backpressure между процессами
+        with METRICS.span("ingest.send_segment"):
+            self.writer_queue.put(("segment", self.shard[0], job))
+
+    def _on_flush(self, chunk_ids: List[str]):
+        self.checkpoint.mark_written(chunk_ids)
+        if self.dedup is not None:
+            # Канонический чанк в графе - теперь на него можно ссылаться и в следующих запусках
+            self.dedup.mark_written(chunk_ids)
+
+    def _drain_retry_queue(self, writer: GraphWriteBatcher):
+        """Повторяет упавшие чанки по сохранённому тексту, не перечитывая и не конвертируя файлы."""
+        for attempt in range(CHUNK_RETRY_PASSES):
+            jobs = self.checkpoint.retry_queue()
+            if not jobs:
+                return
+            count = sum(len(job["pending"]) for job in jobs)
+            print(f"🔁 Повтор упавших чанков: {count} (проход {attempt + 1} из {CHUNK_RETRY_PASSES})")
+            if self.chunk_failures:
+                # Сбой был в этом запуске - даём API время восстановиться
+                time.sleep(CHUNK_RETRY_DELAY)
+            for job in jobs:
+                job.update(first=True, last=True, replaced=set(), links=[])
                 try:
-                    # Универсальное чтение
-                    text = self._read_file_content(filepath)
-                    
-                    if not text.strip():
-                        print("   ⚠️ Файл пуст или не прочитан.")
-                        continue
-
-                    chunks = self.chunker(text)
-                    print(f"      🧩 Чанков: {len(chunks)}")
-
-                    # 1. Документ
-                    session.run(f"MERGE (d:Document {{id: {json.dumps(doc_id)}}})")
-
-                    for i, chunk in enumerate(chunks):
-                        graph_data = self._extract_graph_data(chunk.text)
-                        vector = self._generate_embedding(chunk.text)
-                        chunk_id = str(uuid.uuid4())
-
-                        # 2. Чанк
-                        query_chunk = f"""
-                        MATCH (d:Document {{id: {json.dumps(doc_id)}}})
-                        MERGE (c:Chunk {{id: {json.dumps(chunk_id)}}})
-                        SET c.index = {i}
-                        SET c.text = {json.dumps(chunk.text)}
-                        SET c.embedding = {json.dumps(vector)}
-                        MERGE (d)-[:HAS_CHUNK]->(c)
-                        """
-                        session.run(query_chunk)
-
-                        # 3. Сущности
-                        for ent in graph_data.get("entities", []):
-                            e_id = ent.get("id") or ent.get("name")
-                            if not e_id: continue
-                            e_id = e_id.strip()
-                            e_type = re.sub(r'[^a-zA-Z0-9_]', '', ent.get("type", "Thing").strip()) or "Thing"
-                            
-                            q_ent = f"""
-                            MATCH (c:Chunk {{id: {json.dumps(chunk_id)}}}) 
-                            MERGE (e:Entity {{id: {json.dumps(e_id)}}}) 
-                            ON CREATE SET e.type = {json.dumps(e_type)}
-                            MERGE (c)-[:MENTIONS]->(e)
-                            """
-                            session.run(q_ent)
-
-                        # 4. Связи
-                        for rel in graph_data.get("relations", []):
-                            src = rel.get("source", "").strip()
-                            tgt = rel.get("target", "").strip()
-                            if not src or not tgt: continue
-                            
-                            r_type = re.sub(r'[^a-zA-Z0-9_]', '', rel.get("type", "RELATED").replace(" ", "_").upper()) or "RELATED"
-                            
-                            q_rel = f"""
-                            MATCH (a:Entity {{id: {json.dumps(src)}}}), (b:Entity {{id: {json.dumps(tgt)}}}) 
-                            MERGE (a)-[:{r_type}]->(b)
-                            """
-                            session.run(q_rel)
-                    
-                    print(f"      ✅ Файл {filename} загружен.")
-                            
+                    self._write_segment(writer, self._enrich_stage(job))
                 except Exception as e:
-                    print(f"      ❌ Ошибка: {e}")
+                    print(f"      ❌ Повтор {job['filename']}: {e}")
+
+    def _resolve_deferred_links(self, writer: GraphWriteBatcher):
+        """Связывает дубликаты с каноническими чанками, записанными позже них, и завершает их документы."""
+        for job in self.checkpoint.deferred_links():
+            doc_id = job["doc_id"]
+            ready = self.dedup.known(job["links"]) if self.dedup is not None else set()
+            if not ready:
+                # Канонический чанк в очереди повторов или в dead-letter: документ ждёт следующего запуска
+                continue
+            try:
+                for chunk_id in ready:
+                    writer.link_chunk(doc_id, chunk_id)
+                writer.flush()
+                self.checkpoint.resolve_links(doc_id, ready)
+                if self.checkpoint.has_unwritten(doc_id):
+                    continue
+                writer.set_manifest(doc_id, job["manifest"])
+                writer.flush()
+            except Exception as e:
+                writer.discard()
+                print(f"      ❌ Ссылки {job['filename']}: {e}")
+                continue
+            self.checkpoint.finish_document(doc_id)
+            self.documents_written += 1
+            print(f"      ✅ Файл {job['filename']} загружен.")
+
+    def _read_stage(self, filepath: str) -> Optional[Dict[str, Any]]:
+        filename = os.path.basename(filepath)
+        doc_id = make_doc_id(filepath)
+        print(f"   🔪 Читаю файл: {filename}")
+        if self.writer_queue is not None:
+            self.writer_queue.put(("file", self.shard[0], filename))
+
+        manifest = build_manifest(filepath, self.manifest_config)
+        with self.driver.session() as session, METRICS.span("graph.load_manifest"):
+            stored, existing_ids = load_manifest(session, doc_id)
+        full_rebuild = not self.incremental or stored is None or config_changed(stored, manifest)
+
+        # --resume: прерванный файл с теми же содержимым и настройками продолжаем с места остановки
+        resumed = self.checkpoint.unfinished(doc_id) if self.resume else None
+        if resumed is not None and (config_changed(resumed["manifest"], manifest)
+                                    or not content_unchanged(resumed["manifest"], manifest, filepath)):
+            resumed = None
+        if resumed is not None:
+            print(f"      ⏯️ {filename}: продолжаю, уже записано чанков {len(resumed['written'])}")
+            full_rebuild = False
+        elif not full_rebuild and content_unchanged(stored, manifest, filepath):
+            if stat_changed(stored, manifest):
+                # Хэш совпал, но size/mtime другие: запоминаем их, чтобы не хэшировать файл каждый запуск
+                with self.driver.session() as session:
+                    touch_manifest(session, doc_id, manifest)
+            print(f"      ⏭️ {filename}: без изменений, пропускаю.")
+            return None
+
+        # Универсальное чтение: блоки текста читаются лениво уже на стадии чанкинга
+        blocks = self._read_blocks(filepath)
+        if blocks is None:
+            print(f"   ⚠️ {filename}: файл пуст или не прочитан.")
+            return None
+
+        if manifest["content_hash"] is None:
+            manifest["content_hash"] = file_hash(filepath)
+
+        return {
+            "filename": filename,
+            "doc_id": doc_id,
+            "manifest": manifest,
+            "existing_ids": existing_ids,
+            "full_rebuild": full_rebuild,
+            "resumed": resumed,
+            "blocks": blocks,
+        }
+
+    def _chunk_stage(self, job: Dict[str, Any]):
+        """Генератор сегментов документа по STREAM_SEGMENT_CHUNKS чанков: весь документ не материализуется."""
+        doc_id, filename = job["doc_id"], job["filename"]
+        existing_ids, resumed = job["existing_ids"], job["resumed"]
+        kept = resumed["written"] if resumed is not None else set()
+        dead = resumed["dead"] if resumed is not None else set()
+
+        if resumed is not None:
+            # Записанное прошлым запуском оставляем; dead-letter ждёт checkpoint.py --requeue-dead.
+            # Известные канонические чанки (в том числе чужие, на которые ссылаются дубликаты) не отвязываем:
+            # если документ - последняя ссылка, узел удалился бы вместе с вектором
+            spared = self.dedup.known(existing_ids - kept) if self.dedup is not None else set()
+            first_delete, is_pending = existing_ids - kept - spared, lambda cid: cid not in kept and cid not in dead
+        elif job["full_rebuild"]:
+            # Новая конфигурация или первый запуск: всё старое удаляем, всё новое обрабатываем
+            first_delete, is_pending = set(existing_ids), lambda cid: True
+        else:
+            # Инкрементально: обрабатываем новые ID, а исчезнувшие удаляем в последнем сегменте
+            first_delete, is_pending = set(), lambda cid: cid not in existing_ids
+        # Ссылка дубликата на канонический чанк нужна, если её нет в графе после первых удалений
+        linked = existing_ids - first_delete
+        self.checkpoint.start_document(doc_id, filename, job["manifest"])
+
+        chunk_ids: set = set()
+        seq, processed, duplicates, held = 0, 0, 0, None
+        segment: List[tuple] = []
+        index = 0
+        chunks = stream_chunks(job["blocks"], self.chunker)
+        while True:
+            with METRICS.span("ingest.chunk"):
+                text = next(chunks, None)
+            if text is not None:
+                segment.append((index, text, make_chunk_id(doc_id, index, text)))
+                index += 1
+                if len(segment) < STREAM_SEGMENT_CHUNKS:
+                    continue
+            elif held is not None and not segment:
+                break
+
+            # Дубликаты (точные и почти точные) ссылаются на канонический чанк: без извлечения,
+            # эмбеддинга и нового узла в индексе
+            if self.dedup is not None:
+                with METRICS.span("ingest.dedup"):
+                    canonical = self.dedup.resolve(doc_id, [(cid, t) for _, t, cid in segment], is_pending)
+            else:
+                canonical = [None] * len(segment)
+            planned, pending, links = [], [], []
+            for (i, t, own_id), canon in zip(segment, canonical):
+                if canon is not None:
+                    duplicates += 1
+                    if canon not in linked and canon not in chunk_ids:
+                        links.append(canon)
+                        linked.add(canon)
+                    chunk_ids.add(canon)
+                    continue
+                chunk_ids.add(own_id)
+                planned.append((i, own_id, is_pending(own_id)))
+                if is_pending(own_id):
+                    pending.append((i, t, own_id))
+
+            self.checkpoint.plan_chunks(doc_id, planned)
+            processed += len(pending)
+            # Сегмент отдаём с задержкой на один, чтобы знать, какой из них последний
+            if held is not None:
+                yield held
+            held = {
+                "doc_id": doc_id,
+                "filename": filename,
+                "manifest": job["manifest"],
+                "seq": seq,
+                "first": seq == 0,
+                "last": False,
+                "to_delete": first_delete if seq == 0 else set(),
+                # Чанки документа в графе до загрузки: ответы по ним устаревают вместе с документом
+                "replaced": existing_ids if seq == 0 else set(),
+                "pending": pending,
+                "links": links,
+            }
+            seq += 1
+            segment = []
+            if text is None:
+                break
+
+        # Исчезнувшие из документа чанки и ссылки удаляем последними
+        end_delete = existing_ids - first_delete - chunk_ids
+        held["to_delete"] = held["to_delete"] | end_delete
+        self.checkpoint.end_plan(doc_id, chunk_ids)
+        print(f"      🧩 {filename}: чанков {index} (новых/изменённых: {processed}, дубликатов: {duplicates}, "
+              f"удалённых: {len(first_delete) + len(end_delete)}, сегментов: {seq})")
+        held["last"] = True
+        yield held
+
+    def _enrich_stage(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        try:
+            return self._enrich(job)
+        except Exception as e:
+            # Сегмент не теряем: иначе следующие сегменты документа навсегда ждали бы его на записи.
+            # Его чанки уходят в очередь повторов, как при ошибке извлечения
+            print(f"      ⚠️ {job['filename']}: сбой обогащения сегмента {job['seq']}: {e}")
+            job["ready"] = []
+            job["failed"] = [(i, text, chunk_id, "enrich", str(e)) for i, text, chunk_id in job["pending"]]
+            return job
+
+    def _enrich(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        # Извлечение и эмбеддинги всех чанков идут параллельно,
+        # а результаты забираем строго по порядку индексов
+        texts = [text for _, text, _ in job["pending"]]
+        batches = batched(texts, EMBEDDING_BATCH_SIZE)
+        packs = pack_texts(texts)
+        graph_jobs = self.workers.submit_all(self._extract_graph_data, packs)
+        vector_jobs = self.workers.submit_all(self._generate_embeddings, batches)
+        graphs = []
+        for f, pack in zip(graph_jobs, packs):
+            try:
+                graphs.extend(f.result())
+            except Exception as e:
+                print(f"      ⚠️ Ошибка извлечения графа: {e}")
+                graphs.extend(dict(empty_graph(), error=str(e)) for _ in pack)
+        vectors, errors = [], []
+        for f, batch in zip(vector_jobs, batches):
+            try:
+                vectors.extend(f.result())
+                errors.extend([None] * len(batch))
+            except Exception as e:
+                print(f"      ⚠️ Ошибка вектора: {e}")
+                vectors.extend([None] * len(batch))
+                errors.extend([str(e)] * len(batch))
+
+        # Чанк пишется, только если есть и граф, и пригодный вектор; остальное - в очередь повторов
+        job["ready"], job["failed"] = [], []
+        for (i, text, chunk_id), graph, vector, error in zip(job["pending"], graphs, vectors, errors):
+            if "error" in graph:
+                job["failed"].append((i, text, chunk_id, "extract", graph["error"]))
+            elif not is_valid_embedding(vector):
+                job["failed"].append((i, text, chunk_id, "embed", error or "пустой или некорректный эмбеддинг"))
+            else:
+                job["ready"].append((i, text, chunk_id, vector, graph))
+        return job
+
+    def _write_stage(self, writer: GraphWriteBatcher, job: Dict[str, Any]):
+        # Сегменты одного документа пишем строго по порядку: первый удаляет старые чанки,
+        # последний ставит манифест
+        state = self.write_order.setdefault(job["doc_id"], {"next": 0, "held": {}, "failed": False})
+        if state["failed"]:
+            # Документ уже не дописать: его сегменты отбрасываем, запись закончится на последнем
+            if job["last"]:
+                self.write_order.pop(job["doc_id"], None)
+            return
+        state["held"][job["seq"]] = job
+        segment = job
+        try:
+            while state["next"] in state["held"]:
+                segment = state["held"].pop(state["next"])
+                state["next"] += 1
+                self._write_segment(writer, segment)
+                if segment["last"]:
+                    self.write_order.pop(job["doc_id"], None)
+        except Exception:
+            # Остальные сегменты документа не пишем: он останется незавершённым до --resume
+            self._fail_document(job["doc_id"], job["filename"])
+            if not segment["last"]:
+                # Пометка для сегментов, которые ещё придут: их отбросят, а не будут ждать вечно
+                self.write_order[job["doc_id"]] = {"next": 0, "held": {}, "failed": True}
+            raise
+
+    def _fail_document(self, doc_id: str, filename: str):
+        state = self.write_order.pop(doc_id, None)
+        held = len(state["held"]) if state is not None else 0
+        self.checkpoint.fail_document(doc_id)
+        print(f"      ❌ {filename}: сегмент потерян, документ не дописан (отброшено сегментов: {held}, "
+              f"дообработка: python src/main.py --resume)")
+
+    def abandon_unfinished(self):
+        """Документы, чей сегмент не дошёл до записи (сбой чтения или чанкинга): держать их сегменты незачем."""
+        for doc_id in list(self.write_order):
+            state = self.write_order[doc_id]
+            filename = next((seg["filename"] for seg in state["held"].values()), doc_id)
+            if state["failed"]:
+                self.write_order.pop(doc_id, None)
+            else:
+                self._fail_document(doc_id, filename)
+
+    def _write_segment(self, writer: GraphWriteBatcher, job: Dict[str, Any]):
+        doc_id = job["doc_id"]
+        try:
+            # 1. Документ
+            if job["first"]:
+                writer.add_document(doc_id)
+            writer.delete_chunks(doc_id, job["to_delete"])
+
+            for i, text, chunk_id, vector, graph in job["ready"]:
+                # 2. Чанк, 3. Сущности, 4. Связи
+                writer.add_chunk(doc_id, chunk_id, i, text, vector, graph)
+            # Ссылка - только на канонический чанк, уже записанный в граф; на остальные она
+            # откладывается, и документ не получит манифест, пока чанк не запишется
+            ready_links = self.dedup.known(job["links"]) if self.dedup is not None else set(job["links"])
+            for chunk_id in job["links"]:
+                if chunk_id in ready_links:
+                    writer.link_chunk(doc_id, chunk_id)
+            writer.flush()
+            self.checkpoint.defer_links(doc_id, [cid for cid in job["links"] if cid not in ready_links])
+            if self.dedup is not None:
+                self.dedup.forget(doc_id, job["to_delete"])
+            self.answer_cache.invalidate_chunks(
+                job["replaced"] | job["to_delete"] | {chunk_id for _, _, chunk_id, _, _ in job["ready"]})
+
+            if job["failed"]:
+                self.chunk_failures += len(job["failed"])
+                counts = self.checkpoint.mark_failed(doc_id, job["failed"])
+                print(f"      ⚠️ {job['filename']}: не записано чанков {len(job['failed'])} "
+                      f"(в очереди повторов {counts['retry']}, в dead-letter {counts['dead']})")
+            if not job["last"] or self.checkpoint.has_unwritten(doc_id):
+                # Без манифеста документ не считается загруженным и будет дообработан
+                return
+
+            # 5. Манифест - последним, когда в графе все чанки документа
+            writer.set_manifest(doc_id, job["manifest"])
+            writer.flush()
+        except Exception:
+            writer.discard()
+            raise
+        self.checkpoint.finish_document(doc_id)
+        self.documents_written += 1
+        print(f"      ✅ Файл {job['filename']} загружен.")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Загрузка документов из data/ в граф знаний")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--full", action="store_true",
+                      help="Переобработать все файлы, игнорируя манифесты")
+    mode.add_argument("--resume", action="store_true",
+                      help="Продолжить прерванные файлы с места остановки по журналу загрузки")
+    parser.add_argument("--shards", type=int, default=INGEST_SHARDS,
+                        help="Процессов загрузки (файлы делятся по ID документа; пишет в граф один процесс)")
+    args = parser.parse_args()
+
     if not os.path.exists("data"): os.makedirs("data")
     try:
-        pipeline = HybridGraphPipeline(MEMGRAPH_URI, MEMGRAPH_AUTH)
-        pipeline.process_directory("data")
+        pipeline = HybridGraphPipeline(MEMGRAPH_URI, MEMGRAPH_AUTH, incremental=not args.full,
+                                       resume=args.resume)
+        if args.shards > 1:
+            run_sharded(pipeline, "data", args.shards)
+        else:
+            pipeline.process_directory("data")
+        stats = pipeline.extractor.cache.stats()
+        print(f"📦 Кэш извлечения: попаданий {stats['run_hits']}, промахов {stats['run_misses']} "
+              f"(hit rate {stats['run_hit_rate']:.0%}), ошибок {pipeline.extractor.failures}, "
+              f"откатов пакетного режима {pipeline.extractor.pack_fallbacks}")
+        if pipeline.dedup is not None:
+            dedup = pipeline.dedup.stats()
+            print(f"🪞 Дубликаты: точных {dedup['run_exact_duplicates']}, почти точных {dedup['run_near_duplicates']}, "
+                  f"уникальных чанков {dedup['run_unique']}")
+        # Рост базы: индекс, заполненный до предела, пора пересобрать с большей ёмкостью
+        with pipeline.driver.session() as session:
+            for problem in index_status(session)["problems"]:
+                print(f"⚠️ Векторный индекс: {problem} (python src/index_manager.py --rebuild)")
+        # Уже собранный локальный индекс тоже обновляем: иначе auto ищет по устаревшей матрице
+        local_index = LocalVectorIndex()
+        if RETRIEVAL_BACKEND != "memgraph" or len(local_index):
+            with METRICS.span("ingest.local_index_refresh"):
+                refreshed = local_index.refresh(pipeline.driver)
+            print(f"🧮 Локальный индекс: добавлено {refreshed['added']}, удалено {refreshed['removed']}, "
+                  f"всего векторов {len(local_index)}")
         pipeline.close()
+        print("📈 Время по операциям:")
+        METRICS.print_spans()
+        METRICS.export()
         print("🎉 [6/6] Готово.")
     except Exception as e:
         print(f"\n❌ Сбой: {e}")
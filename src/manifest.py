@@ -0,0 +1,96 @@
+import os
+import re
+import json
+import hashlib
+from typing import Dict, Any, List, Optional, Set, Tuple
+
+# Поля манифеста, которые хранятся свойствами узла Document
+MANIFEST_FIELDS = ("path", "size", "mtime", "content_hash", "chunker_config",
+                   "extraction_model", "embedding_model", "prompt_hash")
+# Изменение любого из этих полей требует полной переобработки файла
+CONFIG_FIELDS = ("chunker_config", "extraction_model", "embedding_model", "prompt_hash")
+
+LOAD_MANIFEST = """
+MATCH (d:Document {id: $doc_id})
+OPTIONAL MATCH (d)-[:HAS_CHUNK]->(c:Chunk)
+RETURN d AS doc, collect(c.id) AS chunk_ids
+"""
+
+# Файл трогали (touch, копирование), но содержимое то же: новые size/mtime вернут его на быстрый путь
+TOUCH_MANIFEST = """
+MATCH (d:Document {id: $doc_id})
+SET d.size = $size, d.mtime = $mtime
+"""
+
+
+def sha256_hex(data: str) -> str:
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def file_hash(filepath: str, block_size: int = 1 << 20) -> str:
+    h = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def make_doc_id(filepath: str) -> str:
+    return re.sub(r'[^a-zA-Z0-9_-]', '_', os.path.basename(filepath))
+
+
+def make_chunk_id(doc_id: str, index: int, text: str) -> str:
+    """Детерминированный ID чанка: один и тот же текст на той же позиции даёт тот же ID."""
+    return sha256_hex(f"{doc_id}:{index}:{sha256_hex(text)}")[:32]
+
+
+def build_manifest(filepath: str, config: Dict[str, Any]) -> Dict[str, Any]:
+    stat = os.stat(filepath)
+    manifest = {
+        "path": os.path.abspath(filepath),
+        "size": stat.st_size,
+        "mtime": stat.st_mtime,
+        "content_hash": None,  # считается лениво, только если быстрый путь не сработал
+    }
+    manifest.update(config)
+    return manifest
+
+
+def config_changed(stored: Dict[str, Any], manifest: Dict[str, Any]) -> bool:
+    return any(stored.get(k) != manifest.get(k) for k in CONFIG_FIELDS)
+
+
+def stat_changed(stored: Dict[str, Any], manifest: Dict[str, Any]) -> bool:
+    return stored.get("size") != manifest["size"] or stored.get("mtime") != manifest["mtime"]
+
+
+def content_unchanged(stored: Dict[str, Any], manifest: Dict[str, Any], filepath: str) -> bool:
+    # Быстрый путь: размер и mtime совпали - файл не трогали
+    if not stat_changed(stored, manifest):
+        manifest["content_hash"] = stored.get("content_hash")
+        return True
+    manifest["content_hash"] = file_hash(filepath)
+    return stored.get("content_hash") == manifest["content_hash"]
+
+
+def load_manifest(session, doc_id: str) -> Tuple[Optional[Dict[str, Any]], Set[str]]:
+    record = session.run(LOAD_MANIFEST, doc_id=doc_id).single()
+    if record is None or record["doc"] is None:
+        return None, set()
+    props = dict(record["doc"])
+    stored = {k: props.get(k) for k in MANIFEST_FIELDS}
+    return stored, set(record["chunk_ids"])
+
+
+def touch_manifest(session, doc_id: str, manifest: Dict[str, Any]):
+    session.run(TOUCH_MANIFEST, doc_id=doc_id, size=manifest["size"], mtime=manifest["mtime"]).consume()
+
+
+def diff_chunks(existing_ids: Set[str], new_ids: List[str]) -> Tuple[Set[str], Set[str]]:
+    """Возвращает (ID, которые нужно обработать, ID, которые исчезли и должны быть удалены)."""
+    new_set = set(new_ids)
+    return new_set - existing_ids, existing_ids - new_set
+
+
+def chunker_config_json(**params) -> str:
+    return json.dumps(params, sort_keys=True)
@@ -0,0 +1,236 @@
+import os
+import json
+import time
+import bisect
+import threading
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Tuple
+
+# --- КОНФИГУРАЦИЯ ---
+# Куда выгрузить метрики по окончании запуска (пусто = не выгружать)
+METRICS_JSON_PATH = os.getenv("METRICS_JSON_PATH", "")
+# Файл в текстовом формате Prometheus (например, для node_exporter textfile collector)
+METRICS_PROM_PATH = os.getenv("METRICS_PROM_PATH", "")
+# Сколько последних замеров каждого ряда хранить для перцентилей в JSON-сводке
+METRICS_SAMPLES = int(os.getenv("METRICS_SAMPLES", "4096"))
+
+# Границы гистограмм длительностей, секунды
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+SPAN_SECONDS = "rag_span_seconds"
+SPAN_ERRORS = "rag_span_errors_total"
+GEMINI_REQUESTS = "rag_gemini_requests_total"
+GEMINI_TOKENS = "rag_gemini_tokens_total"
+GEMINI_RETRIES = "rag_gemini_retries_total"
+GEMINI_ERRORS = "rag_gemini_errors_total"
+GRAPH_ROWS = "rag_graph_rows_total"
+ANSWER_CACHE_LOOKUPS = "rag_answer_cache_lookups_total"
+
+HELP = {
+    SPAN_SECONDS: "Длительность операций (стадий загрузки и поиска)",
+    SPAN_ERRORS: "Операции, завершившиеся исключением",
+    GEMINI_REQUESTS: "Запросы к Gemini, включая повторы",
+    GEMINI_TOKENS: "Оценка токенов, отправленных в Gemini",
+    GEMINI_RETRIES: "Повторы запросов к Gemini после 429/5xx",
+    GEMINI_ERRORS: "Запросы к Gemini, завершившиеся ошибкой",
+    GRAPH_ROWS: "Строки, переданные в запросы записи через UNWIND",
+    ANSWER_CACHE_LOOKUPS: "Поиски в семантическом кэше ответов (result=hit|miss)",
+}
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def percentiles(values: List[float]) -> Dict[str, Any]:
+    """p50/p95/p99, среднее и максимум в миллисекундах (ближайший ранг)."""
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+
+    def rank(p: float) -> float:
+        return ordered[min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered))) - 1))]
+
+    return {
+        "count": len(ordered),
+        "mean_ms": round(sum(ordered) / len(ordered) * 1000, 3),
+        "p50_ms": round(rank(50) * 1000, 3),
+        "p95_ms": round(rank(95) * 1000, 3),
+        "p99_ms": round(rank(99) * 1000, 3),
+        "max_ms": round(ordered[-1] * 1000, 3),
+    }
+
+
+def _key(labels: Dict[str, Any]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key: LabelKey, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    pairs = key + extra
+    if not pairs:
+        return ""
+    escaped = (v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+class _Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.samples: deque = deque(maxlen=METRICS_SAMPLES)
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+        self.samples.append(value)
+
+
+class MetricsRegistry:
+    """Счётчики и гистограммы в памяти процесса; экспорт в Prometheus и JSON."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters: Dict[str, Dict[LabelKey, float]] = {}
+        self.histograms: Dict[str, Dict[LabelKey, _Histogram]] = {}
+        self.started = time.time()
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = _key(labels)
+        with self.lock:
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        key = _key(labels)
+        with self.lock:
+            series = self.histograms.setdefault(name, {})
+            if key not in series:
+                series[key] = _Histogram()
+            series[key].observe(value)
+
+    @contextmanager
+    def span(self, name: str, **labels) -> Iterator[None]:
+        """Замер операции: длительность в rag_span_seconds{span=name}, исключение - в rag_span_errors_total."""
+        started = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.inc(SPAN_ERRORS, span=name, **labels)
+            raise
+        finally:
+            self.observe(SPAN_SECONDS, time.perf_counter() - started, span=name, **labels)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Сырые данные реестра (сериализуются pickle) - для слияния метрик других процессов через merge()."""
+        with self.lock:
+            return {
+                "counters": {name: dict(series) for name, series in self.counters.items()},
+                "histograms": {
+                    name: {key: (list(h.counts), h.sum, h.count, list(h.samples)) for key, h in series.items()}
+                    for name, series in self.histograms.items()
+                },
+            }
+
+    def merge(self, snapshot: Dict[str, Any]):
+        with self.lock:
+            for name, series in snapshot["counters"].items():
+                own = self.counters.setdefault(name, {})
+                for key, value in series.items():
+                    own[key] = own.get(key, 0) + value
+            for name, series in snapshot["histograms"].items():
+                own = self.histograms.setdefault(name, {})
+                for key, (counts, total, count, samples) in series.items():
+                    h = own.setdefault(key, _Histogram())
+                    h.counts = [a + b for a, b in zip(h.counts, counts)]
+                    h.sum += total
+                    h.count += count
+                    h.samples.extend(samples)
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.histograms.clear()
+            self.started = time.time()
+
+    def to_prometheus(self) -> str:
+        lines = []
+        with self.lock:
+            for name in sorted(self.counters):
+                lines.append(f"# HELP {name} {HELP.get(name, name)}")
+                lines.append(f"# TYPE {name} counter")
+                for key, value in sorted(self.counters[name].items()):
+                    lines.append(f"{name}{_format_labels(key)} {value:g}")
+            for name in sorted(self.histograms):
+                lines.append(f"# HELP {name} {HELP.get(name, name)}")
+                lines.append(f"# TYPE {name} histogram")
+                for key, h in sorted(self.histograms[name].items()):
+                    cumulative = 0
+                    for bound, count in zip(BUCKETS + (float("inf"),), h.counts):
+                        cumulative += count
+                        le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                        lines.append(f"{name}_bucket{_format_labels(key, (('le', le),))} {cumulative}")
+                    lines.append(f"{name}_sum{_format_labels(key)} {h.sum:.6f}")
+                    lines.append(f"{name}_count{_format_labels(key)} {h.count}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> Dict[str, Any]:
+        """Сводка запуска: счётчики и перцентили по последним METRICS_SAMPLES замерам каждого ряда."""
+        with self.lock:
+            counters = {
+                name: [dict(key, value=value) for key, value in sorted(series.items())]
+                for name, series in self.counters.items()
+            }
+            histograms = {
+                name: [
+                    dict(key, total_seconds=round(h.sum, 6), **dict(percentiles(list(h.samples)), count=h.count))
+                    for key, h in sorted(series.items())
+                ]
+                for name, series in self.histograms.items()
+            }
+        return {
+            "started": self.started,
+            "elapsed_seconds": round(time.time() - self.started, 3),
+            "counters": counters,
+            "histograms": histograms,
+        }
+
+    def spans(self) -> Dict[str, Dict[str, Any]]:
+        """Перцентили по каждому span (метки, кроме span, добавляются через '/')."""
+        result = {}
+        for row in self.summary()["histograms"].get(SPAN_SECONDS, []):
+            labels = [f"{k}={v}" for k, v in row.items()
+                      if k not in ("span", "total_seconds", "count") and not k.endswith("_ms")]
+            result["/".join([row["span"]] + labels)] = {
+                k: v for k, v in row.items() if k in ("count", "total_seconds") or k.endswith("_ms")}
+        return result
+
+    def export(self, json_path: str = METRICS_JSON_PATH, prom_path: str = METRICS_PROM_PATH):
+        # Через временный файл: коллектор Prometheus не должен увидеть файл наполовину записанным
+        for path, content in ((json_path, lambda: json.dumps(self.summary(), ensure_ascii=False, indent=2)),
+                              (prom_path, self.to_prometheus)):
+            if not path:
+                continue
+            tmp = path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write(content())
+            os.replace(tmp, path)
+
+    def print_spans(self):
+        for name, s in sorted(self.spans().items(), key=lambda kv: -kv[1]["total_seconds"]):
+            print(f"   ⏱️ {name}: {s['count']} шт., всего {s['total_seconds']:.2f}с, "
+                  f"p50 {s['p50_ms']:.0f}мс, p95 {s['p95_ms']:.0f}мс, p99 {s['p99_ms']:.0f}мс")
+
+
+# Общий реестр процесса: модули пишут в него напрямую
+METRICS = MetricsRegistry()
+span = METRICS.span
+inc = METRICS.inc
+observe = METRICS.observe
+
+
+def gemini_request(model: str, tokens: int = 0):
+    """Учёт одного запроса к Gemini (вызывается на каждую попытку, включая повторы)."""
+    METRICS.inc(GEMINI_REQUESTS, model=model)
+    if tokens:
+        METRICS.inc(GEMINI_TOKENS, tokens, model=model)
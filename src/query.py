@@ -1,114 +1,359 @@
 import os
 import json
+import threading
+from typing import List, Dict, Any, Optional, Tuple
 from dotenv import load_dotenv
 load_dotenv()
 
 import google.generativeai as genai
 from neo4j import GraphDatabase
+from embeddings import EmbeddingService
+from context_assembler import assemble_context
+from answer_cache import AnswerCache, ANSWER_CACHE
+from index_manager import ActiveIndex, EMBEDDING_MODEL
+from metrics import METRICS, ANSWER_CACHE_LOOKUPS
+from workers import (
+    ModelScheduler, estimate_tokens,
+    EMBEDDING_CONCURRENCY, EMBEDDING_RPM, EMBEDDING_TPM, QA_CONCURRENCY, QA_RPM, QA_TPM,
+)
 
 # --- НАСТРОЙКИ ---
 MEMGRAPH_URI = os.getenv("MEMGRAPH_URI", "bolt://localhost:7687")
 MEMGRAPH_AUTH = (os.getenv("MEMGRAPH_USER", ""), os.getenv("MEMGRAPH_PASSWORD", ""))
-EMBEDDING_MODEL = "models/text-embedding-004"
 QA_MODEL = "gemini-2.5-flash"
+# Имя векторного индекса берётся из реестра (index_manager.py): пересборка переключает поиск без перезапуска
+VECTOR_INDEX = ActiveIndex()
+TOP_K = int(os.getenv("TOP_K", "3"))
+# memgraph - индекс Memgraph; local - точный поиск по локальной матрице; auto - Memgraph, а при сбое локально
+RETRIEVAL_BACKEND = os.getenv("RETRIEVAL_BACKEND", "memgraph")
+# Сколько кандидатов брать из приближённого индекса для точного пересчёта (0 = без пересчёта)
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "0"))
+# vector - только ближайшие чанки; hybrid - плюс соседние чанки через общие сущности и связи графа
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "vector")
+GRAPH_HOPS = int(os.getenv("GRAPH_HOPS", "1"))
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "30"))
+HYBRID_MAX_SOURCES = int(os.getenv("HYBRID_MAX_SOURCES", "8"))
+# Вес векторного сходства в итоговом score (остальное - близость по графу)
+HYBRID_ALPHA = float(os.getenv("HYBRID_ALPHA", "0.7"))
+FACTS_PER_CHUNK = int(os.getenv("FACTS_PER_CHUNK", "10"))
 
 if "GEMINI_API_KEY" not in os.environ:
     raise ValueError("⚠️ Ошибка: Не найден GEMINI_API_KEY в .env")
 
 genai.configure(api_key=os.environ["GEMINI_API_KEY"])
 
+# Лимиты и повторы 429/5xx для вызовов Gemini на стороне вопросов, общие для всех потоков процесса
+embedding_scheduler = ModelScheduler(EMBEDDING_MODEL, EMBEDDING_CONCURRENCY, EMBEDDING_RPM, EMBEDDING_TPM)
+qa_scheduler = ModelScheduler(QA_MODEL, QA_CONCURRENCY, QA_RPM, QA_TPM)
+
+# Общий сервис эмбеддингов: LRU для повторных вопросов + дисковый кэш
+embedder = EmbeddingService(EMBEDDING_MODEL, scheduler=embedding_scheduler)
+
+# Семантический кэш ответов: повторный или почти такой же вопрос не доходит до поиска и Gemini.
+# Ответы, полученные с другими моделями или настройками поиска, не переиспользуются.
+answer_cache = AnswerCache(scope=json.dumps({
+    "qa_model": QA_MODEL, "embedding_model": embedder.model_key, "mode": RETRIEVAL_MODE, "top_k": TOP_K,
+}, sort_keys=True)) if ANSWER_CACHE else None
+
+# Драйвер (с пулом соединений) и модель создаются один раз на процесс
+_driver = None
+_qa_model = None
+_local_index = None
+_local_empty_warned = False
+_init_lock = threading.Lock()
+
+# Вектор передаётся параметром, а не JSON-литералом в тексте запроса
+VECTOR_QUERY = """
+CALL vector_search.search($index, $k, $vector)
+YIELD node, score
+OPTIONAL MATCH (node)-[:MENTIONS]->(e:Entity)
+RETURN node.id as id, node.text as text, score, collect(e.id) as entities
+"""
+
+# Кандидаты для точного пересчёта: вместе с эмбеддингами
+CANDIDATE_QUERY = """
+CALL vector_search.search($index, $k, $vector)
+YIELD node, score
+RETURN node.id as id, node.embedding as embedding
+"""
+
+CHUNKS_BY_ID = """
+UNWIND $ids AS id
+MATCH (node:Chunk {id: id})
+OPTIONAL MATCH (node)-[:MENTIONS]->(e:Entity)
+RETURN node.id as id, node.text as text, collect(e.id) as entities
+"""
+
+# Гибридный поиск одним запросом: векторные попадания -> общие сущности и связи
+# между ними (до GRAPH_HOPS шагов) -> соседние чанки. Близость соседа = score
+# исходного попадания / (1 + число шагов между сущностями). Число шагов нельзя
+# передать параметром, поэтому оно подставляется в текст как int.
+HYBRID_QUERY = """
+CALL vector_search.search($index, $k, $vector)
+YIELD node, score
+WITH node AS seed, score AS seed_score
+OPTIONAL MATCH p = (seed)-[:MENTIONS]->(:Entity)-[*0..{hops} (r, n | "Entity" IN labels(n))]-(:Entity)<-[:MENTIONS]-(nb:Chunk)
+WHERE nb <> seed
+WITH seed, seed_score, nb, min(size(p)) AS path_len
+WITH seed, seed_score,
+     collect(CASE WHEN nb IS NULL THEN null
+                  ELSE {{chunk: nb, proximity: seed_score / (path_len - 1.0), seed: 0}} END) AS neighbours
+WITH collect({{chunk: seed, proximity: seed_score, seed: 1}}) +
+     reduce(acc = [], ns IN collect(neighbours) | acc + ns) AS candidates
+UNWIND candidates AS cand
+WITH cand.chunk AS c, max(cand.proximity) AS proximity, max(cand.seed) AS is_seed
+ORDER BY proximity DESC
+LIMIT $limit
+OPTIONAL MATCH (c)-[:MENTIONS]->(e:Entity)
+OPTIONAL MATCH (e)-[r]-(:Entity)
+WITH c, proximity, is_seed, collect(DISTINCT e.id) AS entities,
+     collect(DISTINCT startNode(r).id + ' -' + type(r) + '-> ' + endNode(r).id) AS facts
+RETURN c.id AS id, c.text AS text, c.embedding AS embedding, proximity, is_seed,
+       entities, facts[..$facts_per_chunk] AS facts
+"""
+
+def get_driver():
+    global _driver
+    with _init_lock:
+        if _driver is None:
+            _driver = GraphDatabase.driver(MEMGRAPH_URI, auth=MEMGRAPH_AUTH)
+    return _driver
+
+def get_qa_model():
+    global _qa_model
+    with _init_lock:
+        if _qa_model is None:
+            _qa_model = genai.GenerativeModel(QA_MODEL)
+    return _qa_model
+
+def get_local_index():
+    global _local_index
+    with _init_lock:
+        # Новый объект вместо перечитывания на месте: параллельные поиски дорабатывают по старому
+        if _local_index is None or _local_index.changed_on_disk():
+            from local_search import LocalVectorIndex
+            _local_index = LocalVectorIndex()
+    return _local_index
+
+def close():
+    global _driver
+    with _init_lock:
+        if _driver is not None:
+            _driver.close()
+            _driver = None
+
 def get_embedding(text):
-    return genai.embed_content(
-        model=EMBEDDING_MODEL,
-        content=text,
-        task_type="retrieval_query" 
-    )['embedding']
+    with METRICS.span("query.embed"):
+        return embedder.embed_query(text)
 
 def generate_answer(question, context):
-    model = genai.GenerativeModel(QA_MODEL)
+    model = get_qa_model()
     prompt = f"""
     You are a helpful assistant. Answer the question based strictly on the Context provided.
-    
+
     Context:
     {context}
-    
+
     Question: {question}
     Answer:
     """
-    response = model.generate_content(prompt)
+    with METRICS.span("query.generate"):
+        response = qa_scheduler.call(model.generate_content, prompt, tokens=estimate_tokens(prompt))
     return response.text
 
+def cached_answer(vector: List[float]) -> Optional[Dict[str, Any]]:
+    """Готовый ответ на похожий вопрос из кэша (None - промах или кэш выключен)."""
+    if answer_cache is None:
+        return None
+    with METRICS.span("query.answer_cache"):
+        hit = answer_cache.lookup(vector)
+    METRICS.inc(ANSWER_CACHE_LOOKUPS, result="hit" if hit is not None else "miss")
+    return hit
+
+def remember_answer(question: str, vector: List[float], answer_text: Optional[str],
+                    sources: List[Dict[str, Any]]):
+    # Вместе с ответом сохраняются ID чанков: их перезагрузка удалит ответ из кэша
+    if answer_cache is not None and answer_text:
+        answer_cache.put(question, vector, answer_text, sources)
+
+def format_score(raw_score) -> str:
+    # --- ИСПРАВЛЕНИЕ ОШИБКИ SCORE ---
+    if raw_score is None:
+        return "N/A"
+    try:
+        return f"{float(raw_score):.4f}"
+    except (TypeError, ValueError):
+        return str(raw_score)
+
+def _to_source(r, score) -> Dict[str, Any]:
+    # Обработка списка сущностей (может быть [None] из-за OPTIONAL MATCH)
+    ent_list = r.get('entities', []) or []
+    return {
+        "id": r.get('id'),
+        "text": r.get('text', "") or "",
+        "score": score,
+        "entities": [str(e) for e in ent_list if e is not None],
+    }
+
+def fetch_chunks(session, hits: List[Tuple[str, float]]) -> List[Dict[str, Any]]:
+    """Тексты и сущности для найденных (id, score) в исходном порядке."""
+    if not hits:
+        return []
+    records = {r["id"]: r for r in session.run(CHUNKS_BY_ID, ids=[cid for cid, _ in hits])}
+    return [_to_source(records[cid], score) for cid, score in hits if cid in records]
+
+def _retrieve_index(vector, session, k) -> List[Dict[str, Any]]:
+    if RERANK_CANDIDATES > k:
+        # Берём больше кандидатов из приближённого индекса и пересчитываем косинус точно
+        candidates = list(session.run(CANDIDATE_QUERY, index=VECTOR_INDEX.get(session), k=RERANK_CANDIDATES, vector=vector))
+        hits = get_local_index().rerank(
+            vector, [r["id"] for r in candidates], k, embeddings=[r["embedding"] for r in candidates])
+        return fetch_chunks(session, hits)
+
+    # Запрос с OPTIONAL MATCH для защиты от отсутствующих связей
+    records = session.run(VECTOR_QUERY, index=VECTOR_INDEX.get(session), k=k, vector=vector)
+    return [_to_source(r, r.get('score')) for r in records]
+
+def cosine(a: List[float], b: List[float]) -> float:
+    if not a or not b or len(a) != len(b):
+        return 0.0
+    dot = sum(x * y for x, y in zip(a, b))
+    na = sum(x * x for x in a) ** 0.5
+    nb = sum(y * y for y in b) ** 0.5
+    return dot / (na * nb) if na and nb else 0.0
+
+def _retrieve_hybrid(vector, session, k) -> List[Dict[str, Any]]:
+    records = session.run(
+        HYBRID_QUERY.format(hops=int(GRAPH_HOPS)),
+        index=VECTOR_INDEX.get(session), k=k, vector=vector,
+        limit=HYBRID_CANDIDATES, facts_per_chunk=FACTS_PER_CHUNK,
+    )
+    sources = []
+    for r in records:
+        # Итоговый score: точное косинусное сходство с вопросом + близость по графу
+        similarity = cosine(vector, r["embedding"] or [])
+        proximity = float(r["proximity"] or 0.0)
+        src = _to_source(r, HYBRID_ALPHA * similarity + (1 - HYBRID_ALPHA) * proximity)
+        src["facts"] = [f for f in (r["facts"] or []) if f]
+        src["via_graph"] = not r["is_seed"]
+        sources.append(src)
+    sources.sort(key=lambda s: s["score"], reverse=True)
+    return sources[:HYBRID_MAX_SOURCES]
+
+def _retrieve_local(vectors, session, k, fallback: bool = True) -> List[List[Dict[str, Any]]]:
+    index = get_local_index()
+    if not len(index) and fallback:
+        # Индекс ещё не собран: молча отвечать "ничего не найдено" хуже, чем искать в Memgraph
+        global _local_empty_warned
+        if not _local_empty_warned:
+            _local_empty_warned = True
+            print("⚠️ Локальный индекс пуст (python src/local_search.py --rebuild), ищу в индексе Memgraph.")
+        return [_retrieve_memgraph(v, session, k) for v in vectors]
+    return [fetch_chunks(session, hits) for hits in index.search(vectors, k)]
+
+def _retrieve_memgraph(vector, session, k) -> List[Dict[str, Any]]:
+    if RETRIEVAL_MODE == "hybrid":
+        return _retrieve_hybrid(vector, session, k)
+    return _retrieve_index(vector, session, k)
+
+def retrieve(vector: List[float], session=None, k: int = TOP_K) -> List[Dict[str, Any]]:
+    """Векторный поиск по чанкам; возвращает список источников со связанными сущностями."""
+    if session is None:
+        with get_driver().session() as own_session:
+            return retrieve(vector, own_session, k)
+
+    with METRICS.span("query.retrieve", backend=RETRIEVAL_BACKEND, mode=RETRIEVAL_MODE):
+        return _retrieve(vector, session, k)
+
+def _retrieve(vector, session, k) -> List[Dict[str, Any]]:
+    if RETRIEVAL_BACKEND == "local":
+        return _retrieve_local([vector], session, k)[0]
+    try:
+        sources = _retrieve_memgraph(vector, session, k)
+    except Exception as e:
+        if RETRIEVAL_BACKEND != "auto":
+            raise
+        print(f"⚠️ Векторный индекс Memgraph недоступен ({e}), ищу локально.")
+        sources = []
+    if not sources and RETRIEVAL_BACKEND == "auto":
+        return _retrieve_local([vector], session, k, fallback=False)[0]
+    return sources
+
+def retrieve_many(vectors: List[List[float]], session, k: int = TOP_K) -> List[List[Dict[str, Any]]]:
+    """Поиск для пачки вопросов; локальный движок считает все запросы одним умножением матриц."""
+    if RETRIEVAL_BACKEND == "local":
+        with METRICS.span("query.retrieve_many", backend=RETRIEVAL_BACKEND):
+            return _retrieve_local(vectors, session, k)
+    return [retrieve(v, session, k) for v in vectors]
+
+def build_context(sources: List[Dict[str, Any]]) -> str:
+    # Ограниченный бюджетом токенов и без повторов контекст: меньше латентность и цена генерации
+    return assemble_context(sources)
+
+def answer(question: str, session=None) -> Dict[str, Any]:
+    """Полный цикл RAG без печати: вопрос -> вектор -> поиск -> ответ LLM."""
+    with METRICS.span("query.answer"):
+        return _answer(question, session)
+
+def _answer(question: str, session=None) -> Dict[str, Any]:
+    vector = get_embedding(question)
+    hit = cached_answer(vector)
+    if hit is not None:
+        return {"question": question, "answer": hit["answer"], "sources": hit["sources"],
+                "cached": {"question": hit["cached_question"], "similarity": hit["similarity"]}}
+    sources = retrieve(vector, session)
+    result: Dict[str, Any] = {"question": question, "answer": None, "sources": sources}
+    if sources:
+        result["answer"] = generate_answer(question, build_context(sources))
+        remember_answer(question, vector, result["answer"], sources)
+    return result
+
 def search(question):
     print(f"\n🔎 Вопрос: {question}")
-    
+
     try:
         vector = get_embedding(question)
     except Exception as e:
         print(f"❌ Ошибка создания эмбеддинга: {e}")
         return
 
-    driver = GraphDatabase.driver(MEMGRAPH_URI, auth=MEMGRAPH_AUTH)
-    
-    with driver.session() as session:
-        # Вектор конвертирую в строку JSON
-        vec_str = json.dumps(vector)
-        
-        # Запрос с OPTIONAL MATCH для защиты от отсутствующих связей
-        query = f"""
-        CALL vector_search.search('chunk_vector_index', 3, {vec_str}) 
-        YIELD node, score
-        OPTIONAL MATCH (node)-[:MENTIONS]->(e:Entity)
-        RETURN node.text as text, score, collect(e.id) as entities
-        """
-        
-        try:
-            result = session.run(query)
-            records = list(result)
-        except Exception as e:
-            print(f"❌ Ошибка Memgraph: {e}")
-            return
-        
-        if not records:
-            print("⚠️ Ничего не найдено.")
-            return
-
-        print(f"✅ Найдено источников: {len(records)}\n")
-        
-        context_text = ""
-        for i, r in enumerate(records):
-            # --- ИСПРАВЛЕНИЕ ОШИБКИ SCORE ---
-            raw_score = r.get('score')
-            if raw_score is None:
-                score_display = "N/A"
-            else:
-                try:
-                    score_display = f"{float(raw_score):.4f}"
-                except:
-                    score_display = str(raw_score)
-            # --------------------------------
-            
-            text = r.get('text', "")
-            # Обработка списка сущностей (может быть [None] из-за OPTIONAL MATCH)
-            ent_list = r.get('entities', [])
-            valid_entities = [str(e) for e in ent_list if e is not None]
-            entities_str = ', '.join(valid_entities) if valid_entities else "(Нет связей)"
-            
-            print(f"--- Источник {i+1} (Score: {score_display}) ---")
-            print(f"🔗 Сущности: {entities_str}")
-            print(f"📄 Текст: {text[:100].replace(chr(10), ' ')}...")
-            
-            context_text += f"Source {i+1}:\nText: {text}\nEntities: {entities_str}\n\n"
-
-        print("\n🧠 Генерирую ответ...")
-        try:
-            answer = generate_answer(question, context_text)
-            print("\n" + "="*20 + " ОТВЕТ " + "="*20)
-            print(answer)
-            print("="*47)
-        except Exception as e:
-            print(f"❌ Ошибка генерации ответа: {e}")
-
-    driver.close()
+    hit = cached_answer(vector)
+    if hit is not None:
+        print(f"⚡ Ответ из кэша (похожий вопрос: «{hit['cached_question']}», сходство {hit['similarity']:.4f})")
+        print_answer(hit["answer"])
+        return
+
+    try:
+        sources = retrieve(vector)
+    except Exception as e:
+        print(f"❌ Ошибка Memgraph: {e}")
+        return
+
+    if not sources:
+        print("⚠️ Ничего не найдено.")
+        return
+
+    print(f"✅ Найдено источников: {len(sources)}\n")
+
+    for i, src in enumerate(sources):
+        entities_str = ', '.join(src["entities"]) if src["entities"] else "(Нет связей)"
+        print(f"--- Источник {i+1} (Score: {format_score(src['score'])}) ---")
+        print(f"🔗 Сущности: {entities_str}")
+        print(f"📄 Текст: {src['text'][:100].replace(chr(10), ' ')}...")
+
+    print("\n🧠 Генерирую ответ...")
+    try:
+        answer_text = generate_answer(question, build_context(sources))
+        remember_answer(question, vector, answer_text, sources)
+        print_answer(answer_text)
+    except Exception as e:
+        print(f"❌ Ошибка генерации ответа: {e}")
+
+def print_answer(answer_text: str):
+    print("\n" + "="*20 + " ОТВЕТ " + "="*20)
+    print(answer_text)
+    print("="*47)
 
 if __name__ == "__main__":
     search("What is the main topic of the finice document?")
+    close()
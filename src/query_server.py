@@ -0,0 +1,169 @@
+import os
+import json
+import socket
+import asyncio
+import argparse
+import http.client
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Tuple
+
+# --- КОНФИГУРАЦИЯ ---
+QUERY_SERVER_HOST = os.getenv("QUERY_SERVER_HOST", "127.0.0.1")
+QUERY_SERVER_PORT = int(os.getenv("QUERY_SERVER_PORT", "8765"))
+# Если задан путь, сервер слушает Unix-сокет вместо TCP
+QUERY_SERVER_SOCKET = os.getenv("QUERY_SERVER_SOCKET", "")
+QUERY_SERVER_CONCURRENCY = int(os.getenv("QUERY_SERVER_CONCURRENCY", "16"))
+QUERY_SERVER_TIMEOUT = float(os.getenv("QUERY_SERVER_TIMEOUT", "120"))
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 500: "Internal Server Error"}
+
+
+# ---------------- Клиент (только stdlib, без тяжёлых импортов) ----------------
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path: str, timeout: float = QUERY_SERVER_TIMEOUT):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+def request(method: str, path: str, payload: Any = None) -> Dict[str, Any]:
+    """HTTP-запрос к серверу; бросает ConnectionError/FileNotFoundError, если сервер не запущен."""
+    if QUERY_SERVER_SOCKET:
+        conn = UnixHTTPConnection(QUERY_SERVER_SOCKET)
+    else:
+        conn = http.client.HTTPConnection(QUERY_SERVER_HOST, QUERY_SERVER_PORT, timeout=QUERY_SERVER_TIMEOUT)
+    try:
+        body = json.dumps(payload).encode("utf-8") if payload is not None else None
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        conn.request(method, path, body=body, headers=headers)
+        resp = conn.getresponse()
+        data = json.loads(resp.read().decode("utf-8") or "{}")
+        if resp.status != 200:
+            raise RuntimeError(data.get("error", f"HTTP {resp.status}"))
+        return data
+    finally:
+        conn.close()
+
+
+# ---------------- Сервер ----------------
+
+class QueryServer:
+    """Долгоживущий сервис вопросов: один пул соединений Memgraph, прогретые модели и кэши."""
+
+    def __init__(self, concurrency: int = QUERY_SERVER_CONCURRENCY):
+        # Импорт здесь: клиенту (ask.py) не нужны genai и neo4j
+        import query
+        self.query = query
+        self.query.get_driver().verify_connectivity()
+        self.query.get_qa_model()
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="query")
+        self.slots = asyncio.Semaphore(concurrency)
+        self.served = 0
+
+    async def _blocking(self, fn, *args):
+        async with self.slots:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, fn, *args)
+
+    async def route(self, method: str, path: str, body: bytes) -> Tuple[int, Dict[str, Any]]:
+        if method == "GET" and path == "/health":
+            return 200, {"status": "ok", "served": self.served}
+        if method == "GET" and path == "/metrics":
+            # Текстовый формат Prometheus; остальные ответы - JSON
+            from metrics import METRICS
+            return 200, METRICS.to_prometheus()
+        if method == "POST" and path == "/ask":
+            payload = json.loads(body or b"{}")
+            if not isinstance(payload, dict) or not isinstance(payload.get("question") or "", str):
+                return 400, {"error": "ожидается JSON-объект {\"question\": \"...\"}"}
+            question = (payload.get("question") or "").strip()
+            if not question:
+                return 400, {"error": "пустой вопрос"}
+            result = await self._blocking(self.query.answer, question)
+            self.served += 1
+            return 200, result
+        return 404, {"error": f"{method} {path} не найден"}
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = (await reader.readline()).decode("latin-1").strip()
+            if not request_line:
+                return
+            try:
+                method, path, _ = request_line.split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    key, _, value = line.decode("latin-1").partition(":")
+                    headers[key.strip().lower()] = value.strip()
+                length = int(headers.get("content-length", "0"))
+                if length < 0:
+                    raise ValueError(f"Content-Length {length}")
+            except ValueError as e:
+                # Битый запрос получает ответ, а не молча закрытый сокет
+                status, payload = 400, {"error": f"неверный HTTP-запрос: {e}"}
+            else:
+                body = await reader.readexactly(length)
+                try:
+                    status, payload = await self.route(method, path, body)
+                except (json.JSONDecodeError, UnicodeDecodeError) as e:
+                    status, payload = 400, {"error": f"неверный JSON: {e}"}
+                except Exception as e:
+                    status, payload = 500, {"error": str(e)}
+
+            if isinstance(payload, str):
+                data, content_type = payload.encode("utf-8"), "text/plain; version=0.0.4"
+            else:
+                data = json.dumps(payload, ensure_ascii=False, default=str).encode("utf-8")
+                content_type = "application/json"
+            writer.write(
+                f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+                f"Content-Type: {content_type}; charset=utf-8\r\n"
+                f"Content-Length: {len(data)}\r\n"
+                f"Connection: close\r\n\r\n".encode("latin-1") + data
+            )
+            await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionResetError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self):
+        if QUERY_SERVER_SOCKET:
+            if os.path.exists(QUERY_SERVER_SOCKET):
+                os.remove(QUERY_SERVER_SOCKET)
+            server = await asyncio.start_unix_server(self.handle, path=QUERY_SERVER_SOCKET)
+            where = QUERY_SERVER_SOCKET
+        else:
+            server = await asyncio.start_server(self.handle, QUERY_SERVER_HOST, QUERY_SERVER_PORT)
+            where = f"http://{QUERY_SERVER_HOST}:{QUERY_SERVER_PORT}"
+        print(f"🚀 Сервер вопросов слушает {where}")
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        from metrics import METRICS
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.query.close()
+        METRICS.export()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Долгоживущий сервер вопросов к графу знаний")
+    parser.add_argument("--concurrency", type=int, default=QUERY_SERVER_CONCURRENCY)
+    args = parser.parse_args()
+
+    srv = QueryServer(args.concurrency)
+    try:
+        asyncio.run(srv.serve())
+    except KeyboardInterrupt:
+        print("\n🛑 Остановка сервера.")
+    finally:
+        srv.close()
@@ -0,0 +1,155 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+from typing import Any, Dict, List, Optional
+
+from embeddings import EmbeddingService, EmbeddingCache
+from index_manager import EMBEDDING_MODEL, EMBEDDING_DIMENSIONS, index_bytes_per_vector
+from local_search import LocalVectorIndex, QUANTIZATIONS, QUANT_OVERSAMPLE
+from metrics import percentiles
+from workers import ModelScheduler, EMBEDDING_CONCURRENCY, EMBEDDING_RPM, EMBEDDING_TPM
+
+# Сравнение уменьшенной размерности и квантования с полным вектором на собственных данных:
+# выборка чанков из Memgraph векторизуется в каждой размерности (векторы кэшируются, повторный
+# прогон бесплатен), а recall@k считается относительно точного поиска по полным float32 векторам.
+
+# --- КОНФИГУРАЦИЯ ---
+REPORT_SAMPLE = int(os.getenv("REPORT_SAMPLE", "2000"))
+REPORT_QUERIES = int(os.getenv("REPORT_QUERIES", "200"))
+REPORT_DIMS = os.getenv("REPORT_DIMS", "768,512,256,128")
+REPORT_K = int(os.getenv("REPORT_K", "10"))
+# Без файла вопросов вопросом служит начало чанка из выборки (столько слов)
+REPORT_QUESTION_WORDS = int(os.getenv("REPORT_QUESTION_WORDS", "12"))
+# Memgraph хранит компоненту списка-свойства как double
+PROPERTY_BYTES = 8
+
+SAMPLE_CHUNKS = """
+MATCH (c:Chunk)
+WHERE c.text IS NOT NULL
+RETURN c.id AS id, c.text AS text
+ORDER BY c.id
+LIMIT $limit
+"""
+
+
+def load_questions(path: str, limit: int) -> List[str]:
+    questions = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                questions.append(json.loads(line)["question"])
+            if len(questions) >= limit:
+                break
+    return questions
+
+
+def pseudo_questions(texts: List[str], limit: int, words: int = REPORT_QUESTION_WORDS) -> List[str]:
+    # Равномерно по выборке: ID чанков - хэши, так что порядок уже перемешан
+    step = max(1, len(texts) // max(1, limit))
+    return [" ".join(t.split()[:words]) for t in texts[::step][:limit] if t.strip()]
+
+
+def memory_per_chunk(dimension: int, quantization: str) -> Dict[str, Any]:
+    memgraph = dimension * PROPERTY_BYTES + index_bytes_per_vector(dimension)
+    codes = {"none": dimension * 4, "int8": dimension + 4, "binary": (dimension + 7) // 8 + 4}[quantization]
+    return {
+        "memgraph_bytes_per_chunk": memgraph,
+        "chunks_per_gb": int(2 ** 30 / memgraph),
+        # Что держит в RAM локальный индекс при поиске (без квантования - вся float32 матрица)
+        "local_ram_bytes_per_chunk": codes,
+    }
+
+
+def run_report(driver, client, dims: List[int], quantizations: List[str], sample: int = REPORT_SAMPLE,
+               queries: int = REPORT_QUERIES, k: int = REPORT_K, questions_path: Optional[str] = None,
+               model: str = EMBEDDING_MODEL, oversample: int = QUANT_OVERSAMPLE,
+               cache: Optional[EmbeddingCache] = None) -> Dict[str, Any]:
+    native = EMBEDDING_DIMENSIONS.get(model) or max(dims)
+    with driver.session() as session:
+        rows = [dict(r) for r in session.run(SAMPLE_CHUNKS, limit=sample)]
+    if not rows:
+        raise ValueError("в базе нет чанков: сначала загрузите документы (python src/main.py)")
+    ids, texts = [r["id"] for r in rows], [r["text"] for r in rows]
+    questions = load_questions(questions_path, queries) if questions_path else pseudo_questions(texts, queries)
+    print(f"📊 Выборка: {len(ids)} чанков, {len(questions)} вопросов, k={k}")
+
+    cache = cache or EmbeddingCache()
+    # Один планировщик на все размерности: отчёт не должен превышать лимиты модели
+    scheduler = ModelScheduler(model, EMBEDDING_CONCURRENCY, EMBEDDING_RPM, EMBEDDING_TPM)
+    workdir = tempfile.mkdtemp(prefix="recall-report-")
+    truth: List[set] = []
+    configs = []
+    try:
+        # Полная размерность идёт первой: её точный поиск - эталон для всех остальных
+        for dim in [native] + [d for d in dims if d != native]:
+            embedder = EmbeddingService(model, cache=cache, scheduler=scheduler, client=client,
+                                        dimensions=0 if dim == native else dim)
+            vectors = embedder.embed_documents(texts)
+            query_vectors = embedder.embed(questions, "retrieval_query")
+            kinds = ["none"] + [q for q in quantizations if q != "none"] if dim == native else quantizations
+            for kind in kinds:
+                index = LocalVectorIndex(os.path.join(workdir, f"{dim}-{kind}"), quantization=kind,
+                                         oversample=oversample)
+                index.add(ids, vectors)
+                latencies, found = [], []
+                for vector in query_vectors:
+                    started = time.perf_counter()
+                    hits = index.search([vector], k)[0]
+                    latencies.append(time.perf_counter() - started)
+                    found.append({cid for cid, _ in hits})
+                if not truth:
+                    truth = found
+                recall = sum(len(f & t) / max(1, len(t)) for f, t in zip(found, truth)) / max(1, len(truth))
+                config = {"dimension": dim, "quantization": kind, "recall_at_k": round(recall, 4),
+                          "latency": percentiles(latencies)}
+                config.update(memory_per_chunk(dim, kind))
+                configs.append(config)
+                print(f"   {dim:>5} {kind:<7} recall@{k}={recall:.3f}  p50={config['latency']['p50_ms']}мс  "
+                      f"чанков на ГБ Memgraph: {config['chunks_per_gb']}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "model": model,
+        "baseline_dimension": native,
+        "sample_chunks": len(ids),
+        "questions": len(questions),
+        "k": k,
+        "oversample": oversample,
+        "configs": configs,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Recall и задержка поиска с уменьшенной размерностью и квантованием против полного вектора")
+    parser.add_argument("--sample", type=int, default=REPORT_SAMPLE, help="Чанков в выборке")
+    parser.add_argument("--queries", type=int, default=REPORT_QUERIES, help="Число вопросов")
+    parser.add_argument("--questions", help="JSONL с полем question (как у ask.py --batch)")
+    parser.add_argument("--dims", default=REPORT_DIMS, help="Размерности через запятую")
+    parser.add_argument("--quant", default=",".join(QUANTIZATIONS), help="Квантования через запятую")
+    parser.add_argument("-k", type=int, default=REPORT_K)
+    parser.add_argument("--oversample", type=int, default=QUANT_OVERSAMPLE)
+    parser.add_argument("--output", help="Куда сохранить JSON-отчёт")
+    args = parser.parse_args()
+
+    import query
+    report = run_report(
+        query.get_driver(), query.genai,
+        dims=[int(d) for d in args.dims.split(",") if d.strip()],
+        quantizations=[q.strip() for q in args.quant.split(",") if q.strip()],
+        sample=args.sample, queries=args.queries, k=args.k, questions_path=args.questions,
+        oversample=args.oversample, cache=query.embedder.cache,
+    )
+    query.close()
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"💾 Отчёт сохранён: {args.output}")
+    else:
+        json.dump(report, sys.stdout, indent=2, ensure_ascii=False)
+        print()
@@ -20,26 +20,33 @@ def reset_db():
         print("🧹 Полная очистка базы...")
         # Удаляем данные
         session.run("MATCH (n) DETACH DELETE n")
+        # Ответы из кэша ссылаются на удалённые чанки
+        from answer_cache import AnswerCache
+        cache = AnswerCache()
+        print(f"🗑️ Кэш ответов очищен: {cache.clear()}")
+        cache.close()
+        # Канонические чанки для поиска дубликатов больше не существуют
+        from dedup import DedupIndex
+        index = DedupIndex()
+        index.clear()
+        index.close()
         
-        # Удаляем индекс (без IF EXISTS, так как наша версия его не поддерживает)
-        try:
-            session.run("DROP VECTOR INDEX chunk_vector_index")
-            print("🗑️ Старый индекс удален.")
-        except Exception:
-            pass # Игнорируем ошибку, если индекса не было
+        # Удаляем все версии векторного индекса (без IF EXISTS, так как наша версия его не поддерживает)
+        from index_manager import drop_all, init_index
+        for name in drop_all(session):
+            print(f"🗑️ Старый индекс {name} удален.")
 
         print("🔧 Создание векторного индекса...")
         try:
-            # Добавил 'capacity': 10000 - это помогает выделить память заранее
-            session.run("""
-            CREATE VECTOR INDEX chunk_vector_index ON :Chunk(embedding) 
-            WITH CONFIG {"dimension": 768, "metric": "cos", "capacity": 10000}
-            """)
-            print("✅ Векторный индекс УСПЕШНО создан!")
+            # Размерность - по модели эмбеддингов, ёмкость - по VECTOR_INDEX_PROJECTED_CHUNKS с запасом:
+            # заранее выделенная память не перестраивается при росте базы
+            index = init_index(session)
+            print(f"✅ Векторный индекс УСПЕШНО создан! (dimension={index['dimension']}, capacity={index['capacity']})")
             
             # Обычные индексы
             session.run("CREATE INDEX ON :Entity(id);")
             session.run("CREATE INDEX ON :Document(id);")
+            session.run("CREATE INDEX ON :Chunk(id);")
             print("✅ Обычные индексы созданы.")
             
         except Exception as e:
@@ -0,0 +1,187 @@
+import os
+import sys
+import time
+import zlib
+import queue
+import multiprocessing as mp
+from typing import Any, Callable, Dict, List, Optional
+
+from ingest_stages import Stage, run_stages
+from graph_writer import GraphWriteBatcher
+from metrics import METRICS
+
+# Шардированная загрузка: файлы делятся между процессами по ID документа, каждый процесс со своим
+# пулом соединений читает, режет, ищет дубликаты, извлекает граф и считает эмбеддинги, а готовые
+# сегменты отдаёт в общую очередь. Пишет в граф один процесс-координатор: MERGE сущностей
+# не конфликтуют между собой, а разные написания сводит один EntityResolver.
+
+# --- КОНФИГУРАЦИЯ ---
+# Процессов-шардов (0 или 1 = загрузка в одном процессе)
+INGEST_SHARDS = int(os.getenv("INGEST_SHARDS", "0"))
+# Сегментов в очереди шарды -> координатор: ограничивает память, если запись отстаёт
+SHARD_QUEUE_SIZE = int(os.getenv("SHARD_QUEUE_SIZE", "16"))
+# Как часто координатор печатает сводный прогресс, секунды
+SHARD_PROGRESS_INTERVAL = float(os.getenv("SHARD_PROGRESS_INTERVAL", "10"))
+
+
+def shard_of(doc_id: str, shards: int) -> int:
+    # crc32, а не hash(): у hash() строк своя соль в каждом процессе
+    return zlib.crc32(doc_id.encode("utf-8")) % max(1, shards)
+
+
+def _shard_main(shard: int, shards: int, data_dir: str, incremental: bool, resume: bool,
+                dedup_run: Optional[str], out, make_clients: Optional[Callable] = None, quiet: bool = False):
+    """Процесс-шард: всё, кроме записи, для своей доли файлов; в конце - отчёт ("done", ...)."""
+    summary: Dict[str, Any] = {"shard": shard}
+    if quiet:
+        # Перенаправление stdout у координатора (бенчмарк) до дочернего процесса не доходит
+        sys.stdout = open(os.devnull, "w")
+    try:
+        # При запуске через main.py модуль уже загружен как __mp_main__ - не импортируем его второй раз
+        main = sys.modules.get("__mp_main__")
+        if not hasattr(main, "HybridGraphPipeline"):
+            import main
+        driver, client = make_clients() if make_clients is not None else (None, main.genai)
+        pipeline = main.HybridGraphPipeline(
+            main.MEMGRAPH_URI, main.MEMGRAPH_AUTH, incremental=incremental, resume=resume,
+            driver=driver, client=client, shard=(shard, shards), writer_queue=out, dedup_run=dedup_run)
+        METRICS.reset()
+        stages = pipeline.process_directory(data_dir) or []
+        cache = pipeline.extractor.cache
+        summary.update(
+            stages=[(s.name, s.workers, s.processed, s.failed, s.durations) for s in stages],
+            extraction_hits=cache.hits,
+            extraction_misses=cache.misses,
+            extraction_failures=pipeline.extractor.failures,
+            pack_fallbacks=pipeline.extractor.pack_fallbacks,
+            embedding_api_calls=pipeline.embedder.api_calls,
+            dedup=(pipeline.dedup.exact, pipeline.dedup.near, pipeline.dedup.unique)
+            if pipeline.dedup is not None else None,
+            metrics=METRICS.snapshot(),
+        )
+        pipeline.close()
+    except BaseException as e:
+        # SystemExit тоже: main.py выходит так при ошибке подключения
+        summary["error"] = f"{type(e).__name__}: {e}"
+    out.put(("done", shard, summary))
+
+
+class ShardProgress:
+    """Сводный прогресс шардов у координатора."""
+
+    def __init__(self, shards: int):
+        self.files = [0] * shards
+        self.segments = [0] * shards
+        self.chunks = [0] * shards
+        self.done: Dict[int, Dict[str, Any]] = {}
+        self.started = time.time()
+        self.printed = self.started
+
+    def line(self, documents: int) -> str:
+        elapsed = max(1e-9, time.time() - self.started)
+        return (f"📊 Шарды: завершено {len(self.done)}/{len(self.files)}, файлов {sum(self.files)} "
+                f"({', '.join(map(str, self.files))}), сегментов {sum(self.segments)}, чанков {sum(self.chunks)} "
+                f"({sum(self.chunks) / elapsed:.1f}/с), документов записано {documents}")
+
+
+def _segments(inbox, procs: List, progress: ShardProgress, pipeline):
+    """Сегменты из очереди шардов, пока каждый шард не отчитается (или не умрёт без отчёта)."""
+    while len(progress.done) < len(procs):
+        if time.time() - progress.printed >= SHARD_PROGRESS_INTERVAL:
+            progress.printed = time.time()
+            print(progress.line(pipeline.documents_written))
+        try:
+            kind, shard, payload = inbox.get(timeout=1.0)
+        except queue.Empty:
+            # Процесс, убитый без отчёта (OOM, kill), иначе ждали бы вечно
+            for n, proc in enumerate(procs):
+                if n not in progress.done and not proc.is_alive():
+                    progress.done[n] = {"shard": n, "error": f"процесс завершился с кодом {proc.exitcode}"}
+            continue
+        if kind == "segment":
+            progress.segments[shard] += 1
+            progress.chunks[shard] += len(payload["ready"])
+            yield payload
+        elif kind == "file":
+            progress.files[shard] += 1
+        elif kind == "done":
+            progress.done[shard] = payload
+
+
+def _absorb(pipeline, stages: Dict[str, Stage], summary: Dict[str, Any]):
+    """Счётчики шарда - в объекты координатора, чтобы итоги main.py и бенчмарка были общими."""
+    for name, workers, processed, failed, durations in summary.get("stages", []):
+        if name not in stages:
+            stages[name] = Stage(name, None, 0)
+            stages[name].workers = 0
+        stage = stages[name]
+        stage.workers += workers
+        stage.processed += processed
+        stage.failed += failed
+        stage.durations.extend(durations)
+    if "metrics" in summary:
+        METRICS.merge(summary["metrics"])
+    pipeline.extractor.cache.hits += summary.get("extraction_hits", 0)
+    pipeline.extractor.cache.misses += summary.get("extraction_misses", 0)
+    pipeline.extractor.failures += summary.get("extraction_failures", 0)
+    pipeline.extractor.pack_fallbacks += summary.get("pack_fallbacks", 0)
+    pipeline.embedder.api_calls += summary.get("embedding_api_calls", 0)
+    if pipeline.dedup is not None and summary.get("dedup"):
+        exact, near, unique = summary["dedup"]
+        pipeline.dedup.exact += exact
+        pipeline.dedup.near += near
+        pipeline.dedup.unique += unique
+
+
+def run_sharded(pipeline, data_dir: str, shards: int, make_clients: Optional[Callable] = None,
+                quiet: bool = False) -> List[Stage]:
+    """Загрузка папки shards процессами; pipeline (этот процесс) - единственный, кто пишет в граф.
+
+    make_clients - функция без аргументов (сериализуемая pickle), которая в процессе-шарде
+    возвращает (driver, client); по умолчанию - настоящие Memgraph и Gemini.
+    quiet - процессы-шарды ничего не печатают (бенчмарк выводит отчёт в stdout).
+    """
+    if not os.path.exists(data_dir):
+        print(f"❌ Папка '{data_dir}' не существует!")
+        return []
+    print(f"▶️ [5/6] Шардированная загрузка: {shards} процессов, запись - в координаторе...")
+    # spawn: дочерний процесс не наследует потоки, соединения и SQLite координатора
+    ctx = mp.get_context("spawn")
+    inbox = ctx.Queue(maxsize=max(1, SHARD_QUEUE_SIZE))
+    dedup_run = pipeline.dedup.run if pipeline.dedup is not None else None
+    procs = [
+        ctx.Process(target=_shard_main, name=f"shard-{n}",
+                    args=(n, shards, data_dir, pipeline.incremental, pipeline.resume, dedup_run, inbox, make_clients,
+                          quiet))
+        for n in range(shards)
+    ]
+    for proc in procs:
+        proc.start()
+
+    progress = ShardProgress(shards)
+    with pipeline.driver.session() as session:
+        writer = GraphWriteBatcher(session, resolver=pipeline.resolver, on_flush=pipeline._on_flush)
+        write = run_stages(_segments(inbox, procs, progress, pipeline),
+                           [Stage("write", lambda job: pipeline._write_stage(writer, job), 1)])
+        pipeline.abandon_unfinished()
+        pipeline._drain_retry_queue(writer)
+        pipeline._resolve_deferred_links(writer)
+    for proc in procs:
+        proc.join()
+    print(progress.line(pipeline.documents_written))
+
+    stages: Dict[str, Stage] = {}
+    for shard in sorted(progress.done):
+        summary = progress.done[shard]
+        if "error" in summary:
+            print(f"❌ Шард {shard}: {summary['error']} (его файлы дообработает повторный запуск)")
+        _absorb(pipeline, stages, summary)
+    stages = list(stages.values()) + write
+
+    failed = sum(stage.failed for stage in stages) + sum("error" in s for s in progress.done.values())
+    print(f"📄 Обработано файлов: {sum(progress.files)}, записано: {pipeline.documents_written}, ошибок: {failed}")
+    chunks = pipeline.checkpoint.stats()["chunks"]
+    if chunks.get("retry") or chunks.get("dead"):
+        print(f"🧾 Не записано чанков: в очереди повторов {chunks.get('retry', 0)}, "
+              f"в dead-letter {chunks.get('dead', 0)} (python src/checkpoint.py --dead)")
+    return stages
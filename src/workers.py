@@ -0,0 +1,119 @@
+import os
+import time
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Callable, Iterable, List, Any
+
+from metrics import METRICS, GEMINI_RETRIES, GEMINI_ERRORS, gemini_request
+
+# --- КОНФИГУРАЦИЯ ---
+# Параллельность и лимиты на модель (RPM - запросов в минуту, TPM - токенов в минуту, 0 = без лимита)
+EXTRACTION_CONCURRENCY = int(os.getenv("EXTRACTION_CONCURRENCY", "8"))
+EXTRACTION_RPM = int(os.getenv("EXTRACTION_RPM", "1000"))
+EXTRACTION_TPM = int(os.getenv("EXTRACTION_TPM", "1000000"))
+EMBEDDING_CONCURRENCY = int(os.getenv("EMBEDDING_CONCURRENCY", "8"))
+EMBEDDING_RPM = int(os.getenv("EMBEDDING_RPM", "1500"))
+EMBEDDING_TPM = int(os.getenv("EMBEDDING_TPM", "0"))
+# Генерация ответов на вопросы (query.py, batch_ask.py, сервер вопросов)
+QA_CONCURRENCY = int(os.getenv("QA_CONCURRENCY", "16"))
+QA_RPM = int(os.getenv("QA_RPM", "1000"))
+QA_TPM = int(os.getenv("QA_TPM", "1000000"))
+MAX_RETRIES = int(os.getenv("MAX_RETRIES", "5"))
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "1.0"))
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "60.0"))
+
+# HTTP-коды, при которых имеет смысл повторить запрос
+RETRYABLE_CODES = {429, 500, 502, 503, 504}
+
+
+def estimate_tokens(text: str) -> int:
+    # Грубая оценка: ~4 символа на токен, точность для лимитов не нужна
+    return max(1, len(text) // 4)
+
+
+def is_retryable(exc: Exception) -> bool:
+    # google.api_core.exceptions.* хранят HTTP-статус в .code
+    code = getattr(exc, "code", None)
+    return isinstance(code, int) and code in RETRYABLE_CODES
+
+
+class TokenBucket:
+    """Потокобезопасное ведро токенов с пополнением rate_per_minute в минуту."""
+
+    def __init__(self, rate_per_minute: int):
+        self.capacity = float(rate_per_minute)
+        self.tokens = float(rate_per_minute)
+        self.rate = rate_per_minute / 60.0
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, amount: float = 1):
+        if self.capacity <= 0:
+            return
+        # Запрос больше ёмкости ведра иначе ждал бы вечно
+        amount = min(float(amount), self.capacity)
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                wait = (amount - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class ModelScheduler:
+    """Ограничивает параллельность и темп вызовов одной модели, повторяет 429/5xx с экспоненциальной паузой."""
+
+    def __init__(self, name: str, concurrency: int, rpm: int = 0, tpm: int = 0,
+                 max_retries: int = MAX_RETRIES):
+        self.name = name
+        self.concurrency = max(1, concurrency)
+        self.slots = threading.BoundedSemaphore(self.concurrency)
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.max_retries = max_retries
+        self.retries = 0
+
+    def call(self, fn: Callable, *args, tokens: int = 0, **kwargs) -> Any:
+        attempt = 0
+        while True:
+            self.requests.acquire(1)
+            if tokens:
+                self.tokens.acquire(tokens)
+            with self.slots:
+                gemini_request(self.name, tokens)
+                try:
+                    return fn(*args, **kwargs)
+                except Exception as e:
+                    if attempt >= self.max_retries or not is_retryable(e):
+                        METRICS.inc(GEMINI_ERRORS, model=self.name)
+                        raise
+                    error = e
+            # Спим вне слота, чтобы не держать его во время паузы
+            delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * (2 ** attempt))
+            delay *= random.uniform(0.5, 1.0)
+            attempt += 1
+            self.retries += 1
+            METRICS.inc(GEMINI_RETRIES, model=self.name)
+            print(f"      ⏳ {self.name}: {error} — повтор #{attempt} через {delay:.1f}с")
+            time.sleep(delay)
+
+
+class WorkerPool:
+    """Пул потоков для сетевых стадий; результаты отдаются строго в порядке входа."""
+
+    def __init__(self, max_workers: int):
+        self.executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="ingest")
+
+    def submit_all(self, fn: Callable, items: Iterable) -> List[Future]:
+        return [self.executor.submit(fn, item) for item in items]
+
+    def map_ordered(self, fn: Callable, items: Iterable) -> List[Any]:
+        return [f.result() for f in self.submit_all(fn, items)]
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,20 @@
+import os
+import sys
+import tempfile
+
+# Тесты идут на фейковых Gemini и Memgraph (src/fakes.py), как бенчмарк; кэши и чекпоинт -
+# во временной папке. Конфигурация модулей читается при импорте, поэтому окружение задаётся здесь
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+sys.path.insert(0, SRC)
+
+_WORKDIR = tempfile.mkdtemp(prefix="rag-tests-")
+os.environ.setdefault("GEMINI_API_KEY", "tests")
+os.environ.setdefault("EMBEDDING_CACHE_PATH", os.path.join(_WORKDIR, "embeddings.sqlite"))
+os.environ.setdefault("EXTRACTION_CACHE_PATH", os.path.join(_WORKDIR, "extraction.sqlite"))
+os.environ.setdefault("LOCAL_INDEX_DIR", os.path.join(_WORKDIR, "local_index"))
+os.environ.setdefault("CHECKPOINT_PATH", os.path.join(_WORKDIR, "checkpoint.sqlite"))
+os.environ.setdefault("ANSWER_CACHE_PATH", os.path.join(_WORKDIR, "answers.sqlite"))
+os.environ.setdefault("DEDUP_PATH", os.path.join(_WORKDIR, "dedup.sqlite"))
+os.environ.setdefault("CONVERT_WORKERS", "0")
+for name in ("EXTRACTION_RPM", "EXTRACTION_TPM", "EMBEDDING_RPM", "EMBEDDING_TPM", "QA_RPM", "QA_TPM"):
+    os.environ.setdefault(name, "0")
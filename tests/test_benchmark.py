@@ -0,0 +1,25 @@
+import os
+import sys
+import json
+import subprocess
+
+from conftest import SRC
+
+
+def test_sharded_benchmark_prints_valid_json():
+    """Процессы-шарды не печатают в stdout: отчёт --output - годится как --baseline."""
+    env = dict(os.environ)
+    # У бенчмарка свои временные кэши
+    for name in ("EMBEDDING_CACHE_PATH", "EXTRACTION_CACHE_PATH", "LOCAL_INDEX_DIR", "CHECKPOINT_PATH",
+                 "ANSWER_CACHE_PATH", "DEDUP_PATH", "RAG_BENCH_WORKDIR"):
+        env.pop(name, None)
+    result = subprocess.run(
+        [sys.executable, os.path.join(SRC, "benchmark.py"), "--docs", "4", "--doc-words", "600",
+         "--queries", "2", "--shards", "2", "--output", "-"],
+        capture_output=True, text=True, env=env, timeout=300,
+    )
+
+    assert result.returncode == 0, result.stderr
+    report = json.loads(result.stdout)
+    assert report["config"]["shards"] == 2
+    assert report["ingest"]["documents"] == 4
@@ -0,0 +1,53 @@
+import random
+
+import main
+from fakes import FakeGenAI, FakeGraphDriver
+
+WORDS = ("memgraph gemini docling chunk graph entity relation vector index query answer stores builds "
+         "links reads writes returns uses the a of and to in is for with on that by from").split()
+
+
+def _sentences(count: int, seed: int):
+    rng = random.Random(seed)
+    return [" ".join(rng.choice(WORDS) for _ in range(rng.randint(8, 20))).capitalize() + "."
+            for _ in range(count)]
+
+
+def _ingest(driver, gemini, data_dir):
+    pipeline = main.HybridGraphPipeline(main.MEMGRAPH_URI, main.MEMGRAPH_AUTH, driver=driver, client=gemini)
+    try:
+        pipeline.process_directory(str(data_dir))
+    finally:
+        pipeline.close()
+
+
+def _graph_text(driver) -> str:
+    return " ".join(chunk["text"] for chunk in driver.graph.chunks.values())
+
+
+def test_appended_sentence_reaches_graph(tmp_path):
+    """Правка уже загруженного файла не считается почти-дубликатом своей прежней версии."""
+    driver, gemini = FakeGraphDriver(), FakeGenAI()
+    doc, text = tmp_path / "appended.txt", " ".join(_sentences(150, seed=1))
+    doc.write_text(text, encoding="utf-8")
+    _ingest(driver, gemini, tmp_path)
+
+    added = "Chonkie keeps the overlap between neighbouring windows so edited sentences stay searchable."
+    doc.write_text(text + " " + added, encoding="utf-8")
+    _ingest(driver, gemini, tmp_path)
+
+    assert added in _graph_text(driver)
+
+
+def test_prepended_paragraph_reaches_graph(tmp_path):
+    """Абзац в начале файла сдвигает все чанки, но новый текст всё равно записывается."""
+    driver, gemini = FakeGraphDriver(), FakeGenAI()
+    doc, text = tmp_path / "prepended.txt", " ".join(_sentences(150, seed=2))
+    doc.write_text(text, encoding="utf-8")
+    _ingest(driver, gemini, tmp_path)
+
+    added = "Neo4j drivers talk to Memgraph over bolt and the resolver merges spellings of one entity."
+    doc.write_text(added + "\n\n" + text, encoding="utf-8")
+    _ingest(driver, gemini, tmp_path)
+
+    assert added in _graph_text(driver)
@@ -0,0 +1,25 @@
+from embeddings import EmbeddingCache, EmbeddingService, text_hash
+from fakes import FakeGenAI
+
+
+def test_cache_partial_hit(tmp_path):
+    """В одной пачке найденный в кэше и новый текст: найденный возвращается, новый - нет."""
+    cache = EmbeddingCache(str(tmp_path / "embeddings.sqlite"))
+    cache.put_many("model", "retrieval_document", {text_hash("cached"): [0.5, 0.25]})
+
+    found = cache.get_many("model", "retrieval_document", [text_hash("cached"), text_hash("new")])
+
+    assert found == {text_hash("cached"): [0.5, 0.25]}
+    cache.close()
+
+
+def test_embed_mixes_cached_and_uncached(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "embeddings.sqlite"))
+    embedder = EmbeddingService("models/text-embedding-004", cache=cache, client=FakeGenAI())
+    first = embedder.embed_documents(["Memgraph stores the graph."])
+
+    vectors = embedder.embed_documents(["Memgraph stores the graph.", "Gemini answers the question."])
+
+    assert vectors[0] == first[0]
+    assert len(vectors[1]) == len(first[0])
+    embedder.close()